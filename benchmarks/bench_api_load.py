@@ -0,0 +1,68 @@
+import time
+import argparse
+import statistics
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Test de charge local de l'API : des clients concurrents appellent les routes de lecture,
+# pendant que d'autres envoient des requêtes lentes (toutes les observations d'une ville
+# depuis MySQL). On mesure le débit global et la latence de /health sous cette charge :
+# avec des routes qui bloquent la boucle d'événements, /health attend les requêtes lentes.
+# Usage : python benchmarks/bench_api_load.py --url http://localhost:8000 --city PARIS-MONTSOURIS
+
+def get(url):
+    """Durée (s) et code HTTP d'un GET."""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=300) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = None
+    return time.perf_counter() - start, status
+
+def run(urls, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(get, urls))
+
+def summary(name, results, elapsed=None):
+    latencies = sorted(duration * 1000 for duration, _status in results)
+    errors = sum(1 for _duration, status in results if status != 200)
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    line = f"{name:<18} : {len(results)} requêtes, médiane {statistics.median(latencies):8.1f} ms, p95 {p95:8.1f} ms, max {latencies[-1]:8.1f} ms"
+    if elapsed:
+        line += f", {len(results) / elapsed:,.1f} requêtes/s"
+    if errors:
+        line += f", {errors} erreurs"
+    print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test de charge des routes de lecture de l'API.")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--city", required=True, help="Ville de /staging/cities/{city} (requête lente) et /curated/cities/{city}.")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--slow", type=int, default=8, help="Requêtes lentes simultanées pendant la mesure de /health.")
+    args = parser.parse_args()
+
+    base = args.url.rstrip("/")
+    city = urllib.parse.quote(args.city)
+    routes = ["/health", "/staging/cities", "/curated/cities", f"/curated/cities/{city}?granularity=monthly"]
+
+    # 1. Débit des routes de lecture rapides sous accès concurrents
+    urls = [base + routes[i % len(routes)] for i in range(args.requests)]
+    start = time.perf_counter()
+    results = run(urls, args.concurrency)
+    summary("lectures mixtes", results, time.perf_counter() - start)
+
+    # 2. Latence de /health seule, puis pendant des requêtes lentes
+    summary("/health au repos", run([base + "/health"] * 50, 4))
+    with ThreadPoolExecutor(max_workers=args.slow) as slow_executor:
+        slow = [slow_executor.submit(get, f"{base}/staging/cities/{city}") for _ in range(args.slow)]
+        time.sleep(0.2)  # Laisse les requêtes lentes démarrer
+        summary("/health en charge", run([base + "/health"] * 50, 4))
+        summary("requêtes lentes", [future.result() for future in slow])
@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+import pymongo
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from curated_store import TIMESERIES_COLLECTION, ensure_curated_indexes, ensure_timeseries_collection
+
+# Latence des lectures de la zone curated sur un jeu de données synthétique pluriannuel
+# (un document par ville et par jour), dans une base de test supprimée à la fin :
+#   sans index      : collection simple, seul l'index _id (parcours complet à chaque lecture)
+#   index           : index unique (city, period) de ensure_curated_indexes
+#   time-series     : collection time-series (méta city, temps date) de ensure_timeseries_collection
+# Lectures mesurées : toutes les données d'une ville, puis une année d'une ville.
+# Usage : python benchmarks/bench_curated_lookup.py --host localhost --cities 40 --years 10
+
+BENCH_DATABASE = "_bench_curated"
+
+def daily_documents(cities, years):
+    first_day = datetime(2024 - years, 1, 1)
+    for city in cities:
+        for offset in range(365 * years):
+            day = first_day + timedelta(days=offset)
+            temperature = round(random.uniform(-5, 30), 3)
+            yield {
+                "city": city,
+                "period": day.strftime("%Y-%m-%d"),
+                "date": day,
+                "metrics": {
+                    "temperature": {"avg": temperature, "min": temperature - 4, "max": temperature + 4},
+                    "rainfall": {"total": round(random.uniform(0, 10), 3), "hours_with_rain": random.randint(0, 24)},
+                },
+            }
+
+def city_query(city, year, timeseries):
+    if year is None:
+        return {"city": city}
+    if timeseries:
+        return {"city": city, "date": {"$gte": datetime(year, 1, 1), "$lt": datetime(year + 1, 1, 1)}}
+    return {"city": city, "period": {"$gte": f"{year}-01-01", "$lt": f"{year + 1}-01-01"}}
+
+def measure(collection, cities, years, lookups, timeseries=False):
+    """Latences (ms) de lookups lectures aléatoires, par ville entière puis par année."""
+    results = {}
+    for label, with_year in [("ville", False), ("ville + année", True)]:
+        latencies = []
+        for _ in range(lookups):
+            year = random.choice(years) if with_year else None
+            start = time.perf_counter()
+            list(collection.find(city_query(random.choice(cities), year, timeseries), {"_id": 0}))
+            latencies.append((time.perf_counter() - start) * 1000)
+        results[label] = latencies
+    return results
+
+def winning_stage(collection, query):
+    plan = collection.find(query).explain()["queryPlanner"]["winningPlan"]
+    while "inputStage" in plan:
+        plan = plan["inputStage"]
+    return plan.get("stage", "?")
+
+def report(name, results, stage):
+    for label, latencies in results.items():
+        latencies = sorted(latencies)
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        print(f"{name:<12} {label:<14} : médiane {statistics.median(latencies):8.2f} ms, p95 {p95:8.2f} ms ({stage})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latence des lectures curated sans index, avec index et en time-series.")
+    parser.add_argument("--host", default="mongodb")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--cities", type=int, default=40)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--lookups", type=int, default=50)
+    parser.add_argument("--no-timeseries", action="store_true", help="Ne mesure pas la collection time-series.")
+    args = parser.parse_args()
+
+    random.seed(0)
+    cities = [f"Station_{i:03d}" for i in range(args.cities)]
+    years = list(range(2024 - args.years, 2024))
+    documents = list(daily_documents(cities, args.years))
+    print(f"{len(documents)} documents ({args.cities} villes x {args.years} ans)")
+
+    client = pymongo.MongoClient(host=args.host, port=args.port)
+    client.drop_database(BENCH_DATABASE)
+    mongo_db = client[BENCH_DATABASE]
+    try:
+        collection = mongo_db["WeatherStats"]
+        collection.insert_many([{key: value for key, value in doc.items() if key != "date"} for doc in documents])
+        sample = {"city": cities[0]}
+
+        report("sans index", measure(collection, cities, years, args.lookups), winning_stage(collection, sample))
+        ensure_curated_indexes(collection)
+        report("index", measure(collection, cities, years, args.lookups), winning_stage(collection, sample))
+
+        if not args.no_timeseries:
+            series = ensure_timeseries_collection(mongo_db)
+            series.insert_many([{key: value for key, value in doc.items() if key != "period"} for doc in documents])
+            report("time-series", measure(series, cities, years, args.lookups, timeseries=True),
+                   winning_stage(series, sample))
+            stats = mongo_db.command("collStats", TIMESERIES_COLLECTION)
+            print(f"time-series : {stats.get('timeseries', {}).get('bucketCount', '?')} buckets, "
+                  f"{stats['storageSize'] / (1024 * 1024):.1f} Mo sur disque "
+                  f"(collection simple : {mongo_db.command('collStats', 'WeatherStats')['storageSize'] / (1024 * 1024):.1f} Mo)")
+    finally:
+        client.drop_database(BENCH_DATABASE)
+        client.close()
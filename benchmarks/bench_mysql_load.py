@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+import argparse
+
+import pandas as pd
+import pymysql
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from mysql_loader import LOAD_MODES, BATCH_SIZE, create_staging_table, load_csv_file, load_dataframe
+
+# Débit de chargement d'un CSV de staging dans MySQL (lignes/seconde) pour chaque mode
+# de mysql_loader. Chaque mode charge le fichier dans une table de test recréée à vide.
+# Usage : python benchmarks/bench_mysql_load.py data/staging/PARIS_MONTSOURIS.csv --host localhost
+
+BENCH_TABLE = "_bench_load"
+
+def reset_table(cursor):
+    cursor.execute(f"DROP TABLE IF EXISTS staging.`{BENCH_TABLE}`;")
+    create_staging_table(cursor, BENCH_TABLE, track_changes=False)
+
+def run_mode(conn, mode, csv_path, batch_size):
+    cursor = conn.cursor()
+    reset_table(cursor)
+    start = time.perf_counter()
+    if mode == "infile":
+        load_csv_file(cursor, BENCH_TABLE, csv_path)
+    else:
+        df = pd.read_csv(csv_path, dtype={"cod_tend": str, "ww": str}, low_memory=False)
+        load_dataframe(cursor, BENCH_TABLE, df, mode, batch_size=batch_size)
+    conn.commit()
+    elapsed = time.perf_counter() - start
+    cursor.execute(f"SELECT COUNT(*) FROM staging.`{BENCH_TABLE}`;")
+    rows = cursor.fetchone()[0]
+    cursor.close()
+    return rows, elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare les modes de chargement MySQL de la zone staging.")
+    parser.add_argument("csv_path", help="CSV de staging (une ville).")
+    parser.add_argument("--host", default="mysql")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--modes", nargs="+", choices=LOAD_MODES, default=LOAD_MODES)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    conn = pymysql.connect(host=args.host, port=args.port, user="root", password="root",
+                           database="staging", local_infile=True)
+    try:
+        for mode in args.modes:
+            rows, elapsed = run_mode(conn, mode, args.csv_path, args.batch_size)
+            print(f"{mode:<12} : {rows} lignes en {elapsed:.2f} s -> {rows / elapsed:,.0f} lignes/s")
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS staging.`{BENCH_TABLE}`;")
+        conn.close()
@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import argparse
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from raw_format import iter_records
+from synop import COLUMNS_USED
+from staging_writer import split_by_station
+
+# Micro-benchmark du découpage par station d'un export mensuel :
+# ancienne boucle (un masque booléen par station) contre split_by_station.
+# Usage : python benchmarks/bench_split_by_station.py data/raw/2023/12/2023-12.ndjson.gz
+
+def split_with_masks(df):
+    """Ancienne implémentation : un masque et une copie par station."""
+    for nom in df['nom'].unique():
+        yield nom, df[df['nom'] == nom]
+
+def best_time(func, df, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _nom, _df_nom in func(df):
+            pass
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare les deux façons de découper un export par station.")
+    parser.add_argument("file_path", help="Export raw local (JSON ou NDJSON, gzip ou non).")
+    parser.add_argument("--repeat", type=int, default=5, help="Nombre de répétitions (on garde la meilleure).")
+    args = parser.parse_args()
+
+    df = pd.DataFrame(list(iter_records(args.file_path)))
+    df = df[[col for col in COLUMNS_USED if col in df.columns]]
+    print(f"{len(df)} lignes, {df['nom'].nunique()} stations")
+
+    # Les deux implémentations doivent produire les mêmes lignes par station
+    expected = {nom: part.index.tolist() for nom, part in split_with_masks(df)}
+    actual = {nom: part.index.tolist() for nom, part in split_by_station(df)}
+    assert expected == actual, "Les découpages diffèrent"
+
+    old = best_time(split_with_masks, df, args.repeat)
+    new = best_time(split_by_station, df, args.repeat)
+    print(f"Masque par station : {old * 1000:.1f} ms")
+    print(f"split_by_station   : {new * 1000:.1f} ms")
+    print(f"Accélération       : x{old / new:.1f}")
@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import pandas as pd
+import pymysql
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from raw_format import iter_records
+from synop import COLUMNS_USED, station_table_name
+from staging_writer import StationArrowWriter, StationCsvWriter, split_by_station
+from mysql_loader import create_staging_table, load_arrow, load_dataframe
+
+# Compare les deux chemins raw -> MySQL sur des exports locaux :
+#   csv    : DataFrame -> CSV par station sur disque -> pd.read_csv -> MySQL
+#   direct : DataFrame -> tables Arrow en mémoire -> MySQL (--staging-format direct)
+# Chaque chemin charge des tables de test vides, supprimées à la fin.
+# Usage : python benchmarks/bench_staging_direct.py data/raw/2023/12/2023-12.ndjson.gz --host localhost
+
+BENCH_PREFIX = "_bench_"
+
+def bench_table(city):
+    return f"{BENCH_PREFIX}{city}"
+
+def reset_tables(cursor, cities):
+    for city in cities:
+        cursor.execute(f"DROP TABLE IF EXISTS staging.`{bench_table(city)}`;")
+        create_staging_table(cursor, bench_table(city), track_changes=False)
+
+def feed(writer, df):
+    for nom, df_nom in split_by_station(df):
+        writer.add(nom, df_nom)
+
+def run_csv(cursor, df, load_mode):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with StationCsvWriter(tmp_dir, station_table_name) as writer:
+            feed(writer, df)
+        for csv_file in os.listdir(tmp_dir):
+            df_city = pd.read_csv(os.path.join(tmp_dir, csv_file), dtype={"cod_tend": str, "ww": str}, low_memory=False)
+            load_dataframe(cursor, bench_table(os.path.splitext(csv_file)[0]), df_city, load_mode)
+
+def run_direct(cursor, df, load_mode):
+    def load(city, table):
+        load_arrow(cursor, bench_table(city), table, load_mode)
+    with StationArrowWriter(None, station_table_name, load=load) as writer:
+        feed(writer, df)
+
+def count_rows(cursor, cities):
+    total = 0
+    for city in cities:
+        cursor.execute(f"SELECT COUNT(*) FROM staging.`{bench_table(city)}`;")
+        total += cursor.fetchone()[0]
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare le chemin CSV et le chemin Arrow direct vers MySQL.")
+    parser.add_argument("file_paths", nargs="+", help="Exports raw locaux (JSON ou NDJSON, gzip ou non).")
+    parser.add_argument("--host", default="mysql")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--load-mode", choices=["executemany", "batch"], default="batch")
+    args = parser.parse_args()
+
+    records = [record for path in args.file_paths for record in iter_records(path)]
+    df = pd.DataFrame(records)[COLUMNS_USED]
+    cities = sorted({station_table_name(nom) for nom in df["nom"].dropna().unique()})
+    print(f"{len(df)} lignes, {len(cities)} stations")
+
+    conn = pymysql.connect(host=args.host, port=args.port, user="root", password="root", database="staging")
+    try:
+        with conn.cursor() as cursor:
+            for name, run in [("csv", run_csv), ("direct", run_direct)]:
+                reset_tables(cursor, cities)
+                conn.commit()
+                start = time.perf_counter()
+                run(cursor, df, args.load_mode)
+                conn.commit()
+                elapsed = time.perf_counter() - start
+                rows = count_rows(cursor, cities)
+                print(f"{name:<7} : {rows} lignes en {elapsed:.2f} s -> {rows / elapsed:,.0f} lignes/s")
+    finally:
+        with conn.cursor() as cursor:
+            for city in cities:
+                cursor.execute(f"DROP TABLE IF EXISTS staging.`{bench_table(city)}`;")
+        conn.close()
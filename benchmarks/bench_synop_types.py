@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+import argparse
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from raw_format import iter_records
+from synop import COLUMNS_USED
+from staging_writer import split_by_station, to_synop_types
+
+# Mémoire et temps de découpage d'un export avec les types par défaut de pandas
+# (colonnes object) puis avec les types compacts de SYNOP_DTYPES.
+# Usage : python benchmarks/bench_synop_types.py data/raw/2023/12/2023-12.ndjson.gz
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+def split_time(df):
+    start = time.perf_counter()
+    for _nom, _df_nom in split_by_station(df):
+        pass
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare les types par défaut et les types compacts SYNOP.")
+    parser.add_argument("file_path", help="Export raw local (JSON ou NDJSON, gzip ou non).")
+    args = parser.parse_args()
+
+    records = list(iter_records(args.file_path))
+
+    start = time.perf_counter()
+    df_default = pd.DataFrame(records)[COLUMNS_USED]
+    default_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df_typed = to_synop_types(pd.DataFrame.from_records(records, columns=COLUMNS_USED))
+    typed_build = time.perf_counter() - start
+
+    print(f"{len(df_default)} lignes")
+    print(f"Types par défaut : {memory_mb(df_default):8.1f} Mo, construction {default_build:.2f} s, découpage {split_time(df_default):.2f} s")
+    print(f"Types compacts   : {memory_mb(df_typed):8.1f} Mo, construction {typed_build:.2f} s, découpage {split_time(df_typed):.2f} s")
+    print(f"Réduction mémoire : {100 * (1 - memory_mb(df_typed) / memory_mb(df_default)):.0f} %")
@@ -37,9 +37,15 @@ task_unpack_to_raw = BashOperator(
     dag=dag,
 )
 
+task_compact_raw = BashOperator(
+    task_id="run_compact_raw",
+    bash_command='python /opt/airflow/scripts/compact_raw.py --bucket_name raw',
+    dag=dag,
+)
+
 task_preprocess_to_staging = BashOperator(
     task_id="run_preprocess_to_staging",
-    bash_command='python /opt/airflow/scripts/preprocess_to_staging.py ',
+    bash_command='python /opt/airflow/scripts/preprocess_to_staging.py --memory-budget-mb 512 --load-mode infile',
     dag=dag,
 )
 
@@ -49,5 +55,5 @@ task_process_to_curated = BashOperator(
     dag=dag,
 )
 
-task_big_fetch >> task_unpack_to_raw >> task_preprocess_to_staging >> task_process_to_curated
-# task_unpack_to_raw >> task_preprocess_to_staging >> task_process_to_curated
+task_big_fetch >> task_unpack_to_raw >> task_compact_raw >> task_preprocess_to_staging >> task_process_to_curated
+# task_unpack_to_raw >> task_compact_raw >> task_preprocess_to_staging >> task_process_to_curated
@@ -4,12 +4,16 @@ from io import BytesIO
 import boto3
 import pymysql
 import pymongo
-from typing import List
+from typing import List, Optional
 import json
 from datetime import datetime
 import sys
 import time
 import zipfile
+import threading
+import contextlib
+import anyio
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import os
 sys.path.append('/code/src/')
@@ -27,8 +31,20 @@ from process_to_curated import (
 
 from fast_preprocess_to_staging import fast_process_csv_to_mysql
 from fast_process_to_curated import fast_process_weather_data
+from curated_rollups import CURATED_COLLECTIONS, GRANULARITIES
+from raw_format import decode_records, is_raw_file
+from raw_layout import partition_of_key, raw_object_key
+from raw_catalog import catalog_objects, refresh_catalog, touched_prefixes
+from mysql_pool import MySQLPool
 
 app = FastAPI(title="Data Lake API")
+# Les routes sont synchrones : FastAPI les exécute dans un pool de threads borné, hors de la
+# boucle d'événements, si bien qu'une requête lente (MySQL, S3, MongoDB) ne bloque pas les
+# autres. Les clients MySQL, MongoDB et S3 ont autant de connexions que de threads.
+API_THREADS = 16
+# Les routes d'ingestion s'exécutent aussi dans ce pool : ce verrou les sérialise. Il est pris
+# sans attendre (voir ingest_slot) pour qu'une ingestion refusée ne garde pas un thread du pool
+ingest_lock = threading.Lock()
 CSV_OUTPUT_DIR = "/opt/airflow/data/staging/"
 
 @app.get("/")
@@ -41,7 +57,8 @@ class DatabaseConnections:
         self.s3_client = boto3.client('s3',
                                       endpoint_url='http://localstack:4566',
                                       aws_access_key_id="root",
-                                      aws_secret_access_key="root")
+                                      aws_secret_access_key="root",
+                                      config=Config(max_pool_connections=API_THREADS))
         self.bucket_name = "raw"
         
         # staging - mysql
@@ -52,17 +69,56 @@ class DatabaseConnections:
             'password': 'root',
             'database': 'staging'
         }
-        self.mysql_conn = pymysql.connect(**self.mysql_config)
+        # Une connexion par requête, empruntée au pool (une connexion pymysql ne se partage
+        # pas entre threads) ; autocommit pour que chaque lecture voie les dernières données
+        self.mysql_pool = MySQLPool(API_THREADS, autocommit=True, **self.mysql_config)
 
         # curated - mongodb
-        self.mongo_client = pymongo.MongoClient("mongodb://host.docker.internal:27017/")
+        self.mongo_client = pymongo.MongoClient("mongodb://host.docker.internal:27017/", maxPoolSize=API_THREADS)
         self.mongo_db = self.mongo_client["curated"]
         self.weather_stats = self.mongo_db["WeatherStats"]
 
 db = DatabaseConnections()
 
+@app.on_event("startup")
+def limit_threads():
+    """Borne le pool de threads des routes synchrones à API_THREADS (16 par défaut)."""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADS
+
+@app.on_event("shutdown")
+def close_connections():
+    db.mysql_pool.close()
+    db.mongo_client.close()
+
+@contextlib.contextmanager
+def ingest_slot():
+    """Prend le verrou d'ingestion sans attendre : 409 si une ingestion est déjà en cours."""
+    if not ingest_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Une ingestion est déjà en cours, réessayez une fois terminée.")
+    try:
+        yield
+    finally:
+        ingest_lock.release()
+
+def upload_raw_object(fileobj, file_name):
+    """Envoie un fichier ingéré dans sa partition year=/month= du bucket RAW et retourne sa clé."""
+    key = raw_object_key(os.path.basename(file_name), os.path.dirname(file_name))
+    db.s3_client.upload_fileobj(fileobj, db.bucket_name, key)
+    return key
+
+def staging_range(keys):
+    """
+    Plage de mois (start, end) couvrant les clés ingérées, pour ne traiter que ces
+    partitions. (None, None) si une clé n'est pas partitionnée : tout le bucket est traité.
+    """
+    partitions = [partition_of_key(key) for key in keys]
+    if not partitions or None in partitions:
+        return None, None
+    first, last = min(partitions), max(partitions)
+    return f"{first[0]}-{first[1]:02d}", f"{last[0]}-{last[1]:02d}"
+
 @app.get("/health", tags=["Health"])
-async def health_check():
+def health_check():
     """Vérifie la santé de l'API et des connexions aux bases de données."""
     status = {
         "api_status": "healthy",
@@ -76,7 +132,7 @@ async def health_check():
         status["connections"]["s3"] = False
 
     try:
-        with db.mysql_conn.cursor() as cursor:
+        with db.mysql_pool.connection() as conn, conn.cursor() as cursor:
             cursor.execute("SELECT 1")
         status["connections"]["mysql"] = True
     except:
@@ -91,24 +147,26 @@ async def health_check():
     return status
 
 @app.get("/raw/files", response_model=List[str], tags=["S3"])
-async def list_files():
+def list_files(start: Optional[str] = None, end: Optional[str] = None, refresh: bool = False):
     """
-    Liste les fichiers dans le bucket RAW.
+    Liste les fichiers dans le bucket RAW depuis son catalogue, éventuellement limités
+    aux partitions comprises entre start et end (YYYY-MM). refresh=true reliste ces partitions.
     """
     try:
-        response = db.s3_client.list_objects_v2(Bucket=db.bucket_name)
-        return [obj["Key"] for obj in response.get("Contents", [])]
+        return [obj["Key"] for obj in catalog_objects(db.s3_client, db.bucket_name, start, end, refresh)]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur S3 : {e}")
 
-@app.get("/raw/files/{file_name}", tags=["S3"])
-async def get_file(file_name: str):
+@app.get("/raw/files/{file_name:path}", tags=["S3"])
+def get_file(file_name: str):
     """
-    Récupère le contenu d'un fichier JSON dans le bucket RAW.
+    Récupère le contenu d'un fichier JSON ou NDJSON (éventuellement gzip) dans le bucket RAW.
     """
     try:
         obj = db.s3_client.get_object(Bucket=db.bucket_name, Key=file_name)
-        return json.loads(obj["Body"].read().decode("utf-8"))
+        return decode_records(obj["Body"].read(), file_name)
     except db.s3_client.exceptions.NoSuchKey:
         raise HTTPException(status_code=404, detail=f"Fichier '{file_name}' introuvable.")
     except json.JSONDecodeError:
@@ -117,28 +175,46 @@ async def get_file(file_name: str):
         raise HTTPException(status_code=500, detail=f"Erreur S3 : {e}")
 
 @app.get("/staging/cities", response_model=List[str], tags=["MySQL"])
-async def list_cities():
+def list_cities():
     """Liste les tables dans la base MySQL."""
     try:
         query = """
         SELECT table_name 
         FROM information_schema.tables 
-        WHERE table_schema = 'staging';
+        WHERE table_schema = 'staging'
+          AND table_name NOT IN ('observations', 'stations')
+          AND LEFT(table_name, 1) <> '_';
         """
-        with db.mysql_conn.cursor() as cursor:
+        with db.mysql_pool.connection() as conn, conn.cursor() as cursor:
             cursor.execute(query)
-            tables = cursor.fetchall()
-        return [table[0].replace('_', '-') for table in tables]
+            tables = [table[0] for table in cursor.fetchall()]
+            # Villes de la table observations (organisation unified), si elle existe
+            cursor.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = 'staging' AND table_name = 'stations';")
+            if cursor.fetchone()[0]:
+                cursor.execute("SELECT city FROM staging.stations;")
+                tables += [row[0] for row in cursor.fetchall()]
+        return [table.replace('_', '-') for table in sorted(set(tables))]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur MySQL : {e}")
 
 @app.get("/staging/cities/{city}", tags=["MySQL"])
-async def get_city_data(city: str):
+def get_city_data(city: str):
     """Récupère les données pour une ville spécifique dans MySQL."""
     try:
-        query = f"SELECT * FROM staging.{city.replace('-', '_')};"
-        with db.mysql_conn.cursor(pymysql.cursors.DictCursor) as cursor:
-            cursor.execute(query)
+        table = city.replace('-', '_')
+        with db.mysql_pool.connection() as conn, conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            cursor.execute("SELECT COUNT(*) AS n FROM information_schema.tables WHERE table_schema = 'staging' AND table_name = %s;", (table,))
+            if cursor.fetchone()["n"]:
+                cursor.execute(f"SELECT * FROM staging.`{table}`;")
+            else:
+                # Organisation unified : lecture par la clé (station_id, date) de la table observations
+                cursor.execute("""
+                    SELECT o.date, s.nom, o.pmer, o.tend, o.cod_tend, o.dd, o.ff, o.td, o.u, o.ww,
+                           o.pres, o.rafper, o.rr1, o.rr3, o.tc
+                    FROM staging.observations o JOIN staging.stations s ON s.station_id = o.station_id
+                    WHERE s.city = %s
+                    ORDER BY o.date;
+                """, (table,))
             result = cursor.fetchall()
         if not result:
             raise HTTPException(status_code=404, detail=f"Aucune donnée pour la ville : {city}")
@@ -147,7 +223,7 @@ async def get_city_data(city: str):
         raise HTTPException(status_code=500, detail=f"Erreur MySQL : {e}")
 
 @app.get("/curated/cities", response_model=List[str], tags=["MongoDB"])
-async def list_curated_cities():
+def list_curated_cities():
     """
     Liste toutes les villes disponibles dans MongoDB.
     """
@@ -159,13 +235,20 @@ async def list_curated_cities():
         raise HTTPException(status_code=500, detail=f"Erreur MongoDB : {e}")
 
 @app.get("/curated/cities/{city}", tags=["MongoDB"])
-async def get_curated_city_data(city: str):
+def get_curated_city_data(city: str, granularity: str = "daily", start: Optional[str] = None, end: Optional[str] = None):
     """
-    Récupère les données agrégées pour une ville donnée dans MongoDB.
+    Récupère les données agrégées pour une ville donnée dans MongoDB, par jour (daily),
+    semaine (weekly), mois (monthly) ou année (yearly), éventuellement entre start et end (YYYY-MM-DD).
     """
+    if granularity not in CURATED_COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"Granularité inconnue : {granularity} (attendu : {', '.join(GRANULARITIES)})")
     try:
-        # Recherche des données en utilisant une capitalisation sur le nom de la ville
-        data = list(db.weather_stats.find({"city": {"$regex": f"^{city}$", "$options": "i"}}, {"_id": 0})) 
+        # Les villes sont enregistrées capitalisées : une égalité exacte utilise l'index (city, period)
+        query = {"city": city.capitalize()}
+        if start or end:
+            query["period"] = {**({"$gte": start} if start else {}), **({"$lte": end} if end else {})}
+        collection = db.mongo_db[CURATED_COLLECTIONS[granularity]]
+        data = list(collection.find(query, {"_id": 0, "partials": 0}).sort("period", 1))
         if not data:
             raise HTTPException(status_code=404, detail=f"Aucune donnée pour la ville : {city}")
         return data
@@ -173,117 +256,135 @@ async def get_curated_city_data(city: str):
         raise HTTPException(status_code=500, detail=f"Erreur MongoDB : {e}")
 
 @app.post("/ingest", tags=["Ingestion"])
-async def ingest_file(file: UploadFile = File(...)):
+def ingest_file(file: UploadFile = File(...)):
     """
-    Ingestion d'un fichier JSON ou ZIP de fichiers JSON dans le système.
+    Ingestion d'un fichier JSON/NDJSON ou ZIP de fichiers JSON dans le système.
     Le fichier est traité et ses données insérées dans la base de données.
     """
     start_time = time.time()  # Enregistrer l'heure de départ
-    try:
-        # Vérifier si c'est un fichier ZIP ou JSON
-        file_ext = file.filename.split('.')[-1].lower()
-        
+    # Une ingestion à la fois : le chargement staging partage la connexion MySQL du module
+    # preprocess_to_staging et écrit dans les mêmes fichiers de CSV_OUTPUT_DIR
+    with ingest_slot():
         try:
-            bucket_name = db.bucket_name
-            db.s3_client.head_bucket(Bucket=bucket_name)
-            print(f"Le bucket {bucket_name} existe déjà.")
-        except ClientError as e:
-            if e.response['Error']['Code'] == '404':
-                print(f"Le bucket {bucket_name} n'existe pas, création en cours...")
-                try:
-                    db.s3_client.create_bucket(Bucket=bucket_name)  # Remplace par ta région si nécessaire
-                    print(f"Bucket {bucket_name} créé avec succès.")
-                except ClientError as create_error:
-                    print(f"Erreur lors de la création du bucket : {create_error}")
+            # Vérifier si c'est un fichier ZIP ou JSON
+            file_ext = file.filename.split('.')[-1].lower()
+        
+            try:
+                bucket_name = db.bucket_name
+                db.s3_client.head_bucket(Bucket=bucket_name)
+                print(f"Le bucket {bucket_name} existe déjà.")
+            except ClientError as e:
+                if e.response['Error']['Code'] == '404':
+                    print(f"Le bucket {bucket_name} n'existe pas, création en cours...")
+                    try:
+                        db.s3_client.create_bucket(Bucket=bucket_name)  # Remplace par ta région si nécessaire
+                        print(f"Bucket {bucket_name} créé avec succès.")
+                    except ClientError as create_error:
+                        print(f"Erreur lors de la création du bucket : {create_error}")
+                        return
+                else:
+                    print(f"Erreur lors de la vérification du bucket : {e}")
                     return
-            else:
-                print(f"Erreur lors de la vérification du bucket : {e}")
-                return
-
-        if file_ext == 'json':
-            # Traitement du fichier JSON unique
-            print(f"Processing JSON file {file.filename}...")
-            db.s3_client.upload_fileobj(file.file, db.bucket_name, file.filename)
-            process_s3_data_to_csv("raw")
-            process_csv_to_mysql()
-            process_weather_data()
-        elif file_ext == 'zip':
-            # Traitement du fichier ZIP
-            print(f"Processing ZIP file {file.filename}...")
-            with zipfile.ZipFile(file.file, 'r') as zip_ref:
-                # Extraire les fichiers du ZIP
-                for zip_file_name in zip_ref.namelist():
-                    print(f"Extracting file {zip_file_name} from ZIP...")
-                    with zip_ref.open(zip_file_name) as file_in_zip:
-                        db.s3_client.upload_fileobj(file_in_zip, db.bucket_name, zip_file_name)
-                        process_s3_data_to_csv("raw")
+
+            if is_raw_file(file.filename):
+                # Traitement du fichier JSON unique
+                print(f"Processing JSON file {file.filename}...")
+                key = upload_raw_object(file.file, file.filename)
+                refresh_catalog(db.s3_client, db.bucket_name, touched_prefixes([key]))
+                process_s3_data_to_csv("raw", *staging_range([key]))
+                process_csv_to_mysql()
+                process_weather_data()
+            elif file_ext == 'zip':
+                # Traitement du fichier ZIP
+                print(f"Processing ZIP file {file.filename}...")
+                keys = []
+                with zipfile.ZipFile(file.file, 'r') as zip_ref:
+                    # Extraire les fichiers du ZIP
+                    for zip_file_name in zip_ref.namelist():
+                        if zip_file_name.endswith("/"):
+                            continue
+                        print(f"Extracting file {zip_file_name} from ZIP...")
+                        with zip_ref.open(zip_file_name) as file_in_zip:
+                            keys.append(upload_raw_object(file_in_zip, zip_file_name))
+                # Un seul passage de staging, limité aux partitions reçues
+                refresh_catalog(db.s3_client, db.bucket_name, touched_prefixes(keys))
+                process_s3_data_to_csv("raw", *staging_range(keys))
                 process_csv_to_mysql()
                 process_weather_data()
 
-        else:
-            raise HTTPException(status_code=400, detail="Format de fichier non supporté. Accepte uniquement .json ou .zip")
+            else:
+                raise HTTPException(status_code=400, detail="Format de fichier non supporté. Accepte uniquement .json, .ndjson(.gz) ou .zip")
 
-        # Mesurer le temps écoulé
-        elapsed_time = time.time() - start_time
+            # Mesurer le temps écoulé
+            elapsed_time = time.time() - start_time
 
-        return {"message": f"Le fichier '{file.filename}' a été ingéré avec succès en {elapsed_time:.2f} secondes."}
+            return {"message": f"Le fichier '{file.filename}' a été ingéré avec succès en {elapsed_time:.2f} secondes."}
 
-    except json.JSONDecodeError as e:
-        raise HTTPException(status_code=400, detail=f"Fichier JSON non valide. Erreur : {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur d'ingestion : {e}")
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Fichier JSON non valide. Erreur : {str(e)}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Erreur d'ingestion : {e}")
     
 @app.post("/ingest-fast", tags=["Ingestion"])
-async def ingest_fast(file: UploadFile = File(...)):
+def ingest_fast(file: UploadFile = File(...)):
     start_time = time.time()
-    try:
-        file_ext = file.filename.split('.')[-1].lower()
+    # Une ingestion à la fois : le chargement staging partage la connexion MySQL du module
+    # preprocess_to_staging et écrit dans les mêmes fichiers de CSV_OUTPUT_DIR
+    with ingest_slot():
         try:
-            bucket_name = db.bucket_name
-            db.s3_client.head_bucket(Bucket=bucket_name)
-            print(f"Le bucket {bucket_name} existe déjà.")
-        except ClientError as e:
-            if e.response['Error']['Code'] == '404':
-                print(f"Le bucket {bucket_name} n'existe pas, création en cours...")
-                try:
-                    db.s3_client.create_bucket(Bucket=bucket_name)  # Remplace par ta région si nécessaire
-                    print(f"Bucket {bucket_name} créé avec succès.")
-                except ClientError as create_error:
-                    print(f"Erreur lors de la création du bucket : {create_error}")
+            file_ext = file.filename.split('.')[-1].lower()
+            try:
+                bucket_name = db.bucket_name
+                db.s3_client.head_bucket(Bucket=bucket_name)
+                print(f"Le bucket {bucket_name} existe déjà.")
+            except ClientError as e:
+                if e.response['Error']['Code'] == '404':
+                    print(f"Le bucket {bucket_name} n'existe pas, création en cours...")
+                    try:
+                        db.s3_client.create_bucket(Bucket=bucket_name)  # Remplace par ta région si nécessaire
+                        print(f"Bucket {bucket_name} créé avec succès.")
+                    except ClientError as create_error:
+                        print(f"Erreur lors de la création du bucket : {create_error}")
+                        return
+                else:
+                    print(f"Erreur lors de la vérification du bucket : {e}")
                     return
-            else:
-                print(f"Erreur lors de la vérification du bucket : {e}")
-                return
-
-        if file_ext == 'json':
-            # Traitement du fichier JSON unique
-            print(f"Processing JSON file {file.filename}...")
-            db.s3_client.upload_fileobj(file.file, db.bucket_name, file.filename)
-            process_s3_data_to_csv("raw")
-            fast_process_csv_to_mysql()
-            fast_process_weather_data()
-        elif file_ext == 'zip':
-            # Traitement du fichier ZIP
-            print(f"Processing ZIP file {file.filename}...")
-            with zipfile.ZipFile(file.file, 'r') as zip_ref:
-                # Extraire les fichiers du ZIP
-                for zip_file_name in zip_ref.namelist():
-                    print(f"Extracting file {zip_file_name} from ZIP...")
-                    with zip_ref.open(zip_file_name) as file_in_zip:
-                        db.s3_client.upload_fileobj(file_in_zip, db.bucket_name, zip_file_name)
-                        process_s3_data_to_csv("raw")
+
+            if is_raw_file(file.filename):
+                # Traitement du fichier JSON unique
+                print(f"Processing JSON file {file.filename}...")
+                key = upload_raw_object(file.file, file.filename)
+                refresh_catalog(db.s3_client, db.bucket_name, touched_prefixes([key]))
+                process_s3_data_to_csv("raw", *staging_range([key]))
+                fast_process_csv_to_mysql()
+                fast_process_weather_data()
+            elif file_ext == 'zip':
+                # Traitement du fichier ZIP
+                print(f"Processing ZIP file {file.filename}...")
+                keys = []
+                with zipfile.ZipFile(file.file, 'r') as zip_ref:
+                    # Extraire les fichiers du ZIP
+                    for zip_file_name in zip_ref.namelist():
+                        if zip_file_name.endswith("/"):
+                            continue
+                        print(f"Extracting file {zip_file_name} from ZIP...")
+                        with zip_ref.open(zip_file_name) as file_in_zip:
+                            keys.append(upload_raw_object(file_in_zip, zip_file_name))
+                # Un seul passage de staging, limité aux partitions reçues
+                refresh_catalog(db.s3_client, db.bucket_name, touched_prefixes(keys))
+                process_s3_data_to_csv("raw", *staging_range(keys))
                 fast_process_csv_to_mysql()
                 fast_process_weather_data()
 
-        else:
-            raise HTTPException(status_code=400, detail="Format de fichier non supporté. Accepte uniquement .json ou .zip")
+            else:
+                raise HTTPException(status_code=400, detail="Format de fichier non supporté. Accepte uniquement .json, .ndjson(.gz) ou .zip")
 
-        # Mesurer le temps écoulé
-        elapsed_time = time.time() - start_time
+            # Mesurer le temps écoulé
+            elapsed_time = time.time() - start_time
 
-        return {"message": f"Le fichier '{file.filename}' a été ingéré avec succès en {elapsed_time:.2f} secondes."}
+            return {"message": f"Le fichier '{file.filename}' a été ingéré avec succès en {elapsed_time:.2f} secondes."}
 
-    except json.JSONDecodeError as e:
-        raise HTTPException(status_code=400, detail=f"Fichier JSON non valide. Erreur : {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur d'ingestion : {e}")
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Fichier JSON non valide. Erreur : {str(e)}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Erreur d'ingestion : {e}")
@@ -2,6 +2,19 @@ import os
 import subprocess
 import time
 import argparse
+import calendar
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from fetch import FILE_FORMATS, fetch_partition, parse_fields
+from synop import COLUMNS_USED
+from fetch_manifest import FetchManifest
+
+MAX_WORKERS = 4  # Nombre de partitions téléchargées en parallèle
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 2  # Délai de base, doublé à chaque nouvelle tentative
 
 def run_fetch_script(start_year, end_year):
     total_time = 0  # Initialisation du temps total
@@ -25,6 +38,88 @@ def run_fetch_script(start_year, end_year):
     # Afficher le temps total pris
     print(f"Total time taken for all years ({start_year}-{end_year}): {total_time:.2f} seconds\n")
 
+# ----------------------------------------
+# Backfill concurrent dans un seul processus
+# ----------------------------------------
+
+def build_session(pool_size):
+    """Session HTTP partagée dont le pool de connexions couvre tous les workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def list_partitions(start_year, end_year, granularity="month"):
+    """Liste les partitions (année, mois, jour) à récupérer, jour à None en mode mensuel."""
+    partitions = []
+    for year in range(start_year, end_year + 1):
+        for month in range(1, 13):
+            if granularity == "day":
+                days_in_month = calendar.monthrange(year, month)[1]
+                partitions.extend((year, month, day) for day in range(1, days_in_month + 1))
+            else:
+                partitions.append((year, month, None))
+    return partitions
+
+def partition_label(partition):
+    year, month, day = partition
+    return f"{year}-{month:02d}" if day is None else f"{year}-{month:02d}-{day:02d}"
+
+def fetch_with_retry(session, partition, max_retries=MAX_RETRIES, backoff=BACKOFF_SECONDS, file_format="ndjson.gz",
+                     fields=COLUMNS_USED, manifest=None):
+    """Récupère une partition en réessayant avec un backoff exponentiel (au moins une tentative)."""
+    year, month, day = partition
+    max_retries = max(1, max_retries)
+    start_time = time.time()
+    for attempt in range(1, max_retries + 1):
+        try:
+            count, file_path = fetch_partition(session, year, month, day, file_format, fields, manifest)
+            return count, file_path, attempt, time.time() - start_time
+        except requests.exceptions.RequestException as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            print(f"[{partition_label(partition)}] Tentative {attempt} échouée ({e}), nouvel essai dans {delay}s...")
+            time.sleep(delay)
+
+def run_concurrent_fetch(start_year, end_year, max_workers=MAX_WORKERS, granularity="month",
+                         max_retries=MAX_RETRIES, backoff=BACKOFF_SECONDS, file_format="ndjson.gz",
+                         fields=COLUMNS_USED):
+    """Backfill de plusieurs années dans un seul processus, avec un nombre de requêtes simultanées plafonné."""
+    partitions = list_partitions(start_year, end_year, granularity)
+    session = build_session(max_workers)
+    manifest = FetchManifest()
+    total_records = 0
+    failures = []
+    start_time = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fetch_with_retry, session, partition, max_retries, backoff, file_format, fields,
+                            manifest): partition
+            for partition in partitions
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            label = partition_label(futures[future])
+            try:
+                count, file_path, attempts, elapsed = future.result()
+                total_records += count
+                print(f"[{done}/{len(partitions)}] {label} : {count} enregistrements en {elapsed:.2f}s "
+                      f"(tentatives : {attempts}) -> {file_path}")
+            except Exception as e:
+                failures.append(label)
+                print(f"[{done}/{len(partitions)}] {label} : échec définitif ({e})")
+
+    session.close()
+    manifest.save()
+    total_time = time.time() - start_time
+    print(f"\n{len(partitions) - len(failures)}/{len(partitions)} partitions récupérées, "
+          f"{total_records} enregistrements en {total_time:.2f} secondes.")
+    if failures:
+        print(f"Partitions en échec : {', '.join(failures)}")
+    return failures
+
 if __name__ == "__main__":
     # Initialisation des arguments de la ligne de commande
     parser = argparse.ArgumentParser(description="Run the fetch script for a range of years.")
@@ -36,12 +131,51 @@ if __name__ == "__main__":
         "--end-year", type=int, required=True,
         help="The ending year for fetching data (e.g., 2023)."
     )
+    parser.add_argument(
+        "--mode", choices=["concurrent", "subprocess"], default="concurrent",
+        help="'concurrent' fetches partitions in-process over a shared HTTP session, "
+             "'subprocess' runs fetch.py once per month (legacy)."
+    )
+    parser.add_argument(
+        "--granularity", choices=["month", "day"], default="month",
+        help="Partition size used in concurrent mode."
+    )
+    parser.add_argument(
+        "--max-workers", type=int, default=MAX_WORKERS,
+        help="Maximum number of concurrent requests in concurrent mode."
+    )
+    parser.add_argument(
+        "--max-retries", type=int, default=MAX_RETRIES,
+        help="Number of attempts per partition before giving up."
+    )
+    parser.add_argument(
+        "--format", choices=list(FILE_FORMATS), default="ndjson.gz",
+        help="Output format used in concurrent mode."
+    )
+    parser.add_argument(
+        "--fields", type=parse_fields, default=COLUMNS_USED,
+        help="Comma-separated list of fields to download in concurrent mode (defaults to the staging columns)."
+    )
+    parser.add_argument(
+        "--all-fields", action="store_true",
+        help="Download every SYNOP field in concurrent mode."
+    )
     args = parser.parse_args()
 
     # Validation des années
     if args.start_year > args.end_year:
         print("Error: Start year must be less than or equal to end year.")
         exit(1)
+    if args.max_retries < 1:
+        print("Error: --max-retries must be at least 1.")
+        exit(1)
 
     # Lancement du script
-    run_fetch_script(args.start_year, args.end_year)
\ No newline at end of file
+    if args.mode == "subprocess":
+        run_fetch_script(args.start_year, args.end_year)
+    else:
+        failures = run_concurrent_fetch(args.start_year, args.end_year, args.max_workers,
+                                        args.granularity, args.max_retries, file_format=args.format,
+                                        fields=None if args.all_fields else args.fields)
+        if failures:
+            exit(1)
@@ -0,0 +1,153 @@
+import os
+import re
+import gzip
+import json
+import time
+import tempfile
+import argparse
+from datetime import datetime, timezone
+
+import boto3
+
+from raw_format import decode_records, is_raw_file
+from raw_layout import partition_of_key
+from raw_catalog import (
+    catalog_objects,
+    compacted_source_versions,
+    is_compacted,
+    load_compaction_manifest,
+    save_compaction_manifest,
+)
+
+# Compaction de la zone raw : les petits objets d'une partition (fetch quotidiens,
+# deltas, fichiers ingérés) sont regroupés en un fichier NDJSON gzip par station et
+# par mois. Les fichiers compactés sont écrits sous _compacted/ (hors catalogue),
+# puis rendus visibles d'un coup par l'écriture du manifest de compaction.
+BUCKET_NAME = "raw"
+COMPACTED_PREFIX = "_compacted"
+SMALL_OBJECT_MB = 32  # Seuls les objets plus petits que ce seuil sont compactés
+MIN_OBJECTS = 2  # Nombre minimal de petits objets pour compacter une partition
+
+s3 = boto3.client(
+    "s3",
+    endpoint_url="http://localstack:4566",
+    aws_access_key_id="root",
+    aws_secret_access_key="root"
+)
+
+def station_slug(nom):
+    return re.sub(r"[^A-Za-z0-9]+", "_", nom or "inconnu").strip("_") or "inconnu"
+
+def group_by_partition(objects):
+    """Regroupe les objets raw partitionnés par mois ('YYYY-MM')."""
+    partitions = {}
+    for obj in objects:
+        partition = partition_of_key(obj["Key"])
+        if partition is not None and is_raw_file(obj["Key"]):
+            partitions.setdefault(f"{partition[0]}-{partition[1]:02d}", []).append(obj)
+    return partitions
+
+def write_station_files(bucket_name, inputs, tmp_dir):
+    """
+    Lit les objets un par un et écrit chaque enregistrement dans le fichier de sa
+    station : la mémoire utilisée se limite à un objet source à la fois.
+    Retourne {slug: chemin local} et le nombre d'enregistrements.
+    """
+    writers, paths, count = {}, {}, 0
+    try:
+        for obj in inputs:
+            body = s3.get_object(Bucket=bucket_name, Key=obj["Key"])["Body"].read()
+            for record in decode_records(body, obj["Key"]):
+                slug = station_slug(record.get("nom"))
+                if slug not in writers:
+                    paths[slug] = os.path.join(tmp_dir, f"station={slug}.ndjson.gz")
+                    writers[slug] = gzip.open(paths[slug], "wt", encoding="utf-8")
+                writers[slug].write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return paths, count
+
+def compact_partition(bucket_name, partition, objects, manifest, small_object_bytes, min_objects):
+    """Compacte une partition si elle contient assez de nouveaux petits objets. Retourne True si compactée."""
+    previous = manifest["partitions"].get(partition)
+    already_compacted = compacted_source_versions(previous) if previous else {}
+    small = [obj for obj in objects if obj["Size"] < small_object_bytes]
+    new_small = [obj for obj in small if not is_compacted(already_compacted, obj["Key"], obj["ETag"].strip('"'))]
+    if not new_small or (previous is None and len(new_small) < min_objects):
+        return False
+
+    rewritten = [obj for obj in new_small if obj["Key"] in already_compacted]
+    if rewritten:
+        # Une source déjà compactée a été réécrite (fetch du mois en cours) : les fichiers
+        # compactés contiennent son ancienne version, la partition est reconstruite depuis
+        # ses sources actuelles
+        inputs = small
+        sources = small
+    else:
+        # Les fichiers compactés existants sont fusionnés avec les nouveaux petits objets
+        inputs = (previous["files"] if previous else []) + new_small
+        sources = [obj for obj in small if obj["Key"] in already_compacted] + new_small
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    year, month = partition.split("-")
+    run_prefix = f"{COMPACTED_PREFIX}/year={year}/month={month}/{run_id}/"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths, count = write_station_files(bucket_name, inputs, tmp_dir)
+        files = []
+        for slug, path in sorted(paths.items()):
+            key = f"{run_prefix}station={slug}.ndjson.gz"
+            s3.upload_file(path, bucket_name, key)
+            head = s3.head_object(Bucket=bucket_name, Key=key)
+            files.append({"Key": key, "Size": head["ContentLength"], "ETag": head["ETag"].strip('"')})
+
+    # Publication atomique : le manifest bascule les lecteurs sur les nouveaux fichiers
+    manifest["partitions"][partition] = {
+        "run_id": run_id,
+        "compacted_at": datetime.now(timezone.utc).isoformat(),
+        "records": count,
+        "files": files,
+        "sources": [
+            {"Key": obj["Key"], "ETag": obj["ETag"].strip('"'), "Size": obj["Size"]}
+            for obj in sorted(sources, key=lambda obj: obj["Key"])
+        ],
+    }
+    save_compaction_manifest(s3, bucket_name, manifest)
+
+    # Les fichiers de la compaction précédente ne sont plus référencés
+    if previous:
+        for obj in previous["files"]:
+            s3.delete_object(Bucket=bucket_name, Key=obj["Key"])
+
+    print(f"Partition {partition} : {len(inputs)} objets -> {len(files)} fichiers compactés ({count} enregistrements).")
+    return True
+
+def compact_raw(bucket_name=BUCKET_NAME, start=None, end=None, small_object_mb=SMALL_OBJECT_MB, min_objects=MIN_OBJECTS):
+    start_time = time.time()
+    objects = catalog_objects(s3, bucket_name, start, end, refresh=True, resolve_compaction=False)
+    manifest = load_compaction_manifest(s3, bucket_name)
+    small_object_bytes = small_object_mb * 1024 * 1024
+
+    compacted = 0
+    for partition, partition_objects in sorted(group_by_partition(objects).items()):
+        try:
+            if compact_partition(bucket_name, partition, partition_objects, manifest, small_object_bytes, min_objects):
+                compacted += 1
+        except Exception as e:
+            print(f"Erreur lors de la compaction de la partition {partition} : {e}")
+
+    print(f"Compaction terminée en {round(time.time() - start_time, 2)} secondes : {compacted} partitions compactées.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regroupe les petits objets du bucket raw en un fichier par station et par mois.")
+    parser.add_argument("--bucket_name", type=str, default=BUCKET_NAME, help="Nom du bucket S3")
+    parser.add_argument("--start", type=str, help="Premier mois à compacter (YYYY-MM). Par défaut, tout le bucket.")
+    parser.add_argument("--end", type=str, help="Dernier mois à compacter (YYYY-MM). Par défaut, égal à --start.")
+    parser.add_argument("--small-object-mb", type=float, default=SMALL_OBJECT_MB,
+                        help="Taille en dessous de laquelle un objet est compacté.")
+    parser.add_argument("--min-objects", type=int, default=MIN_OBJECTS,
+                        help="Nombre minimal de petits objets pour compacter une partition.")
+    args = parser.parse_args()
+
+    compact_raw(args.bucket_name, args.start, args.end, args.small_object_mb, args.min_objects)
@@ -0,0 +1,104 @@
+import pandas as pd
+
+from curated_store import (
+    DAILY_COLLECTION, PARTIAL_FIELDS, ensure_curated_indexes, ensure_timeseries_collection, upsert_documents,
+)
+
+# Agrégats hebdomadaires, mensuels et annuels de la zone curated, une collection par niveau.
+# Chaque niveau fusionne les agrégats partiels (somme, effectif, min, max) du niveau inférieur,
+# sans relire la staging : semaines et mois depuis les jours, années depuis les mois.
+ROLLUP_COLLECTIONS = {"weekly": "WeatherStatsWeekly", "monthly": "WeatherStatsMonthly", "yearly": "WeatherStatsYearly"}
+CURATED_COLLECTIONS = {"daily": DAILY_COLLECTION, **ROLLUP_COLLECTIONS}
+GRANULARITIES = list(CURATED_COLLECTIONS)
+# Niveau calculé -> niveau dont il fusionne les partiels (dans l'ordre de calcul)
+ROLLUP_SOURCES = {"weekly": "daily", "monthly": "daily", "yearly": "monthly"}
+PERIOD_LENGTHS = {"weekly": pd.DateOffset(weeks=1), "monthly": pd.DateOffset(months=1), "yearly": pd.DateOffset(years=1)}
+# Fusion de chaque partiel entre périodes
+MERGE_FUNCTIONS = {
+    "sum": "sum", "count": "sum", "rainy_days": "sum", "sum_rr3": "sum",
+    "min": "min", "max": "max", "max_gust": "max", "max_3h": "max",
+}
+
+def provision_collections(mongo_db, timeseries=False):
+    """Index unique (city, period) de chaque collection curated, et la collection time-series si demandée."""
+    for name in CURATED_COLLECTIONS.values():
+        ensure_curated_indexes(mongo_db[name])
+    if timeseries:
+        ensure_timeseries_collection(mongo_db)
+
+def period_start(periods, granularity):
+    """Début de la période de chaque date : lundi de la semaine, premier jour du mois ou de l'année."""
+    periods = pd.to_datetime(pd.Series(periods))
+    if granularity == "weekly":
+        return periods.dt.normalize() - pd.to_timedelta(periods.dt.weekday, unit="D")
+    return periods.dt.to_period("M" if granularity == "monthly" else "Y").dt.start_time
+
+def read_partials(collection, keys, granularity):
+    """Partiels des documents source couvrant les périodes (city, period) à recalculer."""
+    ranges = keys.groupby("city")["period"].agg(["min", "max"])
+    query = {"$or": [
+        {"city": city, "period": {
+            "$gte": first.strftime("%Y-%m-%d"),
+            "$lt": (last + PERIOD_LENGTHS[granularity]).strftime("%Y-%m-%d"),
+        }}
+        for city, first, last in ranges.itertuples()
+    ]}
+    documents = list(collection.find(query, {"_id": 0, "city": 1, "period": 1, "partials": 1}))
+    return pd.json_normalize(documents, sep="_")
+
+def merge_partials(df, granularity):
+    """Fusionne les partiels par ville et par période du niveau demandé."""
+    columns = {
+        f"partials_{metric}_{key}": MERGE_FUNCTIONS[key]
+        for metric, fields in PARTIAL_FIELDS.items() for key in fields
+    }
+    df = df.assign(period=period_start(df["period"], granularity))
+    return df.groupby(["city", "period"]).agg(columns).reset_index()
+
+def metrics_from_partials(partials):
+    """Métriques d'un document (même forme que les documents journaliers) à partir de ses partiels."""
+    metrics = {}
+    for metric, values in partials.items():
+        if metric == "rainfall":
+            metrics[metric] = {
+                "total": round(values["sum"], 3), "days_with_rain": int(values["rainy_days"]),
+                "total_rr3": round(values["sum_rr3"], 3), "max_3h": values["max_3h"],
+            }
+        else:
+            average = round(values["sum"] / values["count"], 3) if values["count"] else None
+            metrics[metric] = {"avg": average, **{key: values[key] for key in ("min", "max", "max_gust") if key in values}}
+    return metrics
+
+def build_rollup_documents(df):
+    documents = []
+    for record in df.to_dict("records"):
+        partials = {
+            metric: {key: record[f"partials_{metric}_{key}"] for key in fields}
+            for metric, fields in PARTIAL_FIELDS.items()
+        }
+        documents.append({
+            "city": record["city"],
+            "period": record["period"].strftime("%Y-%m-%d"),
+            "metrics": metrics_from_partials(partials),
+            "partials": partials,
+        })
+    return documents
+
+def update_rollups(mongo_db, touched):
+    """
+    Recalcule les semaines, mois et années contenant les jours (city, period) qui viennent
+    d'être écrits, et seulement ceux-là. Retourne le nombre de documents écrits par niveau.
+    """
+    touched = pd.DataFrame(list(touched), columns=["city", "period"])
+    written = {}
+    for granularity, source in ROLLUP_SOURCES.items():
+        if touched.empty:
+            break
+        keys = touched.assign(period=period_start(touched["period"], granularity)).drop_duplicates()
+        df = read_partials(mongo_db[CURATED_COLLECTIONS[source]], keys, granularity)
+        if df.empty:
+            continue
+        # Les plages lues par ville peuvent couvrir des périodes non modifiées : elles sont écartées
+        merged = merge_partials(df, granularity).merge(keys, on=["city", "period"])
+        written[granularity] = upsert_documents(mongo_db[ROLLUP_COLLECTIONS[granularity]], build_rollup_documents(merged))
+    return written
@@ -0,0 +1,261 @@
+import queue
+import threading
+import time
+
+import pandas as pd
+from pymongo import ASCENDING, ReplaceOne
+from sqlalchemy import text
+
+from mysql_loader import CHANGED_DAYS_TABLE
+
+# Écriture de la zone curated commune à process_to_curated et fast_process_to_curated :
+# un document par ville et par jour, identifié par (city, period) et remplacé en place
+# (upsert) à chaque recalcul, ce qui rend les exécutions rejouables sans doublons.
+CURATED_MODES = ["incremental", "full"]
+CURATED_MODE = "incremental"
+DAILY_COLLECTION = "WeatherStats"
+TIMESERIES_COLLECTION = "WeatherStatsSeries"
+CURATED_INDEX = "city_period"
+CURATED_INDEX_KEYS = [("city", ASCENDING), ("period", ASCENDING)]
+# Écriture par lots (CuratedWriter) : taille des lots, lots en attente, threads d'envoi
+WRITE_BATCH_SIZE = 1000
+WRITE_QUEUE_SIZE = 4
+WRITE_THREADS = 2
+
+# Champs des documents : {métrique: {clé du document: colonne de l'agrégat SQL}}. Un jour compte
+# ses heures pluvieuses (hours_with_rain) ; les semaines, mois et années leurs jours de pluie (days_with_rain)
+METRIC_FIELDS = {
+    "temperature": {"avg": "avg_temp", "min": "min_temp", "max": "max_temp"},
+    "pressure": {"avg": "avg_pressure", "min": "min_pressure", "max": "max_pressure"},
+    "wind_speed": {"avg": "avg_wind_speed", "max": "max_wind_speed", "max_gust": "max_gust"},
+    "rainfall": {"total": "total_rainfall", "hours_with_rain": "hours_with_rain", "total_rr3": "total_rr3", "max_3h": "max_rr3"},
+}
+# Agrégats partiels fusionnables (somme, effectif, min, max) conservés dans chaque document,
+# à partir desquels curated_rollups calcule les semaines, mois et années sans relire la staging
+PARTIAL_FIELDS = {
+    "temperature": {"sum": "sum_temp", "count": "count_temp", "min": "min_temp", "max": "max_temp"},
+    "pressure": {"sum": "sum_pressure", "count": "count_pressure", "min": "min_pressure", "max": "max_pressure"},
+    "wind_speed": {"sum": "sum_wind_speed", "count": "count_wind_speed", "max": "max_wind_speed", "max_gust": "max_gust"},
+    "rainfall": {"sum": "total_rainfall", "rainy_days": "rainy_days", "sum_rr3": "total_rr3", "max_3h": "max_rr3"},
+}
+# Champ le plus récent des documents : son absence signale un document d'un format antérieur
+LATEST_FIELD = "metrics.rainfall.hours_with_rain"
+
+def ensure_curated_indexes(collection):
+    """
+    Index unique (city, period) : sert les upserts et les lectures par ville (API, Streamlit).
+    Les doublons laissés par les anciennes insertions sont supprimés avant sa création, et
+    un index (city, period) non unique d'une version précédente est remplacé.
+    """
+    indexes = collection.index_information()
+    if indexes.get(CURATED_INDEX, {}).get("unique"):
+        return
+    removed = remove_duplicate_documents(collection)
+    if removed:
+        print(f"{collection.name} : {removed} documents en double supprimés.")
+    for name, info in indexes.items():
+        if list(info["key"]) == CURATED_INDEX_KEYS:
+            collection.drop_index(name)
+    collection.create_index(CURATED_INDEX_KEYS, name=CURATED_INDEX, unique=True)
+
+def remove_duplicate_documents(collection):
+    """Supprime les documents en double sur (city, period), en gardant le plus récent."""
+    pipeline = [
+        {"$sort": {"_id": ASCENDING}},
+        {"$group": {"_id": {"city": "$city", "period": "$period"}, "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ]
+    duplicates = [id_ for group in collection.aggregate(pipeline, allowDiskUse=True) for id_ in group["ids"][:-1]]
+    if duplicates:
+        collection.delete_many({"_id": {"$in": duplicates}})
+    return len(duplicates)
+
+def ensure_timeseries_collection(mongo_db):
+    """
+    Collection time-series optionnelle des documents journaliers : date (début du jour) comme
+    champ de temps et city comme champ méta, les mesures d'une ville étant regroupées en buckets.
+    """
+    if TIMESERIES_COLLECTION not in mongo_db.list_collection_names():
+        mongo_db.create_collection(TIMESERIES_COLLECTION, timeseries={
+            "timeField": "date", "metaField": "city", "granularity": "hours",
+        })
+    collection = mongo_db[TIMESERIES_COLLECTION]
+    collection.create_index([("city", ASCENDING), ("date", ASCENDING)])
+    return collection
+
+def sync_timeseries(mongo_db, touched):
+    """
+    Recopie dans la collection time-series les documents journaliers (city, period) écrits.
+    Une collection time-series n'accepte pas d'upsert : les jours sont supprimés puis réinsérés.
+    """
+    periods_by_city = {}
+    for city, period in touched:
+        periods_by_city.setdefault(city, []).append(period)
+    if not periods_by_city:
+        return 0
+    daily = mongo_db[DAILY_COLLECTION].find(
+        {"$or": [{"city": city, "period": {"$in": periods}} for city, periods in periods_by_city.items()]},
+        {"_id": 0, "partials": 0},
+    )
+    documents = [{**document, "date": pd.Timestamp(document["period"]).to_pydatetime()} for document in daily]
+    collection = ensure_timeseries_collection(mongo_db)
+    collection.delete_many({"$or": [
+        {"city": city, "date": {"$in": [pd.Timestamp(period).to_pydatetime() for period in periods]}}
+        for city, periods in periods_by_city.items()
+    ]})
+    if documents:
+        collection.insert_many(documents, ordered=False)
+    return len(documents)
+
+def nested_documents(df, fields):
+    """
+    Sous-documents {métrique: {clé: valeur}} construits colonne par colonne : chaque colonne
+    est convertie une seule fois en liste Python, puis les listes sont assemblées par zip.
+    """
+    columns = {
+        metric: [df[column].tolist() for column in metric_fields.values()]
+        for metric, metric_fields in fields.items()
+    }
+    per_metric = [
+        [dict(zip(metric_fields, values)) for values in zip(*columns[metric])]
+        for metric, metric_fields in fields.items()
+    ]
+    return [dict(zip(fields, values)) for values in zip(*per_metric)]
+
+def build_daily_documents(city, df):
+    """Documents journaliers d'une ville à partir des agrégats SQL (une ligne par jour)."""
+    periods = pd.to_datetime(df["period"]).dt.strftime("%Y-%m-%d").tolist()
+    df = df.assign(rainy_days=(df["total_rainfall"] > 0).astype(int))
+    return [
+        {"city": city, "period": period, "metrics": metrics, "partials": partials, "extreme_events": []}
+        for period, metrics, partials in zip(periods, nested_documents(df, METRIC_FIELDS), nested_documents(df, PARTIAL_FIELDS))
+    ]
+
+def upsert_requests(documents):
+    return [ReplaceOne({"city": doc["city"], "period": doc["period"]}, doc, upsert=True) for doc in documents]
+
+def upsert_documents(collection, documents):
+    """Remplace (ou crée) chaque document selon sa clé (city, period), en un seul bulk_write."""
+    if not documents:
+        return 0
+    result = collection.bulk_write(upsert_requests(documents), ordered=False)
+    return result.upserted_count + result.modified_count
+
+class CuratedWriter:
+    """
+    Écriture des documents curated par lots, en parallèle de leur construction : write()
+    découpe les documents en lots de batch_size upserts (ReplaceOne sur (city, period)),
+    déposés dans une file bornée que des threads d'écriture envoient par bulk_write non
+    ordonné. La file bornée limite la mémoire : un producteur plus rapide que le réseau
+    attend qu'un lot parte. write() peut être appelé depuis plusieurs threads.
+    """
+    def __init__(self, collection, batch_size=WRITE_BATCH_SIZE, queue_size=WRITE_QUEUE_SIZE, writers=WRITE_THREADS):
+        if batch_size < 1:
+            raise ValueError(f"Taille de lot invalide : {batch_size} (au moins 1 document par lot)")
+        self.collection = collection
+        self.batch_size = batch_size
+        self.batches = queue.Queue(maxsize=queue_size)
+        self.pending = []
+        self.lock = threading.Lock()
+        self.documents = 0
+        self.written = 0
+        self.errors = []
+        self.started_at = time.perf_counter()
+        self.threads = [threading.Thread(target=self.send_batches, daemon=True) for _ in range(writers)]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, documents):
+        with self.lock:
+            self.pending.extend(documents)
+            self.documents += len(documents)
+            full = len(self.pending) - len(self.pending) % self.batch_size
+            batches = [self.pending[i:i + self.batch_size] for i in range(0, full, self.batch_size)]
+            del self.pending[:full]
+        for batch in batches:
+            self.batches.put(batch)
+
+    def send_batches(self):
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            if self.errors:
+                continue  # Après une erreur, la file est vidée sans écrire pour ne pas bloquer les producteurs
+            try:
+                result = self.collection.bulk_write(upsert_requests(batch), ordered=False)
+                with self.lock:
+                    self.written += result.upserted_count + result.modified_count
+            except Exception as e:
+                self.errors.append(e)
+
+    def close(self):
+        """Envoie le dernier lot, attend les threads d'écriture et relance la première erreur."""
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            self.batches.put(batch)
+        for _ in self.threads:
+            self.batches.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+        if self.errors:
+            raise self.errors[0]
+
+    def report(self):
+        rate = self.documents / self.elapsed if self.elapsed else 0
+        return f"{self.documents} documents envoyés en {self.elapsed:.2f} s -> {rate:,.0f} documents/s ({self.written} insérés ou modifiés)"
+
+def read_changed_days(engine):
+    """
+    Jours modifiés en staging depuis le dernier passage (table remplie par les triggers de
+    mysql_loader) : DataFrame city, day, marked_at. Vide si la table n'existe pas encore.
+    """
+    with engine.connect() as conn:
+        exists = conn.execute(text("""
+            SELECT COUNT(*) FROM information_schema.tables
+            WHERE table_schema = 'staging' AND table_name = :table;
+        """), {"table": CHANGED_DAYS_TABLE}).scalar()
+        if not exists:
+            return pd.DataFrame(columns=["city", "day", "marked_at"])
+        return pd.read_sql_query(text(f"SELECT city, day, marked_at FROM `{CHANGED_DAYS_TABLE}`;"), conn)
+
+def changed_days_by_city(changes, cities):
+    """{ville: [jours modifiés]} pour les villes demandées."""
+    changes = changes[changes["city"].isin(cities)]
+    return {city: sorted(group["day"]) for city, group in changes.groupby("city")}
+
+def plan_cities(collection, changes, cities, mode=CURATED_MODE):
+    """
+    {ville: jours à recalculer} : None (toute la ville) en mode full, si la collection curated
+    est encore vide (premier passage) ou d'un format antérieur ; sinon les seuls jours modifiés.
+    """
+    if mode == "incremental" and collection.estimated_document_count() == 0:
+        print("Collection curated vide : recalcul complet.")
+        mode = "full"
+    elif mode == "incremental" and collection.find_one({LATEST_FIELD: {"$exists": False}}, {"_id": 1}):
+        print("Documents curated d'un format antérieur : recalcul complet.")
+        mode = "full"
+    if mode == "full":
+        return {city: None for city in cities}
+    return changed_days_by_city(changes, cities)
+
+def clear_changed_days(engine, changes):
+    """
+    Retire les jours traités. Seules les lignes lues sont supprimées, et seulement si elles
+    n'ont pas été marquées de nouveau entre-temps (marked_at inchangé).
+    """
+    if changes.empty:
+        return
+    with engine.begin() as conn:
+        conn.execute(
+            text(f"DELETE FROM `{CHANGED_DAYS_TABLE}` WHERE city = :city AND day = :day AND marked_at = :marked_at;"),
+            changes[["city", "day", "marked_at"]].to_dict("records"),
+        )
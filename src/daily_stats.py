@@ -0,0 +1,169 @@
+from datetime import timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from sqlalchemy import text
+
+from mysql_loader import CHANGED_DAYS_TABLE, OBSERVATIONS_TABLE, STATIONS_TABLE
+
+# Calcul des agrégats journaliers de la zone curated :
+#   per-city    : une requête GROUP BY par table de ville (une connexion et un parcours par ville)
+#   single-scan : toutes les villes en une seule requête SQL, groupée par (ville, jour)
+#   parquet     : group-by Arrow vectorisé sur le jeu de données Parquet de la zone staging
+AGGREGATION_ENGINES = ["per-city", "single-scan", "parquet"]
+AGGREGATION_ENGINE = "single-scan"
+PARQUET_STAGING_DIR = "/opt/airflow/data/staging/parquet/"
+
+DAILY_METRICS_SQL = """
+        AVG(tc) AS avg_temp, MIN(tc) AS min_temp, MAX(tc) AS max_temp,
+        AVG(pmer) AS avg_pressure, MIN(pmer) AS min_pressure, MAX(pmer) AS max_pressure,
+        AVG(ff) AS avg_wind_speed, MAX(ff) AS max_wind_speed,
+        SUM(rr1) AS total_rainfall, COUNT(CASE WHEN rr1 > 0 THEN 1 END) AS hours_with_rain,
+        SUM(tc) AS sum_temp, COUNT(tc) AS count_temp,
+        SUM(pmer) AS sum_pressure, COUNT(pmer) AS count_pressure,
+        SUM(ff) AS sum_wind_speed, COUNT(ff) AS count_wind_speed,
+        MAX(rafper) AS max_gust, MAX(rr3) AS max_rr3,
+        SUM(CASE WHEN HOUR(date) IN (3, 6, 9, 12, 15, 18, 21) THEN rr3 END) AS rr3_day,
+        SUM(CASE WHEN HOUR(date) = 0 THEN rr3 END) AS rr3_midnight
+"""
+# Agrégats Arrow équivalents : (colonne, fonction) -> nom de la colonne produite
+PARQUET_AGGREGATES = {
+    ("tc", "mean"): "avg_temp", ("tc", "min"): "min_temp", ("tc", "max"): "max_temp",
+    ("pmer", "mean"): "avg_pressure", ("pmer", "min"): "min_pressure", ("pmer", "max"): "max_pressure",
+    ("ff", "mean"): "avg_wind_speed", ("ff", "max"): "max_wind_speed",
+    ("rr1", "sum"): "total_rainfall", ("rain", "sum"): "hours_with_rain",
+    ("tc", "sum"): "sum_temp", ("tc", "count"): "count_temp",
+    ("pmer", "sum"): "sum_pressure", ("pmer", "count"): "count_pressure",
+    ("ff", "sum"): "sum_wind_speed", ("ff", "count"): "count_wind_speed",
+    ("rafper", "max"): "max_gust", ("rr3", "max"): "max_rr3",
+    ("rr3_day", "sum"): "rr3_day", ("rr3_midnight", "sum"): "rr3_midnight",
+}
+# Mesures lues dans le jeu Parquet. La staging MySQL les charge à 0 quand elles manquent (voir
+# to_mysql_rows) : elles sont complétées de même ici, pour que moyennes et effectifs ne
+# dépendent pas du moteur d'agrégation
+PARQUET_MEASURES = ["tc", "pmer", "ff", "rr1", "rafper", "rr3"]
+# Cumul rr3 de la journée J : rr3 couvre les 3 h qui précèdent l'observation, la journée se
+# compose donc des observations de 03 h à 21 h de J et de celle de 00 h de J+1. Les requêtes
+# donnent les deux parties par jour (rr3_day, rr3_midnight), réunies par merge_midnight_rr3.
+DAY_RR3_HOURS = pa.array([3, 6, 9, 12, 15, 18, 21], pa.int64())
+DAILY_STATS_COLUMNS = ["city", "period", *[name for name in PARQUET_AGGREGATES.values() if not name.startswith("rr3_")],
+                       "total_rr3"]
+
+# Restriction aux jours modifiés (mode incrémental) : semi-jointure sur la table des jours
+# modifiés, par plage de dates pour que MySQL utilise la clé (station_id, date) / idx_date.
+# La plage couvre la veille (son cumul rr3 se termine à 00 h du jour modifié) et 00 h du lendemain.
+CHANGED_DAYS_FILTER = f"""
+    WHERE EXISTS (
+        SELECT 1 FROM `{CHANGED_DAYS_TABLE}` c
+        WHERE c.city = {{city}} AND date BETWEEN c.day - INTERVAL 1 DAY AND c.day + INTERVAL 1 DAY
+    )
+"""
+
+def daily_stats_unified(engine, incremental=False):
+    """Agrégats journaliers de toutes les villes depuis la table observations, en un seul parcours."""
+    changed_days = CHANGED_DAYS_FILTER.format(city="s.city") if incremental else ""
+    query = f"""
+    SELECT s.city AS city, DATE(date) AS period, {DAILY_METRICS_SQL}
+    FROM `{OBSERVATIONS_TABLE}` o
+    JOIN `{STATIONS_TABLE}` s ON s.station_id = o.station_id
+    {changed_days}
+    GROUP BY s.city, DATE(date);
+    """
+    return pd.read_sql_query(text(query), engine)
+
+def daily_stats_per_city_tables(engine, cities, incremental=False):
+    """
+    Agrégats journaliers des tables de ville en une seule requête (UNION ALL des GROUP BY
+    de chaque table) : un seul aller-retour, chaque table n'est lue qu'une fois.
+    """
+    if not cities:
+        return pd.DataFrame(columns=DAILY_STATS_COLUMNS)
+    selects = []
+    params = {}
+    for i, city in enumerate(cities):
+        params[f"city_{i}"] = city
+        changed_days = CHANGED_DAYS_FILTER.format(city=f":city_{i}") if incremental else ""
+        selects.append(f"""
+    SELECT :city_{i} AS city, DATE(date) AS period, {DAILY_METRICS_SQL}
+    FROM `{city}` {changed_days}
+    GROUP BY DATE(date)""")
+    query = "\n    UNION ALL".join(selects) + ";"
+    return pd.read_sql_query(text(query), engine, params=params)
+
+def daily_stats_parquet(dataset_dir=PARQUET_STAGING_DIR, changes=None):
+    """
+    Agrégats journaliers de toutes les stations du jeu de données Parquet (station=/year=/month=)
+    par un group-by Arrow. Avec changes (city, day), seuls les jours modifiés et leur veille sont conservés.
+    """
+    dataset = ds.dataset(dataset_dir, format="parquet", partitioning="hive")
+    filter_ = None
+    if changes is not None:
+        if changes.empty:
+            return pd.DataFrame(columns=DAILY_STATS_COLUMNS)
+        first_day = pd.Timestamp(min(changes["day"]) - timedelta(days=1), tz="UTC")
+        filter_ = ds.field("station").isin(sorted(changes["city"].unique())) & (ds.field("date") >= first_day)
+    table = dataset.to_table(columns=["station", "date", *PARQUET_MEASURES], filter=filter_)
+    table = table.filter(pc.is_valid(table["date"]))
+    for column in PARQUET_MEASURES:
+        table = table.set_column(table.schema.get_field_index(column), column, pc.fill_null(table[column], 0.0))
+    table = table.append_column("period", pc.cast(table["date"], pa.date32()))
+    table = table.append_column("rain", pc.cast(pc.greater(table["rr1"], 0), pa.int64()))
+    hours = pc.hour(table["date"])
+    no_rr3 = pa.scalar(None, pa.float64())
+    table = table.append_column("rr3_day", pc.if_else(pc.is_in(hours, value_set=DAY_RR3_HOURS), table["rr3"], no_rr3))
+    table = table.append_column("rr3_midnight", pc.if_else(pc.equal(hours, 0), table["rr3"], no_rr3))
+    grouped = table.group_by(["station", "period"]).aggregate(list(PARQUET_AGGREGATES))
+    df = grouped.to_pandas().rename(columns={
+        "station": "city",
+        **{f"{column}_{function}": name for (column, function), name in PARQUET_AGGREGATES.items()},
+    })
+    df["hours_with_rain"] = df["hours_with_rain"].fillna(0).astype(int)
+    df = merge_midnight_rr3(df)
+    return df if changes is None else keep_recomputed_days(df, changes)
+
+def recomputed_days(days):
+    """Jours à recalculer pour des jours modifiés : ces jours et leur veille (cumul rr3)."""
+    return sorted(set(days) | {day - timedelta(days=1) for day in days})
+
+def merge_midnight_rr3(df):
+    """
+    Remplace rr3_day et rr3_midnight par total_rr3 : cumul de 03 h à 21 h du jour et de 00 h
+    du lendemain (même ville). Sans aucune des deux parties, le cumul reste vide.
+    """
+    keys = ["city"] if "city" in df.columns else []
+    periods = pd.to_datetime(df["period"])
+    next_midnight = df[keys].assign(day=periods - pd.Timedelta(days=1), next_midnight=df["rr3_midnight"].astype(float))
+    merged = df[keys].assign(day=periods).merge(next_midnight, on=[*keys, "day"], how="left")
+    total = pd.DataFrame({"day": df["rr3_day"].astype(float).to_numpy(), "midnight": merged["next_midnight"].to_numpy()})
+    return df.drop(columns=["rr3_day", "rr3_midnight"]).assign(total_rr3=total.sum(axis=1, min_count=1).to_numpy())
+
+def keep_recomputed_days(df, changes):
+    """Lignes des jours à recalculer pour les jours modifiés (city, day) : les lignes lues en plus sont écartées."""
+    days = pd.DataFrame([
+        (city, pd.Timestamp(day)) for city, group in changes.groupby("city") for day in recomputed_days(group["day"])
+    ], columns=["city", "day"])
+    df = df.assign(day=pd.to_datetime(df["period"])).merge(days, on=["city", "day"])
+    return df.drop(columns="day")
+
+def daily_stats(engine, plan, layout, aggregation=AGGREGATION_ENGINE, changes=None):
+    """
+    Agrégats journaliers (colonne city) des villes du plan {ville: jours, None pour tous},
+    en un seul parcours de la zone staging. Le plan est incrémental dès qu'une ville a des jours.
+    """
+    if not plan:
+        return pd.DataFrame(columns=DAILY_STATS_COLUMNS)
+    incremental = any(days is not None for days in plan.values())
+    changes = changes[changes["city"].isin(plan)] if incremental else None
+    if aggregation == "parquet":
+        df = daily_stats_parquet(changes=changes)
+    else:
+        if layout == "unified":
+            df = daily_stats_unified(engine, incremental)
+        else:
+            df = daily_stats_per_city_tables(engine, list(plan), incremental)
+        df = merge_midnight_rr3(df)
+        if incremental:
+            df = keep_recomputed_days(df, changes)
+    return df[df["city"].isin(plan)].reset_index(drop=True)
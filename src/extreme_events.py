@@ -0,0 +1,216 @@
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from pymongo import ReplaceOne, UpdateOne
+
+from curated_store import DAILY_COLLECTION
+
+# Détection des événements extrêmes de la zone curated, à partir des métriques journalières
+# de chaque station. Les seuils combinent un minimum absolu et un percentile de l'historique
+# de la station (un jour « extrême » à Brest ne l'est pas à Marseille).
+HEAT_WAVE_MIN_DAYS = 3          # Jours consécutifs au-dessus du seuil de température maximale
+HEAT_WAVE_PERCENTILE = 0.95
+HEAT_WAVE_MIN_TEMP = 25.0       # °C
+GUST_PERCENTILE = 0.99
+GUST_MIN_SPEED = 20.0           # m/s (rafales sur la période, rafper)
+HEAVY_RAIN_PERCENTILE = 0.99
+HEAVY_RAIN_MIN_24H = 20.0       # mm, cumul des rr3 de la journée (03 h à 00 h du lendemain)
+HEAVY_RAIN_MIN_72H = 50.0       # mm, cumul glissant sur 3 jours
+RAIN_WINDOW_DAYS = 3
+
+# Métriques journalières lues dans les documents curated : {colonne: champ}
+EVENT_FIELDS = {
+    "max_temp": "metrics.temperature.max",
+    "max_gust": "metrics.wind_speed.max_gust",
+    "total_rr3": "metrics.rainfall.total_rr3",
+}
+# Seuils par station : {nom: (colonne, percentile, minimum absolu)}
+THRESHOLD_SPECS = {
+    "heat_wave": ("max_temp", HEAT_WAVE_PERCENTILE, HEAT_WAVE_MIN_TEMP),
+    "wind_gust": ("max_gust", GUST_PERCENTILE, GUST_MIN_SPEED),
+    "heavy_rain": ("total_rr3", HEAVY_RAIN_PERCENTILE, HEAVY_RAIN_MIN_24H),
+}
+
+# Les seuils sont mis en cache par ville : seul leur recalcul (cache absent ou expiré) relit
+# tout l'historique de la ville. Sinon, seule une fenêtre de CONTEXT_DAYS jours de part et
+# d'autre des jours écrits est lue, élargie tant qu'une vague de chaleur en dépasse le bord.
+THRESHOLDS_COLLECTION = "ExtremeEventThresholds"
+THRESHOLDS_MAX_AGE_DAYS = 30
+CONTEXT_DAYS = 14
+
+def read_daily_metrics(collection, ranges):
+    """
+    Métriques journalières des plages [(city, premier jour, dernier jour)], avec les événements
+    enregistrés (par l'index city, period). Une plage sans bornes lit tout l'historique de la ville.
+    """
+    clauses = []
+    for city, first, last in ranges:
+        clause = {"city": city}
+        if first is not None:
+            clause["period"] = {"$gte": first.strftime("%Y-%m-%d"), "$lte": last.strftime("%Y-%m-%d")}
+        clauses.append(clause)
+    projection = {"_id": 0, "city": 1, "period": 1, "extreme_events": 1, **{field: 1 for field in EVENT_FIELDS.values()}}
+    rows = [
+        {
+            "city": document["city"],
+            "period": document["period"],
+            "extreme_events": document.get("extreme_events", []),
+            **{column: nested_value(document, field) for column, field in EVENT_FIELDS.items()},
+        }
+        for document in collection.find({"$or": clauses}, projection)
+    ]
+    df = pd.DataFrame(rows, columns=["city", "period", "extreme_events", *EVENT_FIELDS])
+    df["period"] = pd.to_datetime(df["period"])
+    return df.sort_values(["city", "period"], ignore_index=True)
+
+def nested_value(document, field):
+    for key in field.split("."):
+        document = document.get(key) if isinstance(document, dict) else None
+    return document
+
+def station_thresholds(df):
+    """Seuils par station (index city) : percentile de son historique, au moins égal au minimum absolu."""
+    grouped = df.groupby("city")
+    return pd.DataFrame({
+        name: grouped[column].quantile(percentile).clip(lower=minimum)
+        for name, (column, percentile, minimum) in THRESHOLD_SPECS.items()
+    })
+
+def load_thresholds(collection, cities):
+    """Seuils en cache des villes (index city), hors ceux calculés il y a plus de THRESHOLDS_MAX_AGE_DAYS jours."""
+    oldest = datetime.now(timezone.utc) - timedelta(days=THRESHOLDS_MAX_AGE_DAYS)
+    documents = collection.find({"city": {"$in": cities}, "computed_at": {"$gte": oldest}},
+                                {"_id": 0, "city": 1, **{name: 1 for name in THRESHOLD_SPECS}})
+    return pd.DataFrame(list(documents), columns=["city", *THRESHOLD_SPECS]).set_index("city")
+
+def save_thresholds(collection, thresholds):
+    collection.create_index("city", unique=True)
+    computed_at = datetime.now(timezone.utc)
+    collection.bulk_write([
+        ReplaceOne({"city": city}, {"city": city, "computed_at": computed_at, **row}, upsert=True)
+        for city, row in thresholds.astype(float).to_dict("index").items()
+    ], ordered=False)
+
+def heat_runs(df, thresholds):
+    """Jours au-dessus du seuil de chaleur de leur station, et identifiant de leur série de jours consécutifs."""
+    hot = df["max_temp"] >= df["city"].map(thresholds["heat_wave"])
+    new_run = hot & ~(
+        hot.shift(fill_value=False)
+        & (df["city"] == df["city"].shift())
+        & (df["period"].diff() == pd.Timedelta(days=1))
+    )
+    return hot, new_run.cumsum()
+
+def rolling_sum(df, column, window):
+    """Cumul glissant par station sur une fenêtre calendaire (les jours manquants ne comptent pas)."""
+    sums = df.set_index("period").groupby("city", sort=False)[column].rolling(window, min_periods=1).sum()
+    return pd.Series(sums.to_numpy(), index=df.index)
+
+def detect_extreme_events(df, thresholds):
+    """
+    Événements extrêmes de chaque jour (liste par ligne) pour des métriques triées par ville et date :
+    vagues de chaleur, rafales et fortes pluies sur 24 h et 72 h. Tous les seuils et séries sont
+    calculés par colonnes entières ; seules les lignes marquées reçoivent une liste non vide.
+    """
+    hot, run_id = heat_runs(df, thresholds)
+    heat_run = hot.groupby(run_id).transform("sum").where(hot, 0)
+    heat_threshold = df["city"].map(thresholds["heat_wave"])
+    gust_threshold = df["city"].map(thresholds["wind_gust"])
+    rain_threshold = df["city"].map(thresholds["heavy_rain"])
+    rain_72h = rolling_sum(df, "total_rr3", f"{RAIN_WINDOW_DAYS}D")
+
+    checks = [
+        ("heat_wave", heat_run >= HEAT_WAVE_MIN_DAYS, df["max_temp"], heat_threshold, {"duration_days": heat_run}),
+        ("wind_gust", df["max_gust"] >= gust_threshold, df["max_gust"], gust_threshold, {}),
+        ("heavy_rain", df["total_rr3"] >= rain_threshold, df["total_rr3"], rain_threshold, {"window": "24h"}),
+        ("heavy_rain", rain_72h >= HEAVY_RAIN_MIN_72H, rain_72h, pd.Series(HEAVY_RAIN_MIN_72H, index=df.index), {"window": "72h"}),
+    ]
+    events = pd.Series([[] for _ in range(len(df))], index=df.index, dtype=object)
+    for event_type, flags, values, limits, extra in checks:
+        for i in flags[flags].index:
+            event = {"type": event_type, "value": round(float(values[i]), 3), "threshold": round(float(limits[i]), 3)}
+            for key, value in extra.items():
+                event[key] = int(value[i]) if isinstance(value, pd.Series) else value
+            events[i].append(event)
+    return events
+
+def changed_ranges(touched):
+    """Jours écrits regroupés par ville en plages [(city, premier, dernier)] ; les jours proches sont fusionnés."""
+    touched = pd.DataFrame(list(touched), columns=["city", "period"])
+    touched["period"] = pd.to_datetime(touched["period"])
+    ranges = []
+    for city, periods in touched.groupby("city")["period"]:
+        periods = periods.drop_duplicates().sort_values()
+        range_id = (periods.diff() > pd.Timedelta(days=2 * CONTEXT_DAYS)).cumsum().to_numpy()
+        ranges += [(city, days.iloc[0], days.iloc[-1]) for _id, days in periods.groupby(range_id)]
+    return ranges
+
+def window_complete_rows(df, thresholds, first, last, start, end):
+    """
+    Lignes d'une fenêtre [start, end] lue autour des jours écrits [first, last] dont les événements
+    sont calculables : cumul 72 h et série de chaleur entièrement dans la fenêtre. Retourne None
+    si une série de chaleur voisine des jours écrits atteint le bord (la fenêtre doit être élargie).
+    """
+    hot, run_id = heat_runs(df, thresholds)
+    at_edge = hot & run_id.isin(run_id[hot & df["period"].isin([start, end])])
+    near_changes = df["period"].between(first - pd.Timedelta(days=1), last + pd.Timedelta(days=1))
+    if (at_edge & near_changes).any():
+        return None
+    return ~at_edge & (df["period"] >= start + pd.Timedelta(days=RAIN_WINDOW_DAYS - 1))
+
+def event_updates(df, events, rows=None):
+    """UpdateOne des jours (parmi rows) dont les événements calculés diffèrent de ceux enregistrés."""
+    changed = [new != old for new, old in zip(events, df["extreme_events"])]
+    if rows is not None:
+        changed = [flag and row for flag, row in zip(changed, rows)]
+    return [
+        UpdateOne(
+            {"city": df.at[i, "city"], "period": df.at[i, "period"].strftime("%Y-%m-%d")},
+            {"$set": {"extreme_events": events[i]}},
+        )
+        for i in df.index[changed]
+    ]
+
+def update_extreme_events(mongo_db, touched):
+    """
+    Met à jour les événements extrêmes autour des jours (city, period) qui viennent d'être écrits.
+    Une ville sans seuils en cache (ou expirés) est réévaluée sur tout son historique, qui sert
+    aussi à recalculer ses seuils ; les autres ne relisent qu'une fenêtre autour des jours écrits.
+    Seuls les jours dont les événements ont changé sont réécrits.
+    """
+    collection = mongo_db[DAILY_COLLECTION]
+    ranges = changed_ranges(touched)
+    if not ranges:
+        return 0
+    cities = sorted({city for city, _first, _last in ranges})
+    thresholds = load_thresholds(mongo_db[THRESHOLDS_COLLECTION], cities)
+    requests = []
+
+    stale = [city for city in cities if city not in thresholds.index]
+    if stale:
+        df = read_daily_metrics(collection, [(city, None, None) for city in stale])
+        if not df.empty:
+            fresh = station_thresholds(df)
+            save_thresholds(mongo_db[THRESHOLDS_COLLECTION], fresh)
+            requests += event_updates(df, detect_extreme_events(df, fresh))
+
+    pending = [(city, first, last, CONTEXT_DAYS) for city, first, last in ranges if city in thresholds.index]
+    while pending:
+        windows = [
+            (city, first - pd.Timedelta(days=context), last + pd.Timedelta(days=context))
+            for city, first, last, context in pending
+        ]
+        df = read_daily_metrics(collection, windows)
+        retry = []
+        for (city, first, last, context), (_city, start, end) in zip(pending, windows):
+            window = df[(df["city"] == city) & df["period"].between(start, end)].reset_index(drop=True)
+            rows = window_complete_rows(window, thresholds, first, last, start, end)
+            if rows is None:
+                retry.append((city, first, last, 2 * context))
+            else:
+                requests += event_updates(window, detect_extreme_events(window, thresholds), rows)
+        pending = retry
+
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+    return len(requests)
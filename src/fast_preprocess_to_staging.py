@@ -1,154 +1,306 @@
 import boto3
 import pandas as pd
-import json
 import os
 import time
-import pymysql
-from concurrent.futures import ThreadPoolExecutor
+import argparse
+import functools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tqdm import tqdm
 
+from raw_format import decode_records, is_raw_file
+from synop import COLUMNS_USED, station_table_name
+from raw_catalog import catalog_objects, list_all_objects
+from staging_writer import (
+    STAGING_WRITERS, list_parquet_stations, read_station_parquet, split_by_station, station_partitions, to_synop_types,
+)
+from mysql_loader import (
+    DUPLICATE_MODES,
+    LOAD_MODE,
+    LOAD_MODES,
+    ON_DUPLICATE,
+    STAGING_LAYOUT,
+    STAGING_LAYOUTS,
+    create_target_table,
+    load_arrow,
+    load_csv_file,
+    load_dataframe,
+    target_table,
+)
+from mysql_pool import MySQLPool
+from staging_decode import decode_to_station_batches, ipc_to_frame
+
 # Configuration
 BUCKET_NAME = "raw"
-COLUMNS_USED = ['date', 'nom', 'pmer', 'tend', 'cod_tend', 'dd', 'ff', 'td', 'u', 'ww', 'pres', 'rafper', 'rr1', 'rr3', 'tc']
 CSV_OUTPUT_DIR = "/opt/airflow/data/staging/"
+PARQUET_OUTPUT_DIR = "/opt/airflow/data/staging/parquet/"
+STAGING_FORMAT = "csv"  # "csv" : un CSV par ville ; "parquet" : jeu Parquet partitionné station/année/mois ;
+                        # "direct" : tables Arrow en mémoire chargées directement dans MySQL
 MAX_WORKERS = 4  # Ajuste selon les ressources de la machine
+POOL_SIZE = MAX_WORKERS  # Connexions MySQL, une par thread d'insertion
+MEMORY_BUDGET_MB = None  # None : tout est écrit en fin de traitement ; sinon taille max du tampon en Mo
+DECODE_PROCESSES = 0  # 0 : décodage JSON dans les threads ; sinon taille du pool de processus de décodage
 
-# Connexion MySQL
-conn = pymysql.connect(
-    host="mysql",
-    port=3306,
-    user="root",
-    password="root",
-    database="staging",
-    autocommit=True  # Améliore les performances en évitant commit() après chaque insertion
-)
-cursor = conn.cursor()
-
-# Connexion S3
-s3 = boto3.client(
-    "s3",
-    endpoint_url="http://localstack:4566",
-    aws_access_key_id="root",
-    aws_secret_access_key="root"
-)
+# Connexion S3, créée au premier appel et non à l'import : les processus de décodage
+# réimportent ce module (voir iter_station_batches)
+@functools.cache
+def get_s3():
+    return boto3.client(
+        "s3",
+        endpoint_url="http://localstack:4566",
+        aws_access_key_id="root",
+        aws_secret_access_key="root"
+    )
 
 # Fonctions S3
 def get_s3_objects(bucket_name, prefix=""):
     try:
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-        return response.get("Contents", [])
+        return list_all_objects(get_s3(), bucket_name, prefix)
     except Exception as e:
         print(f"Erreur S3 : {e}")
         return []
 
+def get_partitioned_objects(bucket_name, start=None, end=None, refresh=False):
+    """
+    Objets des partitions year=/month= comprises entre start et end (YYYY-MM),
+    lus depuis le catalogue du bucket (relisté pour ces partitions si refresh=True).
+    """
+    try:
+        return catalog_objects(get_s3(), bucket_name, start, end, refresh)
+    except ValueError:
+        raise
+    except Exception as e:
+        print(f"Erreur lors de la lecture du catalogue S3 : {e}")
+        return []
+
 def get_s3_object_data(bucket_name, object_key):
     try:
-        response = s3.get_object(Bucket=bucket_name, Key=object_key)
-        return json.loads(response["Body"].read())
+        response = get_s3().get_object(Bucket=bucket_name, Key=object_key)
+        return decode_records(response["Body"].read(), object_key)
+    except Exception as e:
+        print(f"Erreur S3 ({object_key}) : {e}")
+        return None
+
+def get_s3_object_bytes(bucket_name, object_key):
+    """Téléchargement seul, sans décodage (le décodage est fait par le pool de processus)."""
+    try:
+        return get_s3().get_object(Bucket=bucket_name, Key=object_key)["Body"].read()
     except Exception as e:
         print(f"Erreur S3 ({object_key}) : {e}")
         return None
 
 # Traitement des données
 def json_to_dataframe(json_data):
+    """DataFrame des colonnes utilisées, directement avec les types compacts de SYNOP_DTYPES."""
     try:
-        return pd.DataFrame(json_data)
+        return to_synop_types(pd.DataFrame.from_records(json_data, columns=COLUMNS_USED))
     except ValueError as e:
         print(f"Erreur DataFrame : {e}")
         return pd.DataFrame()
 
 def clean_file_name(file_name):
-    return file_name.replace("METEO", "").replace(" ", "_").replace("-", "_").replace("'", "_")
+    return station_table_name(file_name)
 
-def process_s3_data_to_csv(bucket_name):
-    objects = get_s3_objects(bucket_name)
-    data_by_nom = {}
-
-    # Parallélisation du téléchargement et du traitement JSON
+def iter_s3_object_data(bucket_name, keys, max_in_flight, fetch=get_s3_object_data):
+    """
+    Télécharge les objets en parallèle en gardant au plus max_in_flight objets
+    en cours ou en attente, et les rend dans l'ordre des clés.
+    """
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(get_s3_object_data, bucket_name, obj["Key"]): obj["Key"] for obj in objects if obj["Key"].endswith(".json")}
+        pending = deque()
+        for key in keys:
+            pending.append((key, executor.submit(fetch, bucket_name, key)))
+            if len(pending) >= max_in_flight:
+                key_done, future = pending.popleft()
+                yield key_done, future.result()
+        while pending:
+            key_done, future = pending.popleft()
+            yield key_done, future.result()
+
+def iter_station_batches(bucket_name, keys, max_in_flight, decode_processes):
+    """
+    Les téléchargements S3 se font dans les threads, tandis que le décodage JSON, la
+    construction des DataFrames et le découpage par station tournent dans un pool de
+    processus (hors GIL). Chaque objet revient sous forme de [(nom, tampon Arrow IPC)].
+    """
+    # forkserver : le serveur ne précharge que staging_decode, mais chaque processus réexécute
+    # aussi ce script sous le nom __mp_main__ (sans le bloc __main__). Rien n'y ouvre de connexion
+    # à l'import : le client S3 est créé à la demande et le pool MySQL dans le bloc __main__
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["staging_decode"])
+    with ProcessPoolExecutor(max_workers=decode_processes, mp_context=context) as decoders:
+        pending = deque()
+        for key, data_bytes in iter_s3_object_data(bucket_name, keys, max_in_flight, get_s3_object_bytes):
+            if data_bytes is not None:
+                pending.append((key, decoders.submit(decode_to_station_batches, data_bytes, key, COLUMNS_USED)))
+            else:
+                yield key, []
+            if len(pending) >= max_in_flight:
+                key_done, future = pending.popleft()
+                yield key_done, future.result()
+        while pending:
+            key_done, future = pending.popleft()
+            yield key_done, future.result()
 
-        for future in tqdm(futures, desc="Traitement S3"):
-            key = futures[future]
-            json_data = future.result()
+def process_s3_data_to_csv(bucket_name, start=None, end=None, refresh_catalog=False, memory_budget_mb=MEMORY_BUDGET_MB,
+                           decode_processes=DECODE_PROCESSES, staging_format=STAGING_FORMAT, load=None):
+    """Écrit la zone staging des mois demandés. Retourne les fichiers CSV ou partitions Parquet écrits."""
+    objects = get_partitioned_objects(bucket_name, start, end, refresh_catalog)
+    keys = [obj["Key"] for obj in objects if is_raw_file(obj["Key"])]
+
+    # Parallélisation du téléchargement et du traitement JSON, avec un nombre
+    # d'objets en mémoire limité quand un budget est fixé
+    max_in_flight = len(keys) if memory_budget_mb is None else 2 * max(MAX_WORKERS, decode_processes)
+    max_in_flight = max(max_in_flight, 1)
+    output_dir = PARQUET_OUTPUT_DIR if staging_format == "parquet" else CSV_OUTPUT_DIR
+    # Mode direct : pas de fichier, chaque station est transmise à load(ville, table Arrow)
+    writer_options = {"load": load} if staging_format == "direct" else {}
+    with STAGING_WRITERS[staging_format](output_dir, clean_file_name, memory_budget_mb, **writer_options) as writer:
+        if decode_processes:
+            for key, batches in tqdm(iter_station_batches(bucket_name, keys, max_in_flight, decode_processes),
+                                     total=len(keys), desc="Traitement S3"):
+                for nom, buffer in batches:
+                    writer.add(nom, ipc_to_frame(buffer))
+                writer.end_object()
+            return writer.started
+
+        for key, json_data in tqdm(iter_s3_object_data(bucket_name, keys, max_in_flight),
+                                   total=len(keys), desc="Traitement S3"):
             if json_data:
                 df = json_to_dataframe(json_data)
                 if not df.empty:
                     df_filtered = df[COLUMNS_USED]
-                    for nom in df_filtered['nom'].unique():
-                        df_nom = df_filtered[df_filtered['nom'] == nom]
-                        if nom not in data_by_nom:
-                            data_by_nom[nom] = []
-                        data_by_nom[nom].append(df_nom)
-
-    os.makedirs(CSV_OUTPUT_DIR, exist_ok=True)
-
-    # Sauvegarde des CSV
-    for nom, df_list in data_by_nom.items():
-        final_df = pd.concat(df_list, ignore_index=True)
-        final_df.to_csv(os.path.join(CSV_OUTPUT_DIR, f"{clean_file_name(nom)}.csv"), index=False)
+                    for nom, df_nom in split_by_station(df_filtered):
+                        writer.add(nom, df_nom)
+            writer.end_object()
+    return writer.started
 
 # Gestion MySQL
-def create_table_if_not_exists(city):
+def create_table_if_not_exists(cursor, city):
     try:
-        cursor.execute(f"""
-            CREATE TABLE IF NOT EXISTS staging.`{city}` (
-                date DATE,
-                nom VARCHAR(255),
-                pmer DOUBLE,
-                tend DOUBLE,
-                cod_tend VARCHAR(50),
-                dd DOUBLE,
-                ff DOUBLE,
-                td DOUBLE,
-                u DOUBLE,
-                ww VARCHAR(10),
-                pres DOUBLE,
-                rafper DOUBLE,
-                rr1 DOUBLE,
-                rr3 DOUBLE,
-                tc DOUBLE
-            );
-        """)
+        create_target_table(cursor, city)
     except Exception as e:
         print(f"Erreur table {city} : {e}")
 
-def insert_data_from_csv(city, csv_file_path):
+def insert_dataframe(pool, city, df, load_mode=LOAD_MODE, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT):
+    """Insère les lignes d'une ville avec une connexion empruntée au pool, validée en fin de lot."""
     try:
-        city_table = city.replace("-", "_")
-        create_table_if_not_exists(city_table)
-
-        df = pd.read_csv(csv_file_path, dtype={"cod_tend": str, "ww": str}, low_memory=False).fillna(0)
-        insert_query = f"""
-            INSERT INTO staging.`{city_table}` ({', '.join(df.columns)})
-            VALUES ({', '.join(['%s'] * len(df.columns))});
-        """
-        cursor.executemany(insert_query, [tuple(row) for row in df.values])
+        city_table = target_table(city, layout)
+        with pool.connection() as conn, conn.cursor() as cursor:
+            create_table_if_not_exists(cursor, city_table)
+            load_dataframe(cursor, city_table, df, load_mode, on_duplicate)  # Remplace les NaN par des 0
+            conn.commit()
     except Exception as e:
         print(f"Erreur insertion {city} : {e}")
 
-def fast_process_csv_to_mysql():
+def insert_arrow(pool, city, arrow_table, load_mode=LOAD_MODE, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT):
+    """Mode direct : les lignes arrivent en table Arrow depuis process_s3_data_to_csv, sans CSV."""
+    try:
+        city_table = target_table(city, layout)
+        with pool.connection() as conn, conn.cursor() as cursor:
+            create_table_if_not_exists(cursor, city_table)
+            load_arrow(cursor, city_table, arrow_table, load_mode, on_duplicate)
+            conn.commit()
+    except Exception as e:
+        print(f"Erreur insertion {city} : {e}")
+
+def insert_csv_file(pool, city, csv_file_path, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT):
+    """Mode infile : le CSV est envoyé tel quel au serveur, sans passer par pandas."""
+    try:
+        city_table = target_table(city, layout)
+        with pool.connection() as conn, conn.cursor() as cursor:
+            create_table_if_not_exists(cursor, city_table)
+            load_csv_file(cursor, city_table, csv_file_path, on_duplicate)
+            conn.commit()
+    except Exception as e:
+        print(f"Erreur insertion {city} : {e}")
+
+def insert_data_from_csv(pool, city, csv_file_path, load_mode=LOAD_MODE, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT):
+    if load_mode == "infile":
+        insert_csv_file(pool, city, csv_file_path, on_duplicate, layout)
+        return
+    try:
+        df = pd.read_csv(csv_file_path, dtype={"cod_tend": str, "ww": str}, low_memory=False)
+    except Exception as e:
+        print(f"Erreur lecture {csv_file_path} : {e}")
+        return
+    insert_dataframe(pool, city, df, load_mode, on_duplicate, layout)
+
+def insert_data_from_parquet(pool, city, station_dir, load_mode=LOAD_MODE, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT):
+    try:
+        df = read_station_parquet(station_dir, COLUMNS_USED)
+    except Exception as e:
+        print(f"Erreur lecture Parquet {city} : {e}")
+        return
+    insert_dataframe(pool, city, df, load_mode, on_duplicate, layout)
+
+def fast_process_csv_to_mysql(load_mode=LOAD_MODE, pool_size=POOL_SIZE, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT):
     csv_files = [f for f in os.listdir(CSV_OUTPUT_DIR) if f.endswith(".csv")]
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(insert_data_from_csv, os.path.splitext(f)[0], os.path.join(CSV_OUTPUT_DIR, f)): f for f in csv_files}
+    # Autant de threads que de connexions : chaque thread insère avec sa propre connexion
+    with MySQLPool(pool_size) as pool, ThreadPoolExecutor(max_workers=pool_size) as executor:
+        futures = {executor.submit(insert_data_from_csv, pool, os.path.splitext(f)[0], os.path.join(CSV_OUTPUT_DIR, f), load_mode, on_duplicate, layout): f for f in csv_files}
+
+        for future in tqdm(futures, desc="Insertion MySQL"):
+            future.result()  # Vérifie les erreurs
+
+def fast_process_parquet_to_mysql(load_mode=LOAD_MODE, pool_size=POOL_SIZE, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT,
+                                  partitions=None):
+    """Charge les partitions Parquet écrites par le traitement (partitions), ou tout le jeu de données sans liste."""
+    stations = list_parquet_stations(PARQUET_OUTPUT_DIR) if partitions is None else station_partitions(partitions)
+
+    with MySQLPool(pool_size) as pool, ThreadPoolExecutor(max_workers=pool_size) as executor:
+        futures = {executor.submit(insert_data_from_parquet, pool, city, station_dir, load_mode, on_duplicate, layout): city for city, station_dir in stations.items()}
 
         for future in tqdm(futures, desc="Insertion MySQL"):
             future.result()  # Vérifie les erreurs
 
 # Main
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Traitement des fichiers raw vers la zone staging (CSV puis MySQL).")
+    parser.add_argument("--start", type=str, help="Premier mois à traiter (YYYY-MM). Par défaut, tout le bucket.")
+    parser.add_argument("--end", type=str, help="Dernier mois à traiter (YYYY-MM). Par défaut, égal à --start.")
+    parser.add_argument("--refresh-catalog", action="store_true",
+                        help="Reliste les partitions demandées dans le bucket avant de lire le catalogue.")
+    parser.add_argument("--memory-budget-mb", type=float, default=MEMORY_BUDGET_MB,
+                        help="Écrit les CSV au fil de l'eau dès que le tampon dépasse ce budget (0 : après chaque objet).")
+    parser.add_argument("--decode-processes", type=int, default=DECODE_PROCESSES,
+                        help="Décode les objets dans un pool de N processus (0 : décodage dans les threads).")
+    parser.add_argument("--staging-format", choices=list(STAGING_WRITERS), default=STAGING_FORMAT,
+                        help="Format de la zone staging : CSV par ville, Parquet partitionné, ou direct (en mémoire, sans fichier).")
+    parser.add_argument("--load-mode", choices=LOAD_MODES, default=LOAD_MODE,
+                        help="Chargement MySQL : INSERT multi-lignes en une transaction (executemany) ou un commit par lot (batch), ou LOAD DATA LOCAL INFILE (infile).")
+    parser.add_argument("--on-duplicate", choices=DUPLICATE_MODES, default=ON_DUPLICATE,
+                        help="Observations déjà chargées (même station, même horodatage) : conservées (ignore) ou remplacées (update).")
+    parser.add_argument("--staging-layout", choices=STAGING_LAYOUTS, default=STAGING_LAYOUT,
+                        help="Une table par ville (per-city) ou une table observations partitionnée par mois (unified).")
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE,
+                        help="Nombre de connexions MySQL (et de threads) pour l'insertion.")
+    args = parser.parse_args()
+
     start_time = time.time()
     try:
-        print("Traitement JSON -> CSV...")
-        process_s3_data_to_csv(BUCKET_NAME)
+        print(f"Traitement JSON -> {args.staging_format.upper()}...")
+        if args.staging_format == "direct":
+            # Les tables Arrow sont chargées au fil du traitement, depuis le thread principal
+            with MySQLPool(1) as pool:
+                load = functools.partial(insert_arrow, pool, load_mode=args.load_mode, on_duplicate=args.on_duplicate,
+                                         layout=args.staging_layout)
+                process_s3_data_to_csv(BUCKET_NAME, args.start, args.end, args.refresh_catalog, args.memory_budget_mb,
+                                       args.decode_processes, args.staging_format, load)
+        else:
+            written = process_s3_data_to_csv(BUCKET_NAME, args.start, args.end, args.refresh_catalog, args.memory_budget_mb,
+                                             args.decode_processes, args.staging_format)
 
-        print("Insertion MySQL...")
-        fast_process_csv_to_mysql()
+        # En mode direct, les données ont déjà été insérées pendant le traitement
+        if args.staging_format == "parquet":
+            print("Insertion MySQL...")
+            fast_process_parquet_to_mysql(args.load_mode, args.pool_size, args.on_duplicate, args.staging_layout, written)
+        elif args.staging_format == "csv":
+            print("Insertion MySQL...")
+            fast_process_csv_to_mysql(args.load_mode, args.pool_size, args.on_duplicate, args.staging_layout)
     except Exception as e:
         print(f"Erreur : {e}")
-    finally:
-        cursor.close()
-        conn.close()
 
     print(f"Terminé en {round(time.time() - start_time, 2)}s.")
\ No newline at end of file
@@ -1,9 +1,18 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
 import pymongo
 import pandas as pd
 from tqdm import tqdm
+import argparse
 from concurrent.futures import ThreadPoolExecutor
 
+from curated_store import (
+    CURATED_MODES, CURATED_MODE, WRITE_BATCH_SIZE, CuratedWriter, build_daily_documents,
+    clear_changed_days, plan_cities, read_changed_days, sync_timeseries,
+)
+from curated_rollups import provision_collections, update_rollups
+from extreme_events import update_extreme_events
+from daily_stats import AGGREGATION_ENGINES, AGGREGATION_ENGINE, DAILY_METRICS_SQL, daily_stats, merge_midnight_rr3, recomputed_days
+
 # ----------------------------------------
 # Configuration des connexions
 # ----------------------------------------
@@ -14,6 +23,10 @@ mongo_client = pymongo.MongoClient("mongodb://host.docker.internal:27017/")
 mongo_db = mongo_client["curated"]
 weather_stats = mongo_db["WeatherStats"]
 
+# Organisation de la base staging (voir mysql_loader) : une table par ville ("per-city")
+# ou une table observations commune avec la dimension stations ("unified")
+STAGING_LAYOUT = "per-city"
+
 # ----------------------------------------
 # Récupérer la liste des tables dans MySQL
 # ----------------------------------------
@@ -24,35 +37,63 @@ def get_mysql_tables():
         result = conn.execute(text("""
             SELECT table_name 
             FROM information_schema.tables 
-            WHERE table_schema = 'staging';
+            WHERE table_schema = 'staging'
+              AND table_name NOT IN ('observations', 'stations')
+              AND LEFT(table_name, 1) <> '_';
         """))
         return [row[0] for row in result]
 
+def get_unified_cities():
+    """Récupère la liste des villes de la table observations."""
+    with mysql_engine.connect() as conn:
+        result = conn.execute(text("SELECT city FROM stations ORDER BY city;"))
+        return [row[0] for row in result]
+
+def get_cities(layout=STAGING_LAYOUT):
+    return get_unified_cities() if layout == "unified" else get_mysql_tables()
+
 # Liste des colonnes à arrondir
 columns_to_round = [
     "avg_temp", "min_temp", "max_temp",
     "avg_pressure", "min_pressure", "max_pressure",
     "avg_wind_speed", "max_wind_speed",
-    "total_rainfall", "days_with_rain"
+    "total_rainfall", "hours_with_rain",
+    "max_gust", "max_rr3", "total_rr3"
 ]
 
 # ----------------------------------------
 # Récupérer et traiter les données de MySQL
 # ----------------------------------------
 
-def get_weather_data_from_mysql(city):
+def get_weather_data_from_mysql(city, layout=STAGING_LAYOUT, days=None):
     """Récupère les données météorologiques agrégées pour une ville depuis MySQL."""
+    if layout == "unified":
+        # Lecture par la clé primaire (station_id, date) de la ville demandée
+        source = "observations o JOIN stations s ON s.station_id = o.station_id"
+        conditions = ["s.city = :city"]
+    else:
+        source = f"`{city}`"
+        conditions = []
+    params = {"city": city}
+    if days is not None:
+        # Mode incrémental : les jours modifiés et leur veille (cumul rr3), avec l'observation
+        # de 00 h du lendemain de chacun, dans la plage couverte par ces jours
+        days = recomputed_days(days)
+        conditions += ["date >= :first_day", "date <= :last_day + INTERVAL 1 DAY",
+                       "(DATE(date) IN :days OR DATE(date - INTERVAL 1 SECOND) IN :days)"]
+        params.update(first_day=min(days), last_day=max(days), days=days)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
     query = f"""
-    SELECT 
-        DATE(date) AS period,
-        AVG(tc) AS avg_temp, MIN(tc) AS min_temp, MAX(tc) AS max_temp,
-        AVG(pmer) AS avg_pressure, MIN(pmer) AS min_pressure, MAX(pmer) AS max_pressure,
-        AVG(ff) AS avg_wind_speed, MAX(ff) AS max_wind_speed,
-        SUM(rr1) AS total_rainfall, COUNT(CASE WHEN rr1 > 0 THEN 1 END) AS days_with_rain
-    FROM `{city}`
+    SELECT DATE(date) AS period, {DAILY_METRICS_SQL}
+    FROM {source}
+    {where}
     GROUP BY DATE(date);
     """
-    return pd.read_sql_query(query, mysql_engine)
+    statement = text(query)
+    if days is not None:
+        statement = statement.bindparams(bindparam("days", expanding=True))
+    df = merge_midnight_rr3(pd.read_sql_query(statement, mysql_engine, params=params))
+    return df if days is None else df[pd.to_datetime(df["period"]).isin(pd.to_datetime(days))]
 
 def round_columns(df):
     """Arrondir les colonnes spécifiées à 3 chiffres après la virgule."""
@@ -62,48 +103,83 @@ def round_columns(df):
 # Insertion des données dans MongoDB
 # ----------------------------------------
 
-def insert_data_to_mongo(city, df):
-    """Insère les données traitées dans MongoDB."""
-    if df.empty:
-        return
-    
-    df["city"] = city.capitalize()
-    df["period"] = df["period"].astype(str)
-    
-    records = df.to_dict("records")
-    for record in records:
-        record["metrics"] = {
-            "temperature": {key: record.pop(key) for key in ["avg_temp", "min_temp", "max_temp"]},
-            "pressure": {key: record.pop(key) for key in ["avg_pressure", "min_pressure", "max_pressure"]},
-            "wind_speed": {key: record.pop(key) for key in ["avg_wind_speed", "max_wind_speed"]},
-            "rainfall": {key: record.pop(key) for key in ["total_rainfall", "days_with_rain"]}
-        }
-        record["extreme_events"] = []
-    
-    weather_stats.insert_many(records)
+def insert_data_to_mongo(city, df, writer):
+    """Transmet les documents journaliers d'une ville à l'écriture par lots et retourne leurs clés (city, period)."""
+    documents = build_daily_documents(city.capitalize(), df)
+    writer.write(documents)
+    return [(document["city"], document["period"]) for document in documents]
+
+def insert_all_data_to_mongo(df, writer):
+    """
+    Documents journaliers de toutes les villes (colonne city), transmis ville par ville :
+    les lots d'une ville partent pendant la construction des documents de la suivante.
+    """
+    written = []
+    for city, df_city in df.groupby("city"):
+        written += insert_data_to_mongo(city, df_city, writer)
+    return written
 
 # ----------------------------------------
 # Main Process (Parallélisé)
 # ----------------------------------------
 
-def process_city(city):
-    """Processus parallèle pour une ville."""
-    df = get_weather_data_from_mysql(city)
+def process_city(city, writer, layout=STAGING_LAYOUT, days=None):
+    """Processus parallèle pour une ville (days : jours à recalculer, None pour tous)."""
+    df = get_weather_data_from_mysql(city, layout, days)
     df = round_columns(df)
-    insert_data_to_mongo(city, df)
+    return insert_data_to_mongo(city, df, writer)
 
-def fast_process_weather_data():
+def fast_process_weather_data(layout=STAGING_LAYOUT, mode=CURATED_MODE, aggregation=AGGREGATION_ENGINE, timeseries=False,
+                              batch_size=WRITE_BATCH_SIZE):
     """Exécute le processus complet avec parallélisation."""
-    cities = get_mysql_tables()
-
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        list(tqdm(executor.map(process_city, cities), total=len(cities), desc="Traitement des villes"))
-
-    print("Données insérées avec succès dans MongoDB.")
+    provision_collections(mongo_db, timeseries)
+    changes = read_changed_days(mysql_engine)
+    plan = plan_cities(weather_stats, changes, get_cities(layout), mode)
+
+    with CuratedWriter(weather_stats, batch_size) as writer:
+        if aggregation == "per-city":
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                keys_by_city = executor.map(process_city, plan, [writer] * len(plan), [layout] * len(plan), plan.values())
+                written = [key for keys in tqdm(keys_by_city, total=len(plan), desc="Traitement des villes") for key in keys]
+        else:
+            # Un seul parcours de la zone staging pour toutes les villes, sans répartition par ville
+            df = round_columns(daily_stats(mysql_engine, plan, layout, aggregation, changes))
+            written = insert_all_data_to_mongo(df, writer)
+
+    print(f"{len(written)} documents journaliers ({len(plan)} villes) : {writer.report()}")
+
+    # Événements extrêmes autour des jours écrits, avec les seuils par station en cache
+    updated = update_extreme_events(mongo_db, written)
+    print(f"{updated} jours dont les événements extrêmes ont changé.")
+
+    # Semaines, mois et années contenant les jours écrits, à partir de leurs agrégats partiels
+    for granularity, count in update_rollups(mongo_db, written).items():
+        print(f"{count} documents {granularity} insérés ou mis à jour.")
+    if timeseries:
+        print(f"{sync_timeseries(mongo_db, written)} documents recopiés dans la collection time-series.")
+
+    # Jours traités : ils ne seront pas recalculés au prochain passage
+    clear_changed_days(mysql_engine, changes[changes["city"].isin(plan)])
 
 # ----------------------------------------
 # Exécution
 # ----------------------------------------
 
 if __name__ == "__main__":
-    fast_process_weather_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Agrégation quotidienne des données de staging vers MongoDB.")
+    parser.add_argument("--staging-layout", choices=["per-city", "unified"], default=STAGING_LAYOUT,
+                        help="Organisation de la base staging à lire.")
+    parser.add_argument("--mode", choices=CURATED_MODES, default=CURATED_MODE,
+                        help="incremental : seuls les jours modifiés en staging depuis le dernier passage ; full : tout recalculer.")
+    parser.add_argument("--aggregation", choices=AGGREGATION_ENGINES, default=AGGREGATION_ENGINE,
+                        help="per-city : une requête par ville ; single-scan : une seule requête SQL pour toutes les villes ; "
+                             "parquet : group-by Arrow sur la zone staging Parquet.")
+    parser.add_argument("--timeseries", action="store_true",
+                        help="Recopie aussi les documents journaliers dans une collection time-series (WeatherStatsSeries).")
+    parser.add_argument("--batch-size", type=int, default=WRITE_BATCH_SIZE,
+                        help="Nombre de documents par bulk_write MongoDB.")
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size doit être au moins 1.")
+
+    fast_process_weather_data(args.staging_layout, args.mode, args.aggregation, args.timeseries, args.batch_size)
\ No newline at end of file
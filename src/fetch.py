@@ -1,12 +1,23 @@
 import requests
 import json
+import gzip
 import os
 import argparse
 from datetime import datetime, timezone, timedelta
 
+from raw_format import DEFAULT_EXTENSION, iter_records
+from synop import COLUMNS_USED
+from fetch_manifest import MANIFEST_PATH, FetchManifest, WatermarkTracker, partition_of
+
 # API URL and constants
 URL_API = "https://public.opendatasoft.com/api/explore/v2.1/catalog/datasets/donnees-synop-essentielles-omm/exports/json"
+# Same export, one record per line: lets us write records to disk as they arrive
+URL_API_JSONL = "https://public.opendatasoft.com/api/explore/v2.1/catalog/datasets/donnees-synop-essentielles-omm/exports/jsonl"
 HEADERS = {"accept": "*/*"}
+RAW_DATA_DIR = "/opt/airflow/data/raw"
+REQUEST_TIMEOUT = 300  # seconds
+STREAM_CHUNK_SIZE = 1024 * 1024  # bytes read from the socket at a time
+FILE_FORMATS = {"ndjson.gz": DEFAULT_EXTENSION, "json": ".json"}
 
 def get_date_range(year=None, month=None, day=None):
     """
@@ -30,15 +41,151 @@ def get_date_range(year=None, month=None, day=None):
     
     return date_start.isoformat(), date_end.isoformat()
 
-def fetch_data_from_api(url, params, headers):
+def get_incremental_ranges(year=None, month=None):
+    """
+    Date ranges scanned by an incremental run: the given month, or by default
+    yesterday's month and the current month up to now (both when they differ,
+    so the last day of a month is not lost on the 1st).
+    """
+    if year and month:
+        return [get_date_range(year, month)]
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    yesterday = now - timedelta(days=1)
+    ranges = []
+    for moment in sorted({(yesterday.year, yesterday.month), (now.year, now.month)}):
+        date_start, date_end = get_date_range(*moment)
+        ranges.append((date_start, min(date_end, now.isoformat())))
+    return ranges
+
+def get_output_path(date_start, daily=False, file_format="ndjson.gz"):
+    """
+    Build the local file path for a partition: YYYY/MM/YYYY-MM.<ext> for a month,
+    YYYY/MM/YYYY-MM-DD.<ext> for a single day.
+    """
+    year, month = date_start[:4], date_start[5:7]
+    extension = FILE_FORMATS[file_format]
+    if daily:
+        file_name = f"{date_start.split('T')[0]}{extension}"
+    else:
+        file_name = f"{year}-{month}{extension}"
+    return os.path.join(RAW_DATA_DIR, year, month, file_name)
+
+def get_delta_output_path(date_start, file_format="ndjson.gz"):
+    """Build the path of an incremental delta: YYYY/MM/YYYY-MM-delta-<UTC run time>.<ext>."""
+    year, month = date_start[:4], date_start[5:7]
+    run_time = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    file_name = f"{year}-{month}-delta-{run_time}{FILE_FORMATS[file_format]}"
+    return os.path.join(RAW_DATA_DIR, year, month, file_name)
+
+def build_query_params(date_start, date_end, fields=COLUMNS_USED):
+    """
+    Build the export query. Only the given fields are requested (OpenDataSoft
+    'select' parameter); pass fields=None to download every SYNOP field.
+    """
+    params = {
+        "where": f"date >= '{date_start}' AND date <= '{date_end}'",
+        "timezone": "UTC",
+        "use_labels": "false",
+        "epsg": 4326,
+    }
+    if fields:
+        params["select"] = ",".join(fields)
+    return params
+
+def parse_fields(value):
+    """Parse a comma-separated --fields value into a list of field names."""
+    return [field.strip() for field in value.split(",") if field.strip()]
+
+def fetch_data_from_api(url, params, headers, session=None):
     try:
-        response = requests.get(url, params=params, headers=headers)
+        http = session or requests
+        response = http.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"An error occurred: {e}")
         return None
 
+def stream_data_to_file(session, url, params, headers, file_path, tracker=None, keep_empty=True):
+    """
+    Stream a JSONL export straight into a gzip-compressed NDJSON file, line by line,
+    so memory use does not depend on the size of the export.
+    If a WatermarkTracker is given, each record is passed through it and dropped
+    when already known. The file is written under a temporary name and renamed
+    once complete; with keep_empty=False, no file is left when nothing was written.
+    Returns the number of records written.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.part"
+    count = 0
+    try:
+        with session.get(url, params=params, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            response.raise_for_status()
+            with gzip.open(tmp_path, "wb") as file:
+                for line in response.iter_lines(chunk_size=STREAM_CHUNK_SIZE):
+                    if not line:
+                        continue
+                    if tracker is not None and not tracker.keep(json.loads(line)):
+                        continue
+                    file.write(line + b"\n")
+                    count += 1
+        if count or keep_empty:
+            os.replace(tmp_path, file_path)
+            print(f"Data saved to '{file_path}'.")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return count
+
+def download(session, params, file_path, file_format, tracker, keep_empty=True):
+    """Download one export to file_path in the requested format, returning the record count."""
+    if file_format == "json":
+        response = session.get(URL_API, params=params, headers=HEADERS, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        data = [record for record in response.json() if tracker.keep(record)]
+        if data or keep_empty:
+            save_data_to_file(data, file_path)
+        return count_data_elements(data)
+    return stream_data_to_file(session, URL_API_JSONL, params, HEADERS, file_path, tracker, keep_empty)
+
+def fetch_partition(session, year=None, month=None, day=None, file_format="ndjson.gz", fields=COLUMNS_USED,
+                    manifest=None):
+    """
+    Fetch one partition (a month, a day if given, or yesterday by default) and save it to disk.
+    Unlike fetch_data_from_api, HTTP errors are raised so the caller can retry.
+    When a FetchManifest is given, the partition's watermarks are recorded in it.
+    Returns the number of records and the output file path.
+    """
+    date_start, date_end = get_date_range(year, month, day)
+    daily = day is not None or not (year and month)
+    file_path = get_output_path(date_start, daily, file_format)
+    params = build_query_params(date_start, date_end, fields)
+    tracker = WatermarkTracker()
+    count = download(session, params, file_path, file_format, tracker)
+    if manifest is not None:
+        manifest.record(partition_of(date_start), tracker.latest, file_path)
+    return count, file_path
+
+def fetch_incremental(session, date_start, date_end, manifest, file_format="ndjson.gz", fields=COLUMNS_USED):
+    """
+    Fetch only the observations newer than the manifest watermarks for the partition
+    of date_start and write them to a new delta file.
+    Returns the number of new records and the delta path (None when nothing is new).
+    """
+    partition = partition_of(date_start)
+    lower_bound = manifest.query_lower_bound(partition)
+    query_start = max(date_start, lower_bound) if lower_bound else date_start
+    print(f"Partition {partition}: fetching observations from {query_start} to {date_end}")
+
+    file_path = get_delta_output_path(date_start, file_format)
+    params = build_query_params(query_start, date_end, fields)
+    tracker = WatermarkTracker(manifest.station_watermarks(partition))
+    count = download(session, params, file_path, file_format, tracker, keep_empty=False)
+    if not count:
+        return 0, None
+    manifest.record(partition, tracker.latest, file_path)
+    return count, file_path
+
 def save_data_to_file(data, file_path):
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
     with open(file_path, "w", encoding="utf-8") as file:
@@ -46,8 +193,7 @@ def save_data_to_file(data, file_path):
     print(f"Data saved to '{file_path}'.")
 
 def load_data_from_file(file_path):
-    with open(file_path, "r", encoding="utf-8") as file:
-        return json.load(file)
+    return list(iter_records(file_path))
 
 def count_data_elements(data):
     return len(data)
@@ -57,34 +203,35 @@ if __name__ == "__main__":
     parser.add_argument("--year", type=int, help="The year for the data (e.g., 2025).")
     parser.add_argument("--month", type=int, choices=range(1, 13), help="The month for the data (1 to 12).")
     parser.add_argument("--day", type=int, choices=range(1, 32), help="The day for the data (1 to 31).")
+    parser.add_argument("--format", choices=list(FILE_FORMATS), default="ndjson.gz",
+                        help="Output format: streamed gzip NDJSON (default) or a single JSON array (legacy).")
+    parser.add_argument("--fields", type=parse_fields, default=COLUMNS_USED,
+                        help="Comma-separated list of fields to download (defaults to the columns used by staging).")
+    parser.add_argument("--all-fields", action="store_true", help="Download every SYNOP field.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only fetch observations newer than the manifest watermark and write them as a delta file.")
+    parser.add_argument("--manifest", default=MANIFEST_PATH, help="Path of the local fetch manifest.")
     args = parser.parse_args()
 
-    # Get date range
-    date_start, date_end = get_date_range(args.year, args.month, args.day)
-    print(f"Fetching data for range: {date_start} to {date_end}")
+    fields = None if args.all_fields else args.fields
+    manifest = FetchManifest(args.manifest)
 
-    # File path
-    # Construire le nom du dossier avec le format attendu
-    folder_name = f"{args.year}/{args.month:02d}"
+    with requests.Session() as session:
+        try:
+            if args.incremental:
+                for date_start, date_end in get_incremental_ranges(args.year, args.month):
+                    count, file_path = fetch_incremental(session, date_start, date_end, manifest, args.format, fields)
+                    print(f"Number of new elements: {count}")
+            else:
+                # Get date range
+                date_start, date_end = get_date_range(args.year, args.month, args.day)
+                print(f"Fetching data for range: {date_start} to {date_end}")
 
-    # Vérifiez si le jour est spécifié, sinon utilisez le format mois-année
-    if args.day is None:
-        # Si 'day' n'est pas spécifié, nom du fichier : YYYY-MM.json
-        json_file_name = f"/opt/airflow/data/raw/{folder_name}/{args.year}-{args.month:02d}.json"
-    else:
-        # Si 'day' est spécifié, nom du fichier : YYYY-MM-DD.json
-        json_file_name = f"/opt/airflow/data/raw/{folder_name}/{date_start.split('T')[0]}.json"
-    
-    # Query parameters
-    params = {
-        "where": f"date >= '{date_start}' AND date <= '{date_end}'",
-        "timezone": "UTC",
-        "use_labels": "false",
-        "epsg": 4326,
-    }
+                # Fetch and save data
+                count, file_path = fetch_partition(session, args.year, args.month, args.day, args.format, fields,
+                                                   manifest)
+                print(f"Number of elements: {count}")
+        except requests.exceptions.RequestException as e:
+            print(f"An error occurred: {e}")
 
-    # Fetch and save data
-    data = fetch_data_from_api(URL_API, params, HEADERS)
-    if data:
-        save_data_to_file(data, json_file_name)
-        print(f"Number of elements: {count_data_elements(data)}")
\ No newline at end of file
+    manifest.save()
@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+# Manifest local des récupérations : pour chaque partition (YYYY-MM), la date
+# d'observation la plus récente déjà récupérée, globalement et par station.
+# Il est stocké hors de data/raw pour ne pas être envoyé dans le bucket.
+MANIFEST_PATH = "/opt/airflow/data/manifest/fetch_manifest.json"
+
+def partition_of(date_iso):
+    """Partition (YYYY-MM) d'une date ISO 8601."""
+    return date_iso[:7]
+
+class FetchManifest:
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.partitions = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                self.partitions = json.load(file).get("partitions", {})
+
+    def save(self):
+        """Écrit le manifest de manière atomique (fichier temporaire puis renommage)."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with self.lock:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump({"partitions": self.partitions}, file, ensure_ascii=False, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def watermark(self, partition):
+        """Date de la dernière observation récupérée pour la partition, ou None."""
+        with self.lock:
+            return self.partitions.get(partition, {}).get("watermark")
+
+    def station_watermarks(self, partition):
+        """Copie des watermarks par station de la partition."""
+        with self.lock:
+            return dict(self.partitions.get(partition, {}).get("stations", {}))
+
+    def query_lower_bound(self, partition):
+        """
+        Borne basse à demander à l'API : le plus ancien des watermarks par station,
+        pour ne pas manquer les observations d'une station qui publie en retard.
+        """
+        stations = self.station_watermarks(partition)
+        if stations:
+            return min(stations.values())
+        return self.watermark(partition)
+
+    def record(self, partition, station_watermarks, file_path):
+        """Fusionne les watermarks d'une récupération terminée dans le manifest."""
+        if not station_watermarks:
+            return
+        with self.lock:
+            entry = self.partitions.setdefault(partition, {"watermark": None, "stations": {}, "files": []})
+            stations = entry["stations"]
+            for station, date in station_watermarks.items():
+                if station not in stations or date > stations[station]:
+                    stations[station] = date
+            entry["watermark"] = max(stations.values())
+            if file_path not in entry["files"]:
+                entry["files"].append(file_path)
+            entry["updated_at"] = datetime.now(timezone.utc).isoformat()
+
+class WatermarkTracker:
+    """
+    Suit la date maximale par station pendant un téléchargement en flux et,
+    si des watermarks précédents sont fournis, écarte les observations déjà connues.
+    """
+    def __init__(self, previous=None):
+        self.previous = previous or {}
+        self.latest = {}
+
+    def keep(self, record):
+        station, date = record.get("nom"), record.get("date")
+        if station is None or date is None:
+            return True
+        if station in self.previous and date <= self.previous[station]:
+            return False
+        if station not in self.latest or date > self.latest[station]:
+            self.latest[station] = date
+        return True
@@ -0,0 +1,422 @@
+import os
+import csv
+import tempfile
+import threading
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from synop import COLUMNS_USED, station_table_name
+from staging_writer import arrow_to_mysql_rows, to_mysql_rows
+
+# Modes de chargement des tables de staging MySQL :
+#   executemany : un seul executemany pour toutes les lignes, validé en une transaction
+#                 (comportement historique)
+#   batch       : executemany par lots de BATCH_SIZE lignes, un commit par lot
+# Dans les deux modes, pymysql réécrit l'INSERT ... VALUES en requêtes multi-lignes (jusqu'à
+# max_stmt_length octets par requête) : seule la taille des transactions change.
+#   infile      : LOAD DATA LOCAL INFILE directement depuis le fichier de staging
+#                 (nécessite local_infile côté client et côté serveur)
+LOAD_MODES = ["executemany", "batch", "infile"]
+LOAD_MODE = "executemany"
+BATCH_SIZE = 10000
+
+# Traitement des lignes déjà présentes (même station et même horodatage) :
+#   ignore : les lignes existantes sont conservées, seules les nouvelles sont écrites
+#   update : les lignes existantes sont remplacées par les nouvelles valeurs
+DUPLICATE_MODES = ["ignore", "update"]
+ON_DUPLICATE = "ignore"
+
+STRING_COLUMNS = {"nom", "cod_tend", "ww"}
+
+# Index secondaires des tables de staging. Ils sont créés après le chargement :
+# lors d'un premier chargement (table vide), les lignes sont insérées sans index
+# à maintenir et l'index est construit en une fois à la fin.
+DEFERRED_INDEXES = {"idx_date": "(`date`)"}
+
+# Organisation de la base staging :
+#   per-city : une table par ville (historique)
+#   unified  : une table de faits observations commune à toutes les stations, partitionnée
+#              par mois, et une table de dimension stations (identifiant compact, nom, ville)
+STAGING_LAYOUTS = ["per-city", "unified"]
+STAGING_LAYOUT = "per-city"
+OBSERVATIONS_TABLE = "observations"
+STATIONS_TABLE = "stations"
+
+# Tables de staging : une ligne par station et par observation, identifiée par la clé primaire
+STAGING_TABLE_COLUMNS = """
+    date DATETIME NOT NULL,
+    nom VARCHAR(255) NOT NULL,
+    pmer DOUBLE,
+    tend DOUBLE,
+    cod_tend VARCHAR(50),
+    dd DOUBLE,
+    ff DOUBLE,
+    td DOUBLE,
+    u DOUBLE,
+    ww VARCHAR(10),
+    pres DOUBLE,
+    rafper DOUBLE,
+    rr1 DOUBLE,
+    rr3 DOUBLE,
+    tc DOUBLE,
+    PRIMARY KEY (nom, date)
+"""
+
+STATIONS_TABLE_COLUMNS = """
+    station_id SMALLINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    nom VARCHAR(100) NOT NULL,
+    city VARCHAR(100) NOT NULL,
+    PRIMARY KEY (station_id),
+    UNIQUE KEY uk_nom (nom),
+    KEY idx_city (city)
+"""
+
+# Types compacts : mesures en FLOAT (4 octets), direction et humidité en entiers courts.
+# La clé primaire (station_id, date) sert d'index composite station/horodatage.
+OBSERVATIONS_TABLE_COLUMNS = """
+    station_id SMALLINT UNSIGNED NOT NULL,
+    date DATETIME NOT NULL,
+    pmer FLOAT,
+    tend FLOAT,
+    cod_tend VARCHAR(8),
+    dd SMALLINT UNSIGNED,
+    ff FLOAT,
+    td FLOAT,
+    u TINYINT UNSIGNED,
+    ww VARCHAR(8),
+    pres FLOAT,
+    rafper FLOAT,
+    rr1 FLOAT,
+    rr3 FLOAT,
+    tc FLOAT,
+    PRIMARY KEY (station_id, date)
+"""
+
+# Suivi des jours modifiés, pour le recalcul incrémental de la zone curated : des triggers
+# enregistrent (ville, jour) pour chaque ligne réellement insérée ou modifiée, quel que soit
+# le chemin de chargement (INSERT, LOAD DATA, API). Les doublons ignorés ne déclenchent rien.
+CHANGED_DAYS_TABLE = "_changed_days"
+CHANGED_DAYS_TABLE_COLUMNS = """
+    city VARCHAR(100) NOT NULL,
+    day DATE NOT NULL,
+    marked_at TIMESTAMP(6) NOT NULL,
+    PRIMARY KEY (city, day)
+"""
+MEASURE_COLUMNS = [column for column in COLUMNS_USED if column not in ("date", "nom")]
+
+# Partitions mensuelles créées à la demande (voir ensure_month_partitions). Le verrou
+# évite que deux threads d'insertion ajoutent la même partition en même temps.
+partition_lock = threading.Lock()
+
+def target_table(city, layout=STAGING_LAYOUT):
+    """Table de destination des lignes d'une ville selon l'organisation de la base."""
+    return OBSERVATIONS_TABLE if layout == "unified" else city.replace("-", "_")
+
+def create_target_table(cursor, table):
+    if table == OBSERVATIONS_TABLE:
+        create_observations_table(cursor)
+    else:
+        create_staging_table(cursor, table)
+
+def create_observations_table(cursor):
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS staging.`{STATIONS_TABLE}` ({STATIONS_TABLE_COLUMNS});")
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS staging.`{OBSERVATIONS_TABLE}` ({OBSERVATIONS_TABLE_COLUMNS})
+        PARTITION BY RANGE (TO_DAYS(date)) (PARTITION p_max VALUES LESS THAN MAXVALUE);
+    """)
+    ensure_change_tracking(cursor, OBSERVATIONS_TABLE)
+
+def ensure_change_tracking(cursor, table):
+    """Crée la table des jours modifiés et les triggers d'insertion/modification de la table."""
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS staging.`{CHANGED_DAYS_TABLE}` ({CHANGED_DAYS_TABLE_COLUMNS});")
+    if table == OBSERVATIONS_TABLE:
+        city = f"(SELECT city FROM staging.`{STATIONS_TABLE}` WHERE station_id = NEW.station_id)"
+    else:
+        city = cursor.connection.escape(table)
+    mark = f"""
+        INSERT INTO staging.`{CHANGED_DAYS_TABLE}` (city, day, marked_at) VALUES ({city}, DATE(NEW.date), SYSDATE(6))
+        ON DUPLICATE KEY UPDATE marked_at = SYSDATE(6)
+    """
+    new_values = ", ".join(f"NEW.{column}" for column in MEASURE_COLUMNS)
+    old_values = ", ".join(f"OLD.{column}" for column in MEASURE_COLUMNS)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS staging.`{f"trk_ins_{table}"[:64]}` AFTER INSERT ON staging.`{table}`
+        FOR EACH ROW {mark};
+    """)
+    # ON DUPLICATE KEY UPDATE déclenche aussi les triggers UPDATE quand les valeurs sont identiques
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS staging.`{f"trk_upd_{table}"[:64]}` AFTER UPDATE ON staging.`{table}`
+        FOR EACH ROW BEGIN
+            IF NOT (({new_values}) <=> ({old_values})) OR NEW.date <> OLD.date THEN
+                {mark};
+            END IF;
+        END;
+    """)
+
+def station_ids(cursor, noms):
+    """Identifiants des stations {nom: station_id}, en enregistrant les nouvelles stations."""
+    noms = sorted({nom for nom in noms if isinstance(nom, str) and nom})
+    if not noms:
+        return {}
+    placeholders = ", ".join(["%s"] * len(noms))
+    query = f"SELECT nom, station_id FROM staging.`{STATIONS_TABLE}` WHERE nom IN ({placeholders});"
+    cursor.execute(query, noms)
+    ids = dict(cursor.fetchall())
+    missing = [nom for nom in noms if nom not in ids]
+    if missing:
+        # INSERT IGNORE : une station enregistrée entre-temps par un autre thread est conservée
+        cursor.executemany(f"INSERT IGNORE INTO staging.`{STATIONS_TABLE}` (nom, city) VALUES (%s, %s);",
+                           [(nom, station_table_name(nom)) for nom in missing])
+        cursor.connection.commit()
+        cursor.execute(query, noms)
+        ids = dict(cursor.fetchall())
+    return ids
+
+def to_days(day):
+    """Équivalent Python de TO_DAYS() de MySQL."""
+    return day.toordinal() + 365
+
+def next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+def ensure_month_partitions(cursor, months):
+    """
+    Ajoute à la table observations une partition pour chaque mois (année, mois) qui n'en a
+    pas encore, en découpant la partition qui contient actuellement ce mois (p_max pour les
+    mois les plus récents). Une partition pAAAAMM contient les lignes antérieures au mois suivant.
+    """
+    with partition_lock:
+        cursor.execute("""
+            SELECT partition_name, partition_description FROM information_schema.partitions
+            WHERE table_schema = 'staging' AND table_name = %s AND partition_name IS NOT NULL;
+        """, (OBSERVATIONS_TABLE,))
+        bounds = {name: None if bound == "MAXVALUE" else int(bound) for name, bound in cursor.fetchall()}
+        for year, month in sorted(months):
+            name = f"p{year}{month:02d}"
+            if name in bounds:
+                continue
+            upper = to_days(date(*next_month(year, month), 1))
+            # La partition qui contient le mois est celle de plus petite borne au-delà du mois
+            candidates = sorted((bound, partition) for partition, bound in bounds.items()
+                                if bound is not None and bound > upper)
+            if candidates:
+                containing_bound, containing = candidates[0]
+                containing_limit = f"({containing_bound})"
+            else:
+                containing = next(partition for partition, bound in bounds.items() if bound is None)
+                containing_limit = "MAXVALUE"
+            cursor.execute(f"""
+                ALTER TABLE staging.`{OBSERVATIONS_TABLE}` REORGANIZE PARTITION {containing} INTO (
+                    PARTITION {name} VALUES LESS THAN ({upper}),
+                    PARTITION {containing} VALUES LESS THAN {containing_limit}
+                );
+            """)
+            bounds[name] = upper
+
+def dataframe_months(df):
+    dates = pd.to_datetime(df["date"], utc=True).dropna()
+    return set(zip(dates.dt.year, dates.dt.month))
+
+def scan_csv_stations_and_months(csv_path):
+    """Stations et mois présents dans un CSV de staging, lus sans pandas."""
+    noms, months = set(), set()
+    with open(csv_path, "r", encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader, [])
+        date_index, nom_index = header.index("date"), header.index("nom")
+        for row in reader:
+            noms.add(row[nom_index])
+            if len(row[date_index]) >= 7:
+                months.add((int(row[date_index][:4]), int(row[date_index][5:7])))
+    return noms, months
+
+def to_observations_frame(cursor, df):
+    """Prépare les lignes pour la table observations : le nom de station devient son identifiant."""
+    ids = station_ids(cursor, df["nom"].unique())
+    df = df.assign(nom=df["nom"].map(ids)).rename(columns={"nom": "station_id"})
+    df = df.dropna(subset=["station_id"])
+    return df.astype({"station_id": "int64"})
+
+def to_observations_arrow(cursor, arrow_table):
+    """Même préparation que to_observations_frame, pour une table Arrow."""
+    ids = station_ids(cursor, pc.unique(arrow_table["nom"]).to_pylist())
+    station_id = pc.take(pa.array(list(ids.values()), pa.uint16()),
+                         pc.index_in(arrow_table["nom"], value_set=pa.array(list(ids), pa.string())))
+    arrow_table = arrow_table.set_column(arrow_table.schema.get_field_index("nom"), "station_id", station_id)
+    return arrow_table.filter(pc.is_valid(arrow_table["station_id"]))
+
+def arrow_months(arrow_table):
+    months = pc.unique(pc.strftime(arrow_table["date"].drop_null(), format="%Y-%m")).to_pylist()
+    return {(int(month[:4]), int(month[5:])) for month in months}
+
+def create_staging_table(cursor, table, track_changes=True):
+    """Crée la table si besoin, et remplace une table d'avant la clé primaire (date DATE, sans clé)."""
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS staging.`{table}` ({STAGING_TABLE_COLUMNS});")
+    if not has_primary_key(cursor, table):
+        migrate_to_primary_key(cursor, table)
+    if track_changes:
+        ensure_change_tracking(cursor, table)
+
+def has_primary_key(cursor, table):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.table_constraints
+        WHERE table_schema = 'staging' AND table_name = %s AND constraint_type = 'PRIMARY KEY';
+    """, (table,))
+    return cursor.fetchone()[0] > 0
+
+def migrate_to_primary_key(cursor, table):
+    """
+    Remplace une ancienne table (date DATE, sans clé) par une table vide avec clé primaire.
+    Ses lignes ne sont pas recopiées : l'heure des observations y est tronquée à minuit, et
+    une ligne recopiée bloquerait la vraie observation de 00:00 au rechargement (doublon ignoré).
+    L'ancienne table est conservée sous _legacy_<table>, hors des listes de villes.
+    """
+    legacy_table = f"_legacy_{table}"
+    cursor.execute(f"RENAME TABLE staging.`{table}` TO staging.`{legacy_table}`;")
+    cursor.execute(f"CREATE TABLE staging.`{table}` ({STAGING_TABLE_COLUMNS});")
+    print(f"Table {table} recréée avec la clé primaire (nom, date), l'ancienne est conservée sous {legacy_table} : "
+          f"relancer le traitement de la zone raw pour recharger son historique.")
+
+def insert_query(table, columns, on_duplicate=ON_DUPLICATE):
+    if on_duplicate == "update":
+        updates = ", ".join(f"{column} = VALUES({column})" for column in columns)
+        return f"""
+            INSERT INTO staging.`{table}` ({', '.join(columns)})
+            VALUES ({', '.join(['%s'] * len(columns))})
+            ON DUPLICATE KEY UPDATE {updates};
+        """
+    return f"""
+        INSERT IGNORE INTO staging.`{table}` ({', '.join(columns)})
+        VALUES ({', '.join(['%s'] * len(columns))});
+    """
+
+def load_executemany(cursor, table, df, on_duplicate=ON_DUPLICATE):
+    cursor.executemany(insert_query(table, df.columns, on_duplicate), to_mysql_rows(df))
+    return len(df)
+
+def load_batches(cursor, table, df, batch_size=BATCH_SIZE, on_duplicate=ON_DUPLICATE):
+    """executemany par lots, validés un par un pour limiter la taille des transactions."""
+    query = insert_query(table, df.columns, on_duplicate)
+    for start in range(0, len(df), batch_size):
+        cursor.executemany(query, to_mysql_rows(df.iloc[start:start + batch_size]))
+        cursor.connection.commit()
+    return len(df)
+
+def read_csv_header(csv_path):
+    with open(csv_path, "r", encoding="utf-8") as file:
+        return file.readline().strip().split(",")
+
+def load_csv_infile(cursor, table, csv_path, on_duplicate=ON_DUPLICATE):
+    """
+    Charge un CSV de staging avec LOAD DATA LOCAL INFILE, sans passer par des tuples Python.
+    Comme fillna(0) dans les autres modes, les champs vides deviennent 0 ('0' pour les textes).
+    En mode update, LOAD DATA REPLACE supprimerait puis réinsérerait chaque ligne existante, et
+    le trigger d'insertion marquerait tous les jours rechargés : le fichier est chargé dans une
+    table temporaire puis fusionné par INSERT ... ON DUPLICATE KEY UPDATE, comme les autres modes.
+    """
+    columns = read_csv_header(csv_path)
+    load_table = table
+    if on_duplicate == "update":
+        # Sans LIKE : une table temporaire ne peut pas être partitionnée (table observations)
+        load_table = f"_load_{table}"
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS staging.`{load_table}`;")
+        cursor.execute(f"CREATE TEMPORARY TABLE staging.`{load_table}` SELECT * FROM staging.`{table}` LIMIT 0;")
+    assignments = []
+    for column in columns:
+        if column == "date":
+            # '2023-12-01T00:00:00+00:00' ou '2023-12-01 00:00:00' -> '2023-12-01 00:00:00'
+            assignments.append("`date` = REPLACE(LEFT(@date, 19), 'T', ' ')")
+        elif column == "nom" and table == OBSERVATIONS_TABLE:
+            assignments.append(f"`station_id` = (SELECT station_id FROM staging.`{STATIONS_TABLE}` WHERE nom = @nom)")
+        elif column in STRING_COLUMNS:
+            assignments.append(f"`{column}` = IF(@{column} = '', '0', @{column})")
+        else:
+            assignments.append(f"`{column}` = IF(@{column} = '', 0, @{column})")
+    cursor.execute(f"""
+        LOAD DATA LOCAL INFILE %s
+        IGNORE INTO TABLE staging.`{load_table}`
+        CHARACTER SET utf8mb4
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+        LINES TERMINATED BY '\\n'
+        IGNORE 1 LINES
+        ({', '.join('@' + column for column in columns)})
+        SET {', '.join(assignments)};
+    """, (csv_path,))
+    rows = cursor.rowcount
+    if load_table != table:
+        loaded = ["station_id" if column == "nom" and table == OBSERVATIONS_TABLE else column for column in columns]
+        updates = ", ".join(f"{column} = VALUES({column})" for column in loaded)
+        cursor.execute(f"""
+            INSERT INTO staging.`{table}` ({', '.join(loaded)})
+            SELECT {', '.join(loaded)} FROM staging.`{load_table}`
+            ON DUPLICATE KEY UPDATE {updates};
+        """)
+        cursor.execute(f"DROP TEMPORARY TABLE staging.`{load_table}`;")
+    cursor.connection.commit()
+    return rows
+
+def load_dataframe_infile(cursor, table, df, on_duplicate=ON_DUPLICATE):
+    """LOAD DATA depuis un DataFrame (ex : zone Parquet), via un CSV temporaire."""
+    fd, tmp_path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        df.to_csv(tmp_path, index=False, date_format="%Y-%m-%d %H:%M:%S")
+        return load_csv_infile(cursor, table, tmp_path, on_duplicate)
+    finally:
+        os.remove(tmp_path)
+
+def ensure_deferred_indexes(cursor, table):
+    """Crée les index secondaires manquants, une fois les données chargées."""
+    cursor.execute("""
+        SELECT DISTINCT index_name FROM information_schema.statistics
+        WHERE table_schema = 'staging' AND table_name = %s;
+    """, (table,))
+    existing = {row[0] for row in cursor.fetchall()}
+    for name, columns in DEFERRED_INDEXES.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE staging.`{table}` ADD INDEX `{name}` {columns};")
+
+def load_dataframe(cursor, table, df, load_mode=LOAD_MODE, on_duplicate=ON_DUPLICATE, batch_size=BATCH_SIZE):
+    """Charge un DataFrame dans une table de staging selon le mode demandé. Retourne le nombre de lignes."""
+    if table == OBSERVATIONS_TABLE:
+        df = to_observations_frame(cursor, df)
+        ensure_month_partitions(cursor, dataframe_months(df))
+    if load_mode == "infile":
+        rows = load_dataframe_infile(cursor, table, df, on_duplicate)
+    elif load_mode == "batch":
+        rows = load_batches(cursor, table, df, batch_size, on_duplicate)
+    else:
+        rows = load_executemany(cursor, table, df, on_duplicate)
+    ensure_deferred_indexes(cursor, table)
+    return rows
+
+def load_csv_file(cursor, table, csv_path, on_duplicate=ON_DUPLICATE):
+    """Charge un CSV de staging tel quel avec LOAD DATA, puis crée les index différés."""
+    if table == OBSERVATIONS_TABLE:
+        noms, months = scan_csv_stations_and_months(csv_path)
+        station_ids(cursor, noms)
+        ensure_month_partitions(cursor, months)
+    rows = load_csv_infile(cursor, table, csv_path, on_duplicate)
+    ensure_deferred_indexes(cursor, table)
+    return rows
+
+def load_arrow(cursor, table, arrow_table, load_mode=LOAD_MODE, on_duplicate=ON_DUPLICATE, batch_size=BATCH_SIZE):
+    """
+    Charge une table Arrow (zone staging en mémoire) sans DataFrame ni fichier intermédiaire.
+    LOAD DATA LOCAL ne lisant que des fichiers, le mode infile est remplacé ici par le mode batch.
+    """
+    if table == OBSERVATIONS_TABLE:
+        arrow_table = to_observations_arrow(cursor, arrow_table)
+        ensure_month_partitions(cursor, arrow_months(arrow_table))
+    query = insert_query(table, arrow_table.column_names, on_duplicate)
+    if load_mode == "executemany":
+        cursor.executemany(query, arrow_to_mysql_rows(arrow_table))
+    else:
+        for batch in arrow_table.to_batches(max_chunksize=batch_size):
+            cursor.executemany(query, arrow_to_mysql_rows(pa.Table.from_batches([batch])))
+            cursor.connection.commit()
+    ensure_deferred_indexes(cursor, table)
+    return arrow_table.num_rows
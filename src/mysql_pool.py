@@ -0,0 +1,87 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+import pymysql
+
+# Paramètres de connexion à la base staging
+MYSQL_CONFIG = {
+    "host": "mysql",
+    "port": 3306,
+    "user": "root",
+    "password": "root",
+    "database": "staging",
+    "local_infile": True,  # Autorise LOAD DATA LOCAL INFILE (--load-mode infile)
+}
+POOL_SIZE = 4
+
+class MySQLPool:
+    """
+    Pool de connexions pymysql partagé entre threads. Une connexion pymysql ne supporte
+    pas d'être utilisée par plusieurs threads : chaque worker emprunte sa propre connexion
+    le temps d'un traitement puis la rend au pool. Les connexions sont ouvertes à la
+    demande (au plus size) et restent en mode transactionnel : c'est à l'appelant de
+    valider chaque lot, et une erreur annule la transaction en cours.
+    """
+    def __init__(self, size=POOL_SIZE, **connect_kwargs):
+        self.size = size
+        self.connect_kwargs = {**MYSQL_CONFIG, **connect_kwargs}
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def acquire(self):
+        """Connexion libre, nouvelle connexion si le pool n'est pas plein, sinon attend qu'une connexion soit rendue."""
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            can_open = self.opened < self.size
+            if can_open:
+                self.opened += 1
+        if not can_open:
+            return self.idle.get()
+        try:
+            return pymysql.connect(**self.connect_kwargs)
+        except Exception:
+            with self.lock:
+                self.opened -= 1
+            raise
+
+    def release(self, conn):
+        self.idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            conn.ping(reconnect=True)  # Rouvre une connexion fermée par le serveur pendant son inactivité
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+        with self.lock:
+            self.opened = 0
@@ -1,16 +1,40 @@
 import boto3
 import pandas as pd
-import json
 import os
 from io import BytesIO
 import time
+import argparse
+import functools
 from tqdm import tqdm
 import pymysql
 
+from raw_format import decode_records, is_raw_file
+from synop import COLUMNS_USED, station_table_name
+from raw_catalog import catalog_objects, list_all_objects
+from staging_writer import (
+    STAGING_WRITERS, list_parquet_stations, read_station_parquet, split_by_station, station_partitions, to_synop_types,
+)
+from mysql_loader import (
+    DUPLICATE_MODES,
+    LOAD_MODE,
+    LOAD_MODES,
+    ON_DUPLICATE,
+    STAGING_LAYOUT,
+    STAGING_LAYOUTS,
+    create_target_table,
+    load_arrow,
+    load_csv_file,
+    load_dataframe,
+    target_table,
+)
+
 # Configuration
 BUCKET_NAME = "raw"
-COLUMNS_USED = ['date', 'nom', 'pmer', 'tend', 'cod_tend', 'dd', 'ff', 'td', 'u', 'ww', 'pres', 'rafper', 'rr1', 'rr3', 'tc']
 CSV_OUTPUT_DIR = "/opt/airflow/data/staging/"
+PARQUET_OUTPUT_DIR = "/opt/airflow/data/staging/parquet/"
+STAGING_FORMAT = "csv"  # "csv" : un CSV par ville ; "parquet" : jeu Parquet partitionné station/année/mois ;
+                        # "direct" : tables Arrow en mémoire chargées directement dans MySQL
+MEMORY_BUDGET_MB = None  # None : tout est écrit en fin de traitement ; sinon taille max du tampon en Mo
 
 # Connexion MySQL
 conn = pymysql.connect(
@@ -18,7 +42,8 @@ conn = pymysql.connect(
     port=3306,
     user="root",
     password="root",
-    database="staging"
+    database="staging",
+    local_infile=True  # Autorise LOAD DATA LOCAL INFILE (--load-mode infile)
 )
 cursor = conn.cursor()
 
@@ -33,112 +58,132 @@ s3 = boto3.client(
 # Fonctions S3
 def get_s3_objects(bucket_name, prefix=""):
     try:
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-        return response.get("Contents", [])
+        return list_all_objects(s3, bucket_name, prefix)
     except Exception as e:
         print(f"Erreur lors de la récupération des objets S3 : {e}")
         return []
 
+def get_partitioned_objects(bucket_name, start=None, end=None, refresh=False):
+    """
+    Objets des partitions year=/month= comprises entre start et end (YYYY-MM),
+    lus depuis le catalogue du bucket (relisté pour ces partitions si refresh=True).
+    """
+    try:
+        return catalog_objects(s3, bucket_name, start, end, refresh)
+    except ValueError:
+        raise
+    except Exception as e:
+        print(f"Erreur lors de la lecture du catalogue S3 : {e}")
+        return []
+
 def get_s3_object_data(bucket_name, object_key):
     try:
         response = s3.get_object(Bucket=bucket_name, Key=object_key)
         data_bytes = response["Body"].read()
-        return json.loads(data_bytes)
+        return decode_records(data_bytes, object_key)
     except Exception as e:
         print(f"Erreur lors de la récupération de l'objet {object_key} : {e}")
         return None
 
 # Traitement des données
 def json_to_dataframe(json_data):
+    """DataFrame des colonnes utilisées, directement avec les types compacts de SYNOP_DTYPES."""
     try:
-        return pd.DataFrame(json_data)
+        return to_synop_types(pd.DataFrame.from_records(json_data, columns=COLUMNS_USED))
     except ValueError as e:
         print(f"Erreur lors de la conversion en DataFrame : {e}")
         return pd.DataFrame()
 
 def clean_file_name(file_name):
-    return file_name.replace("METEO", "").replace(" ", "_").replace("-", "_").replace("'", "_")
-
-def process_s3_data_to_csv(bucket_name):
-    objects = get_s3_objects(bucket_name)
-    data_by_nom = {}
-
-    for obj in tqdm(objects, desc="Traitement des objets S3"):
-        key = obj["Key"]
-        if not key.endswith(".json"):
-            continue
-
-        json_data = get_s3_object_data(bucket_name, key)
-        if json_data:
-            df = json_to_dataframe(json_data)
-            if not df.empty:
-                df_filtered = df[COLUMNS_USED]
-                for nom in df_filtered['nom'].unique():
-                    df_nom = df_filtered[df_filtered['nom'] == nom]
-                    if nom not in data_by_nom:
-                        data_by_nom[nom] = []
-                    data_by_nom[nom].append(df_nom)
-
-    if not os.path.exists(CSV_OUTPUT_DIR):
-        os.makedirs(CSV_OUTPUT_DIR)
-
-    for nom, df_list in data_by_nom.items():
-        final_df = pd.concat(df_list, ignore_index=True)
-        cleaned_file_name = clean_file_name(nom)
-        file_name = f"{cleaned_file_name}.csv"
-        csv_path = os.path.join(CSV_OUTPUT_DIR, file_name)
-        try:
-            final_df.to_csv(csv_path, index=False)
-        except Exception as e:
-            print(f"Erreur lors de la sauvegarde du fichier CSV pour '{nom}' : {e}")
+    return station_table_name(file_name)
+
+def process_s3_data_to_csv(bucket_name, start=None, end=None, refresh_catalog=False, memory_budget_mb=MEMORY_BUDGET_MB,
+                           staging_format=STAGING_FORMAT, load=None):
+    """Écrit la zone staging des mois demandés. Retourne les fichiers CSV ou partitions Parquet écrits."""
+    objects = get_partitioned_objects(bucket_name, start, end, refresh_catalog)
+    output_dir = PARQUET_OUTPUT_DIR if staging_format == "parquet" else CSV_OUTPUT_DIR
+
+    # Mode direct : pas de fichier, chaque station est transmise à load(ville, table Arrow)
+    writer_options = {"load": load} if staging_format == "direct" else {}
+    with STAGING_WRITERS[staging_format](output_dir, clean_file_name, memory_budget_mb, **writer_options) as writer:
+        for obj in tqdm(objects, desc="Traitement des objets S3"):
+            key = obj["Key"]
+            if not is_raw_file(key):
+                continue
+
+            json_data = get_s3_object_data(bucket_name, key)
+            if json_data:
+                df = json_to_dataframe(json_data)
+                if not df.empty:
+                    df_filtered = df[COLUMNS_USED]
+                    for nom, df_nom in split_by_station(df_filtered):
+                        writer.add(nom, df_nom)
+            writer.end_object()
+    return writer.started
 
 # Gestion MySQL
 def create_table_if_not_exists(city):
     try:
-        cursor.execute(f"""
-            CREATE TABLE IF NOT EXISTS staging.`{city}` (
-                date DATE,
-                nom VARCHAR(255),
-                pmer DOUBLE,
-                tend DOUBLE,
-                cod_tend VARCHAR(50),
-                dd DOUBLE,
-                ff DOUBLE,
-                td DOUBLE,
-                u DOUBLE,
-                ww VARCHAR(10),
-                pres DOUBLE,
-                rafper DOUBLE,
-                rr1 DOUBLE,
-                rr3 DOUBLE,
-                tc DOUBLE
-            );
-        """)
+        create_target_table(cursor, city)
     except Exception as e:
         print(f"Erreur lors de la création de la table {city} : {e}")
 
-def insert_data_from_csv(city, csv_file_path):
+def insert_dataframe(city, df, load_mode=LOAD_MODE, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT):
     try:
-        city_table = city.replace("-", "_")
+        city_table = target_table(city, layout)
         create_table_if_not_exists(city_table)
-        
-        df = pd.read_csv(csv_file_path).fillna(0)  # Remplace les NaN par des chaînes vides
-        insert_query = f"""
-            INSERT INTO staging.`{city_table}` ({', '.join(df.columns)})
-            VALUES ({', '.join(['%s'] * len(df.columns))});
-        """
-        data = [tuple(row) for row in df.values]
-        cursor.executemany(insert_query, data)
+        load_dataframe(cursor, city_table, df, load_mode, on_duplicate)  # Remplace les NaN par des 0
         conn.commit()
     except Exception as e:
         print(f"Erreur lors de l'insertion dans la table {city} : {e}")
 
-def process_csv_to_mysql():
+def insert_arrow(city, arrow_table, load_mode=LOAD_MODE, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT):
+    """Mode direct : les lignes arrivent en table Arrow depuis process_s3_data_to_csv, sans CSV."""
+    try:
+        city_table = target_table(city, layout)
+        create_table_if_not_exists(city_table)
+        load_arrow(cursor, city_table, arrow_table, load_mode, on_duplicate)
+        conn.commit()
+    except Exception as e:
+        print(f"Erreur lors de l'insertion dans la table {city} : {e}")
+
+def insert_csv_file(city, csv_file_path, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT):
+    """Mode infile : le CSV est envoyé tel quel au serveur, sans passer par pandas."""
+    try:
+        city_table = target_table(city, layout)
+        create_table_if_not_exists(city_table)
+        load_csv_file(cursor, city_table, csv_file_path, on_duplicate)
+    except Exception as e:
+        print(f"Erreur lors de l'insertion dans la table {city} : {e}")
+
+def insert_data_from_csv(city, csv_file_path, load_mode=LOAD_MODE, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT):
+    if load_mode == "infile":
+        insert_csv_file(city, csv_file_path, on_duplicate, layout)
+        return
+    try:
+        df = pd.read_csv(csv_file_path)
+    except Exception as e:
+        print(f"Erreur lors de la lecture du fichier {csv_file_path} : {e}")
+        return
+    insert_dataframe(city, df, load_mode, on_duplicate, layout)
+
+def process_csv_to_mysql(load_mode=LOAD_MODE, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT):
     for csv_file in os.listdir(CSV_OUTPUT_DIR):
         if csv_file.endswith(".csv"):
             csv_file_path = os.path.join(CSV_OUTPUT_DIR, csv_file)
             city = os.path.splitext(csv_file)[0].replace("-", "_")
-            insert_data_from_csv(city, csv_file_path)
+            insert_data_from_csv(city, csv_file_path, load_mode, on_duplicate, layout)
+
+def process_parquet_to_mysql(load_mode=LOAD_MODE, on_duplicate=ON_DUPLICATE, layout=STAGING_LAYOUT, partitions=None):
+    """Charge les partitions Parquet écrites par le traitement (partitions), ou tout le jeu de données sans liste."""
+    stations = list_parquet_stations(PARQUET_OUTPUT_DIR) if partitions is None else station_partitions(partitions)
+    for city, station_dirs in stations.items():
+        try:
+            df = read_station_parquet(station_dirs, COLUMNS_USED)
+        except Exception as e:
+            print(f"Erreur lors de la lecture des fichiers Parquet de {city} : {e}")
+            continue
+        insert_dataframe(city.replace("-", "_"), df, load_mode, on_duplicate, layout)
 
 # def fast_process_csv_to_mysql():
 #     for csv_file in os.listdir(CSV_OUTPUT_DIR):
@@ -149,13 +194,40 @@ def process_csv_to_mysql():
 
 # Main
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Traitement des fichiers raw vers la zone staging (CSV puis MySQL).")
+    parser.add_argument("--start", type=str, help="Premier mois à traiter (YYYY-MM). Par défaut, tout le bucket.")
+    parser.add_argument("--end", type=str, help="Dernier mois à traiter (YYYY-MM). Par défaut, égal à --start.")
+    parser.add_argument("--refresh-catalog", action="store_true",
+                        help="Reliste les partitions demandées dans le bucket avant de lire le catalogue.")
+    parser.add_argument("--memory-budget-mb", type=float, default=MEMORY_BUDGET_MB,
+                        help="Écrit les CSV au fil de l'eau dès que le tampon dépasse ce budget (0 : après chaque objet).")
+    parser.add_argument("--staging-format", choices=list(STAGING_WRITERS), default=STAGING_FORMAT,
+                        help="Format de la zone staging : CSV par ville, Parquet partitionné, ou direct (en mémoire, sans fichier).")
+    parser.add_argument("--load-mode", choices=LOAD_MODES, default=LOAD_MODE,
+                        help="Chargement MySQL : INSERT multi-lignes en une transaction (executemany) ou un commit par lot (batch), ou LOAD DATA LOCAL INFILE (infile).")
+    parser.add_argument("--on-duplicate", choices=DUPLICATE_MODES, default=ON_DUPLICATE,
+                        help="Observations déjà chargées (même station, même horodatage) : conservées (ignore) ou remplacées (update).")
+    parser.add_argument("--staging-layout", choices=STAGING_LAYOUTS, default=STAGING_LAYOUT,
+                        help="Une table par ville (per-city) ou une table observations partitionnée par mois (unified).")
+    args = parser.parse_args()
+
     start_time = time.time()
     try:
-        print("Traitement des JSON vers CSV...")
-        process_s3_data_to_csv(BUCKET_NAME)
-
-        print("Insertion des données dans MySQL...")
-        process_csv_to_mysql()
+        load = None
+        if args.staging_format == "direct":
+            load = functools.partial(insert_arrow, load_mode=args.load_mode, on_duplicate=args.on_duplicate,
+                                     layout=args.staging_layout)
+        print(f"Traitement des JSON vers {args.staging_format.upper()}...")
+        written = process_s3_data_to_csv(BUCKET_NAME, args.start, args.end, args.refresh_catalog, args.memory_budget_mb,
+                                         args.staging_format, load)
+
+        # En mode direct, les données ont déjà été insérées pendant le traitement
+        if args.staging_format == "parquet":
+            print("Insertion des données dans MySQL...")
+            process_parquet_to_mysql(args.load_mode, args.on_duplicate, args.staging_layout, written)
+        elif args.staging_format == "csv":
+            print("Insertion des données dans MySQL...")
+            process_csv_to_mysql(args.load_mode, args.on_duplicate, args.staging_layout)
     except Exception as e:
         print(f"Erreur lors de l'exécution principale : {e}")
     finally:
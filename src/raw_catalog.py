@@ -0,0 +1,160 @@
+import gzip
+import json
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+from raw_layout import partition_of_key, partition_prefix, partition_prefixes
+
+# Catalogue du bucket raw : index persistant (clé, taille, ETag, partition)
+# stocké dans le bucket lui-même pour être partagé entre Airflow et l'API.
+# Les clés commençant par '_' sont réservées aux métadonnées et ne sont jamais cataloguées.
+INDEX_KEY = "_catalog/raw_index.json.gz"
+# Manifest de compaction (voir compact_raw.py) : pour chaque partition, les fichiers
+# compactés et les petits objets qu'ils remplacent. Il est écrit en un seul PUT,
+# ce qui rend chaque compaction visible de manière atomique pour les lecteurs.
+COMPACTION_MANIFEST_KEY = "_manifest/compaction.json"
+# L'index est partagé entre plusieurs écrivains (Airflow, API) : chaque mise à jour est écrite
+# par un PUT conditionnel sur l'ETag lu, et recommencée si un autre écrivain est passé entre-temps
+INDEX_WRITE_ATTEMPTS = 5
+CONDITIONAL_WRITE_ERRORS = ("PreconditionFailed", "ConditionalRequestConflict", "412", "409")
+
+def is_data_key(key):
+    return not key.startswith("_")
+
+def list_all_objects(s3, bucket_name, prefix=""):
+    """Liste toutes les clés d'un préfixe, page par page (list_objects_v2 s'arrête à 1 000 clés)."""
+    objects = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        objects.extend(obj for obj in page.get("Contents", []) if is_data_key(obj["Key"]))
+    return objects
+
+def to_entry(obj):
+    partition = partition_of_key(obj["Key"])
+    return {
+        "size": obj["Size"],
+        "etag": obj["ETag"].strip('"'),
+        "partition": f"{partition[0]}-{partition[1]:02d}" if partition else None,
+    }
+
+def read_object_version(s3, bucket_name, key):
+    """Contenu et ETag d'un objet, ou (None, None) s'il n'existe pas."""
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None, None
+        raise
+    return response["Body"].read(), response["ETag"]
+
+def read_object(s3, bucket_name, key):
+    """Contenu d'un objet, ou None s'il n'existe pas."""
+    return read_object_version(s3, bucket_name, key)[0]
+
+def load_index_version(s3, bucket_name):
+    """Index et ETag de sa version lue, ou (None, None) s'il n'existe pas encore."""
+    body, etag = read_object_version(s3, bucket_name, INDEX_KEY)
+    return (None, None) if body is None else (json.loads(gzip.decompress(body)), etag)
+
+def load_index(s3, bucket_name):
+    """Charge l'index depuis le bucket, ou None s'il n'existe pas encore."""
+    return load_index_version(s3, bucket_name)[0]
+
+def load_compaction_manifest(s3, bucket_name):
+    body = read_object(s3, bucket_name, COMPACTION_MANIFEST_KEY)
+    return {"partitions": {}} if body is None else json.loads(body)
+
+def compacted_source_versions(entry):
+    """
+    Sources d'une partition compactée : {clé: ETag}. Les manifests antérieurs ne gardaient que
+    les clés (ETag None) : leur version est inconnue, la partition est reconstruite à la
+    compaction suivante et, d'ici là, les sources restent visibles.
+    """
+    return dict(
+        (source["Key"], source["ETag"]) if isinstance(source, dict) else (source, None)
+        for source in entry["sources"]
+    )
+
+def is_compacted(compacted_sources, key, etag):
+    """Vrai si cette version de l'objet (clé et ETag) est déjà dans les fichiers compactés."""
+    return key in compacted_sources and compacted_sources[key] == etag
+
+def save_compaction_manifest(s3, bucket_name, manifest):
+    body = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+    s3.put_object(Bucket=bucket_name, Key=COMPACTION_MANIFEST_KEY, Body=body, ContentType="application/json")
+
+def save_index(s3, bucket_name, index, etag=None):
+    """
+    Écrit l'index s'il est encore dans la version lue (ETag), ou s'il n'existe pas encore
+    (etag None). Retourne False si un autre écrivain l'a modifié entre-temps.
+    """
+    index["updated_at"] = datetime.now(timezone.utc).isoformat()
+    body = gzip.compress(json.dumps(index, ensure_ascii=False).encode("utf-8"))
+    condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    try:
+        s3.put_object(Bucket=bucket_name, Key=INDEX_KEY, Body=body, ContentType="application/gzip", **condition)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in CONDITIONAL_WRITE_ERRORS:
+            return False
+        raise
+    return True
+
+def touched_prefixes(keys):
+    """Préfixes à relister après l'écriture de ces clés : leur partition, ou la clé elle-même à la racine."""
+    prefixes = set()
+    for key in keys:
+        partition = partition_of_key(key)
+        prefixes.add(partition_prefix(*partition) if partition else key)
+    return sorted(prefixes)
+
+def refresh_catalog(s3, bucket_name, prefixes=None):
+    """
+    Met à jour l'index en relistant uniquement les préfixes donnés (partitions
+    modifiées). Sans préfixe, ou si l'index n'existe pas encore, tout le bucket est relisté.
+    Si un autre écrivain met l'index à jour pendant ce temps, l'index est relu et les
+    préfixes relistés : aucune des deux mises à jour n'est perdue.
+    """
+    for _attempt in range(INDEX_WRITE_ATTEMPTS):
+        index, etag = load_index_version(s3, bucket_name)
+        relisted = prefixes
+        if index is None or not prefixes:
+            index, relisted = {"objects": {}}, [""]
+        objects = index["objects"]
+        for prefix in relisted:
+            for key in [key for key in objects if key.startswith(prefix)]:
+                del objects[key]
+            for obj in list_all_objects(s3, bucket_name, prefix):
+                objects[obj["Key"]] = to_entry(obj)
+        if save_index(s3, bucket_name, index, etag):
+            return index
+        print("Index du catalogue modifié par un autre traitement : nouvelle mise à jour.")
+    raise RuntimeError(f"Index du catalogue non mis à jour après {INDEX_WRITE_ATTEMPTS} tentatives concurrentes.")
+
+def catalog_objects(s3, bucket_name, start=None, end=None, refresh=False, resolve_compaction=True):
+    """
+    Objets de la plage de mois demandée (toutes les clés sans plage), lus depuis l'index,
+    au format de list_objects_v2 ({"Key", "Size", "ETag"}). Avec refresh=True, les
+    partitions demandées sont relistées avant la lecture. Avec resolve_compaction, les
+    petits objets déjà compactés sont remplacés par les fichiers compactés du manifest ; un
+    objet réécrit depuis sa compaction (ETag différent) reste visible jusqu'à la suivante.
+    """
+    prefixes = partition_prefixes(start, end)
+    index = refresh_catalog(s3, bucket_name, prefixes) if refresh else load_index(s3, bucket_name)
+    if index is None:
+        index = refresh_catalog(s3, bucket_name)
+
+    compacted_files, compacted_sources = [], {}
+    if resolve_compaction:
+        for partition, entry in load_compaction_manifest(s3, bucket_name)["partitions"].items():
+            year, month = partition.split("-")
+            if any(partition_prefix(year, month).startswith(prefix) for prefix in prefixes):
+                compacted_files.extend(entry["files"])
+                compacted_sources.update(compacted_source_versions(entry))
+
+    objects = [
+        {"Key": key, "Size": entry["size"], "ETag": entry["etag"]}
+        for key, entry in sorted(index["objects"].items())
+        if not is_compacted(compacted_sources, key, entry["etag"]) and any(key.startswith(prefix) for prefix in prefixes)
+    ]
+    return objects + compacted_files
@@ -0,0 +1,45 @@
+import gzip
+import json
+
+# Formats acceptés dans la zone raw : JSON (tableau d'enregistrements) ou NDJSON
+# (un enregistrement par ligne), éventuellement compressés en gzip.
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+RAW_EXTENSIONS = (".json",) + NDJSON_EXTENSIONS + tuple(ext + ".gz" for ext in (".json",) + NDJSON_EXTENSIONS)
+DEFAULT_EXTENSION = ".ndjson.gz"
+
+def is_raw_file(name):
+    """Indique si le nom de fichier correspond à un format raw lisible."""
+    return name.endswith(RAW_EXTENSIONS)
+
+def strip_raw_extension(name):
+    """Retire l'extension raw (ex : '2023-12.ndjson.gz' -> '2023-12')."""
+    for ext in sorted(RAW_EXTENSIONS, key=len, reverse=True):
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+def decode_records(data_bytes, name):
+    """Décode le contenu d'un fichier raw en liste d'enregistrements selon son extension."""
+    if name.endswith(".gz"):
+        data_bytes = gzip.decompress(data_bytes)
+        name = name[:-3]
+    if name.endswith(NDJSON_EXTENSIONS):
+        return [json.loads(line) for line in data_bytes.splitlines() if line.strip()]
+    return json.loads(data_bytes)
+
+def open_raw_file(file_path, mode="rb"):
+    """Ouvre un fichier raw local, en le décompressant à la volée s'il est en gzip."""
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, mode)
+    return open(file_path, mode)
+
+def iter_records(file_path):
+    """Parcourt les enregistrements d'un fichier raw local sans tout charger pour le NDJSON."""
+    name = file_path[:-3] if file_path.endswith(".gz") else file_path
+    with open_raw_file(file_path) as file:
+        if not name.endswith(NDJSON_EXTENSIONS):
+            yield from json.load(file)
+            return
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,66 @@
+import os
+import re
+
+# Organisation des objets du bucket raw en partitions de style Hive :
+#   year=2023/month=12/2023-12.ndjson.gz
+# Les fichiers dont le mois ne peut pas être déduit restent à la racine du bucket.
+
+NAME_PARTITION_PATTERN = re.compile(r"^(\d{4})-(\d{2})")
+DIR_PARTITION_PATTERN = re.compile(r"(?:^|/)(\d{4})/(\d{2})(?:/|$)")
+KEY_PARTITION_PATTERN = re.compile(r"^year=(\d{4})/month=(\d{2})/")
+
+def partition_prefix(year, month):
+    return f"year={int(year):04d}/month={int(month):02d}/"
+
+def partition_from_path(file_name, rel_dir=""):
+    """
+    Déduit (année, mois) d'un fichier, d'abord depuis son dossier local (YYYY/MM),
+    sinon depuis son nom (YYYY-MM...). Retourne None si aucun des deux ne convient.
+    """
+    match = DIR_PARTITION_PATTERN.search(rel_dir.replace(os.sep, "/"))
+    if match is None:
+        match = NAME_PARTITION_PATTERN.match(file_name)
+    if match is None:
+        return None
+    year, month = int(match.group(1)), int(match.group(2))
+    return (year, month) if 1 <= month <= 12 else None
+
+def raw_object_key(file_name, rel_dir=""):
+    """Clé de l'objet dans le bucket raw pour un fichier local ou ingéré."""
+    partition = partition_from_path(file_name, rel_dir)
+    if partition is None:
+        return file_name
+    return partition_prefix(*partition) + file_name
+
+def partition_of_key(key):
+    """(année, mois) d'une clé partitionnée, ou None pour une clé à la racine."""
+    match = KEY_PARTITION_PATTERN.match(key)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+def parse_month(value):
+    """Convertit 'YYYY-MM' en (année, mois). Lève ValueError si le format est invalide."""
+    match = re.fullmatch(r"(\d{4})-(\d{2})", value or "")
+    if match is None or not 1 <= int(match.group(2)) <= 12:
+        raise ValueError(f"Mois invalide : '{value}' (format attendu : YYYY-MM)")
+    return int(match.group(1)), int(match.group(2))
+
+def month_range(start, end):
+    """Liste des mois (année, mois) de start à end inclus, bornes au format 'YYYY-MM'."""
+    year, month = parse_month(start)
+    end_year, end_month = parse_month(end)
+    months = []
+    while (year, month) <= (end_year, end_month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+def partition_prefixes(start=None, end=None):
+    """
+    Préfixes à lister pour une plage de mois. Sans borne, tout le bucket ('').
+    Une seule borne donne une plage d'un mois.
+    """
+    if not start and not end:
+        return [""]
+    return [partition_prefix(year, month) for year, month in month_range(start or end, end or start)]
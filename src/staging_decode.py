@@ -0,0 +1,31 @@
+import pandas as pd
+import pyarrow as pa
+
+from raw_format import decode_records
+from staging_writer import split_by_station, to_synop_types
+
+# Décodage des objets raw exécuté dans les processus du pool de fast_preprocess_to_staging.
+# Ce module ne doit ouvrir aucune connexion à l'import : il est préchargé par le forkserver.
+# Les résultats reviennent au processus principal sous forme de flux Arrow IPC (un tampon
+# binaire par station) plutôt que de listes de dictionnaires picklées.
+
+def frame_to_ipc(df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as stream:
+        stream.write_table(table)
+    return sink.getvalue()
+
+def ipc_to_frame(buffer):
+    return pa.ipc.open_stream(buffer).read_all().to_pandas()
+
+def decode_to_station_batches(data_bytes, object_key, columns):
+    """Décode un objet raw, garde les colonnes utiles et le découpe par station : [(nom, tampon IPC)]."""
+    try:
+        df = to_synop_types(pd.DataFrame.from_records(decode_records(data_bytes, object_key), columns=columns))
+        if df.empty:
+            return []
+        return [(nom, frame_to_ipc(df_nom)) for nom, df_nom in split_by_station(df)]
+    except Exception as e:
+        print(f"Erreur de décodage ({object_key}) : {e}")
+        return []
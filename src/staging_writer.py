@@ -0,0 +1,261 @@
+import abc
+import os
+import shutil
+import uuid
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from synop import COLUMNS_USED, SYNOP_DTYPES
+
+MB = 1024 * 1024
+
+# Schéma explicite de la zone staging au format Parquet
+STAGING_SCHEMA = pa.schema([
+    ("date", pa.timestamp("s", tz="UTC")),
+    ("nom", pa.string()),
+    ("pmer", pa.float64()),
+    ("tend", pa.float64()),
+    ("cod_tend", pa.string()),
+    ("dd", pa.float64()),
+    ("ff", pa.float64()),
+    ("td", pa.float64()),
+    ("u", pa.float64()),
+    ("ww", pa.string()),
+    ("pres", pa.float64()),
+    ("rafper", pa.float64()),
+    ("rr1", pa.float64()),
+    ("rr3", pa.float64()),
+    ("tc", pa.float64()),
+])
+PARQUET_COMPRESSION = "zstd"
+# Décimales conservées en repassant un float32 en float64 : les mesures SYNOP en ont au plus
+# deux, et l'arrondi retire le bruit de conversion (12.3 et non 12.300000190734863)
+FLOAT32_DECIMALS = 3
+
+def split_by_station(df, column="nom"):
+    """
+    Découpe un DataFrame par station en un seul passage : les stations sont codées
+    une fois (factorize), les lignes triées une seule fois par station, puis chaque
+    station est une tranche contiguë. Évite un masque booléen sur tout le DataFrame
+    et une copie par station. Les lignes sans station sont ignorées.
+    """
+    codes, stations = pd.factorize(df[column])
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    order = order[sorted_codes >= 0]
+    sorted_codes = sorted_codes[sorted_codes >= 0]
+    if len(order) == 0:
+        return
+    df_sorted = df.take(order)
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(sorted_codes)) + 1, [len(sorted_codes)]))
+    for begin, end in zip(bounds[:-1], bounds[1:]):
+        yield stations[sorted_codes[begin]], df_sorted.iloc[begin:end]
+
+class StationWriter(abc.ABC):
+    """
+    Écrit les lignes de chaque station dans la zone staging.
+
+    Les DataFrames reçus sont mis en tampon puis écrits dès que le tampon dépasse le
+    budget mémoire : la mémoire utilisée ne dépend plus de la taille totale des données.
+    Avec un budget de 0, chaque objet raw est écrit dès qu'il est traité ; sans budget
+    (None), tout est écrit à la fermeture, comme avant. Les sous-classes définissent
+    le format d'écriture dans write_station.
+    """
+    def __init__(self, output_dir, file_name_for, memory_budget_mb=None):
+        self.output_dir = output_dir
+        self.file_name_for = file_name_for
+        self.memory_budget = None if memory_budget_mb is None else memory_budget_mb * MB
+        self.buffers = {}
+        self.buffered_bytes = 0
+        self.started = set()
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, nom, df):
+        data = self.prepare(df)
+        self.buffers.setdefault(nom, []).append(data)
+        if self.memory_budget is not None:
+            self.buffered_bytes += self.size_of(data)
+            if self.buffered_bytes >= self.memory_budget:
+                self.flush()
+
+    def prepare(self, df):
+        """Forme sous laquelle les lignes sont gardées en tampon."""
+        return df
+
+    def size_of(self, df):
+        return int(df.memory_usage(deep=True).sum())
+
+    def concat(self, parts):
+        return pd.concat(parts, ignore_index=True)
+
+    def end_object(self):
+        """À appeler après chaque objet raw : vide le tampon en mode écriture immédiate."""
+        if self.memory_budget == 0:
+            self.flush()
+
+    def flush(self):
+        for nom, df_list in self.buffers.items():
+            try:
+                self.write_station(nom, self.concat(df_list))
+            except Exception as e:
+                print(f"Erreur lors de la sauvegarde des données de staging pour '{nom}' : {e}")
+        self.buffers = {}
+        self.buffered_bytes = 0
+
+    @abc.abstractmethod
+    def write_station(self, nom, df):
+        """Écrit les lignes tamponnées d'une station au format de la sous-classe."""
+
+    def close(self):
+        self.flush()
+
+class StationCsvWriter(StationWriter):
+    """Un fichier CSV par station, complété en mode append au fil des écritures."""
+    def write_station(self, nom, df):
+        csv_path = os.path.join(self.output_dir, f"{self.file_name_for(nom)}.csv")
+        # Le premier écrit d'une exécution remplace le fichier précédent, les suivants s'y ajoutent
+        first_write = csv_path not in self.started
+        df.to_csv(csv_path, mode="w" if first_write else "a", header=first_write, index=False)
+        self.started.add(csv_path)
+
+class StationParquetWriter(StationWriter):
+    """
+    Jeu de données Parquet partitionné station=/year=/month=, compressé en zstd,
+    avec le schéma STAGING_SCHEMA. Chaque écriture ajoute un fichier à la partition.
+    """
+    def write_station(self, nom, df):
+        df = to_staging_types(df)
+        station = self.file_name_for(nom)
+        for (year, month), df_month in df.groupby([df["date"].dt.year, df["date"].dt.month], sort=False):
+            partition_dir = os.path.join(self.output_dir, f"station={station}", f"year={year}", f"month={month:02d}")
+            # Le premier écrit d'une exécution dans une partition remplace son contenu précédent
+            if partition_dir not in self.started:
+                shutil.rmtree(partition_dir, ignore_errors=True)
+                os.makedirs(partition_dir, exist_ok=True)
+                self.started.add(partition_dir)
+            table = pa.Table.from_pandas(df_month, schema=STAGING_SCHEMA, preserve_index=False)
+            pq.write_table(table, os.path.join(partition_dir, f"part-{uuid.uuid4().hex}.parquet"),
+                           compression=PARQUET_COMPRESSION)
+
+class StationArrowWriter(StationWriter):
+    """
+    Zone staging en mémoire, sans fichier : les lignes de chaque station sont gardées en
+    tables Arrow (schéma STAGING_SCHEMA) puis transmises à load(ville, table), par exemple
+    le chargement MySQL. Évite l'aller-retour par les CSV (écriture, relecture, parsing).
+    """
+    def __init__(self, output_dir, file_name_for, memory_budget_mb=None, load=None):
+        super().__init__(None, file_name_for, memory_budget_mb)
+        self.load = load
+
+    def prepare(self, df):
+        return pa.Table.from_pandas(to_staging_types(df), schema=STAGING_SCHEMA, preserve_index=False)
+
+    def size_of(self, table):
+        return table.nbytes
+
+    def concat(self, parts):
+        return pa.concat_tables(parts)
+
+    def write_station(self, nom, table):
+        self.load(self.file_name_for(nom), table)
+
+STAGING_WRITERS = {"csv": StationCsvWriter, "parquet": StationParquetWriter, "direct": StationArrowWriter}
+
+def to_synop_types(df):
+    """
+    Applique SYNOP_DTYPES en une passe vectorisée par colonne. Les colonnes absentes sont
+    ajoutées vides, les valeurs non numériques ou dates invalides deviennent manquantes.
+    """
+    columns = {}
+    for column in COLUMNS_USED:
+        values = df[column] if column in df.columns else pd.Series(np.nan, index=df.index)
+        dtype = SYNOP_DTYPES[column]
+        if dtype == "datetime":
+            columns[column] = pd.to_datetime(values, utc=True, errors="coerce")
+        elif dtype == "category":
+            columns[column] = values.astype("string").astype("category")
+        else:
+            columns[column] = pd.to_numeric(values, errors="coerce").astype(dtype)
+    return pd.DataFrame(columns, index=df.index)
+
+def to_plain_types(df):
+    """Repasse les colonnes compactes (catégories, float32) en types standards avant écriture."""
+    df = df.copy()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+        elif df[column].dtype == np.float32:
+            df[column] = df[column].astype(np.float64).round(FLOAT32_DECIMALS)
+    return df
+
+def to_staging_types(df):
+    """Convertit les colonnes vers les types de STAGING_SCHEMA (dates UTC, nombres, chaînes)."""
+    df = to_plain_types(df)
+    for field in STAGING_SCHEMA:
+        if field.name == "date":
+            df["date"] = pd.to_datetime(df["date"], utc=True)
+        elif pa.types.is_string(field.type):
+            df[field.name] = df[field.name].astype("string")
+        else:
+            df[field.name] = pd.to_numeric(df[field.name], errors="coerce")
+    return df[STAGING_SCHEMA.names]
+
+def list_parquet_stations(output_dir):
+    """Stations présentes dans le jeu de données Parquet : {nom de la station: dossier}."""
+    if not os.path.isdir(output_dir):
+        return {}
+    return {
+        entry.split("=", 1)[1]: os.path.join(output_dir, entry)
+        for entry in sorted(os.listdir(output_dir)) if entry.startswith("station=")
+    }
+
+def station_partitions(partition_dirs):
+    """Partitions year=/month= regroupées par station : {nom de la station: [dossiers]}."""
+    stations = {}
+    for partition_dir in sorted(partition_dirs):
+        station_dir = os.path.dirname(os.path.dirname(os.path.normpath(partition_dir)))
+        stations.setdefault(os.path.basename(station_dir).split("=", 1)[1], []).append(partition_dir)
+    return stations
+
+def read_station_parquet(station_dir, columns=None):
+    """
+    Lit les partitions d'une station (son dossier, ou une liste de dossiers year=/month=), en ne
+    chargeant que les colonnes demandées (fichiers mappés en mémoire).
+    """
+    paths = [station_dir] if isinstance(station_dir, str) else station_dir
+    tables = [pq.read_table(path, columns=columns or STAGING_SCHEMA.names, memory_map=True) for path in paths]
+    return pa.concat_tables(tables).to_pandas()
+
+def to_mysql_rows(df):
+    """Lignes prêtes pour MySQL : NaN remplacés par 0, dates ramenées en UTC au format DATETIME de MySQL."""
+    df = to_plain_types(df.dropna(subset=["date"])).fillna(0)  # Sans date, une observation n'a pas de clé
+    df["date"] = pd.to_datetime(df["date"], utc=True).dt.strftime("%Y-%m-%d %H:%M:%S")
+    return [tuple(row) for row in df.values]
+
+def arrow_to_mysql_rows(table):
+    """
+    Équivalent de to_mysql_rows pour une table Arrow, colonne par colonne et sans pandas :
+    lignes sans date écartées, valeurs manquantes à 0 ('0' pour les textes), dates en UTC.
+    """
+    table = table.filter(pc.is_valid(table["date"]))
+    columns = []
+    for field in table.schema:
+        column = table[field.name]
+        if pa.types.is_timestamp(field.type):
+            column = pc.strftime(column, format="%Y-%m-%d %H:%M:%S")
+        elif pa.types.is_string(field.type):
+            column = pc.fill_null(column, "0")
+        else:
+            column = pc.fill_null(column, 0)
+        columns.append(column.to_pylist())
+    return list(zip(*columns))
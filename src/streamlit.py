@@ -4,16 +4,39 @@ import pymongo
 
 mongo_client = pymongo.MongoClient("mongodb://host.docker.internal:27017/")
 mongo_db = mongo_client["curated"]
-weather_stats = mongo_db["WeatherStats"]
+
+# Collections de la zone curated par granularité (voir curated_rollups)
+CURATED_COLLECTIONS = {
+    "Jour": "WeatherStats",
+    "Semaine": "WeatherStatsWeekly",
+    "Mois": "WeatherStatsMonthly",
+    "Année": "WeatherStatsYearly",
+}
 
 # Récupérer les données depuis MongoDB
 @st.cache_data
-def fetch_data():
-    data = list(weather_stats.find({}, {"_id": 0}))  # Exclure l'_id pour éviter des problèmes d'affichage
+def fetch_cities():
+    return sorted(mongo_db["WeatherStats"].distinct("city"))
+
+@st.cache_data
+def fetch_data(collection_name, city):
+    # Lecture d'une seule ville par l'index (city, period) ; exclure l'_id pour éviter des
+    # problèmes d'affichage, et les agrégats partiels (usage interne)
+    data = list(mongo_db[collection_name].find({"city": city}, {"_id": 0, "partials": 0}).sort("period", 1))
     return data
 
+with st.sidebar:
+    st.header("Filtres")
+
+    # Granularité : les vues longues lisent les agrégats hebdomadaires, mensuels ou annuels
+    # au lieu de tous les jours
+    granularity = st.selectbox("Granularité :", options=list(CURATED_COLLECTIONS))
+
+    # Filtrage par ville
+    selected_city = st.selectbox("Sélectionnez une ville :", options=fetch_cities())
+
 # Charger les données dans un DataFrame
-data = fetch_data()
+data = fetch_data(CURATED_COLLECTIONS[granularity], selected_city)
 df = pd.json_normalize(data, sep="_")
 
 # Convertir 'period' en format datetime
@@ -24,18 +47,16 @@ st.title("Visualisation des données météorologiques (Curated)")
 
 # Déplacer les filtres dans la barre latérale
 with st.sidebar:
-    st.header("Filtres")
-    
-    # Choisir l'année
+    # Choisir l'année (toutes les années en granularité annuelle)
     years = df["period"].dt.year.unique()
-    selected_year = st.selectbox("Sélectionnez une année :", options=sorted(years))
+    if granularity == "Année":
+        selected_year = st.select_slider("Plage d'années :", options=sorted(years), value=(min(years), max(years)))
+    else:
+        selected_year = st.selectbox("Sélectionnez une année :", options=sorted(years))
     
     # Sélectionner une plage de mois
-    selected_month_range = st.slider("Sélectionnez une plage de mois", min_value=1, max_value=12, value=(1, 12))
-    
-    # Filtrage par ville
-    cities = sorted(df["city"].unique())
-    selected_city = st.selectbox("Sélectionnez une ville :", options=cities)
+    selected_month_range = st.slider("Sélectionnez une plage de mois", min_value=1, max_value=12, value=(1, 12),
+                                     disabled=granularity == "Année")
     
     # Filtrage par métrique
     metrics = ["temperature", "pressure", "wind_speed", "rainfall"]
@@ -43,8 +64,11 @@ with st.sidebar:
     
 
 # Appliquer les filtres
-filtered_df = df[(df["city"] == selected_city) & (df["period"].dt.year == selected_year)]
-filtered_df = filtered_df[filtered_df["period"].dt.month.between(*selected_month_range)]
+if granularity == "Année":
+    filtered_df = df[(df["city"] == selected_city) & df["period"].dt.year.between(*selected_year)]
+else:
+    filtered_df = df[(df["city"] == selected_city) & (df["period"].dt.year == selected_year)]
+    filtered_df = filtered_df[filtered_df["period"].dt.month.between(*selected_month_range)]
 
 # Filtrer les colonnes en fonction de la métrique sélectionnée
 metric_columns = [col for col in filtered_df.columns if col.startswith(f"metrics_{selected_metric}")]
@@ -72,6 +96,17 @@ if not filtered_df.empty:
             min_temp = non_zero_min_temps.min()
             min_temp_date = filtered_df.loc[filtered_df["metrics_temperature_min"] == min_temp, "period"].values[0]
             st.write(f"📉 **Température minimale** : {min_temp}°C atteint le {pd.to_datetime(min_temp_date).strftime('%Y-%m-%d')}")
+
+    # Événements extrêmes précalculés par la zone curated (documents journaliers)
+    if "extreme_events" in filtered_df.columns:
+        events = [
+            {"period": period.strftime("%Y-%m-%d"), **event}
+            for period, day_events in zip(filtered_df["period"], filtered_df["extreme_events"])
+            for event in day_events
+        ]
+        if events:
+            st.write("### Événements extrêmes")
+            st.dataframe(pd.DataFrame(events))
     
 else:
     st.write("Aucune donnée disponible pour les filtres sélectionnés.")
\ No newline at end of file
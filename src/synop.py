@@ -0,0 +1,29 @@
+# Définition partagée des colonnes SYNOP utilisées par le pipeline.
+# fetch.py s'en sert pour ne demander que ces champs à l'API OpenDataSoft,
+# et les scripts de staging pour filtrer les DataFrames.
+COLUMNS_USED = ['date', 'nom', 'pmer', 'tend', 'cod_tend', 'dd', 'ff', 'td', 'u', 'ww', 'pres', 'rafper', 'rr1', 'rr3', 'tc']
+
+# Types compacts des colonnes utilisées, appliqués une seule fois à la construction des
+# DataFrames (voir staging_writer.to_synop_types) : mesures en float32, codes et noms de
+# station en catégories, dates en datetime UTC.
+SYNOP_DTYPES = {
+    'date': 'datetime',
+    'nom': 'category',
+    'pmer': 'float32',
+    'tend': 'float32',
+    'cod_tend': 'category',
+    'dd': 'float32',
+    'ff': 'float32',
+    'td': 'float32',
+    'u': 'float32',
+    'ww': 'category',
+    'pres': 'float32',
+    'rafper': 'float32',
+    'rr1': 'float32',
+    'rr3': 'float32',
+    'tc': 'float32',
+}
+
+def station_table_name(nom):
+    """Nom de ville dérivé d'une station SYNOP, utilisé pour les tables et fichiers de staging."""
+    return nom.replace("METEO", "").replace(" ", "_").replace("-", "_").replace("'", "_")
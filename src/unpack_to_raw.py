@@ -1,17 +1,38 @@
 import os
+import hashlib
+import time
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import subprocess
 import argparse
 
-def upload_to_s3(bucket_name):
-    input_dir = "/opt/airflow/data/raw"
-    s3 = boto3.client("s3",
-                      endpoint_url="http://localstack:4566",
-                      aws_access_key_id="root",
-                      aws_secret_access_key="root")  # Remplace par l'URL de ton endpoint S3 local si nécessaire
+from raw_format import is_raw_file
+from raw_layout import raw_object_key
+from raw_catalog import list_all_objects, refresh_catalog, touched_prefixes
 
-    # Vérifie si le bucket existe, sinon le crée
+INPUT_DIR = "/opt/airflow/data/raw"
+MAX_WORKERS = 8  # Nombre de fichiers envoyés en parallèle
+MB = 1024 * 1024
+
+# Configuration des transferts multipart : les gros fichiers sont découpés en
+# parties de 8 Mo envoyées en parallèle.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * MB,
+    multipart_chunksize=8 * MB,
+    max_concurrency=4,
+    use_threads=True,
+)
+
+def get_s3_client():
+    return boto3.client("s3",
+                        endpoint_url="http://localstack:4566",
+                        aws_access_key_id="root",
+                        aws_secret_access_key="root")  # Remplace par l'URL de ton endpoint S3 local si nécessaire
+
+def ensure_bucket(s3, bucket_name):
+    """Vérifie si le bucket existe, sinon le crée. Retourne False en cas d'erreur."""
     try:
         s3.head_bucket(Bucket=bucket_name)
         print(f"Le bucket {bucket_name} existe déjà.")
@@ -23,32 +44,139 @@ def upload_to_s3(bucket_name):
                 print(f"Bucket {bucket_name} créé avec succès.")
             except ClientError as create_error:
                 print(f"Erreur lors de la création du bucket : {create_error}")
-                return
+                return False
         else:
             print(f"Erreur lors de la vérification du bucket : {e}")
-            return
+            return False
+    return True
 
-    # Télécharge les fichiers dans le bucket
-    print(input_dir)
+def list_local_files(input_dir):
+    """
+    Liste les fichiers à envoyer : (chemin local, clé de l'objet). Les dossiers
+    YYYY/MM deviennent des partitions year=YYYY/month=MM dans le bucket.
+    """
+    local_files = []
     for root, dirs, files in os.walk(input_dir):
         dirs.sort()  # Trie les dossiers par ordre alphabétique
         files.sort()  # Trie les fichiers par ordre alphabétique
 
         for file_name in files:
-            file_path = os.path.join(root, file_name)
+            # Vérifie si le fichier est un JSON/NDJSON (gzip ou non) ou contient 'data-' dans le nom
+            if is_raw_file(file_name) or 'data-' in file_name:
+                rel_dir = os.path.relpath(root, input_dir)
+                local_files.append((os.path.join(root, file_name), raw_object_key(file_name, rel_dir)))
+    return local_files
+
+def list_remote_objects(s3, bucket_name):
+    """Liste tous les objets du bucket (toutes les pages) : clé -> (taille, ETag)."""
+    return {obj["Key"]: (obj["Size"], obj["ETag"].strip('"')) for obj in list_all_objects(s3, bucket_name)}
+
+def compute_etag(file_path, config=TRANSFER_CONFIG):
+    """
+    Calcule localement l'ETag que S3 attribuera au fichier avec cette configuration :
+    le MD5 du contenu en envoi simple, le MD5 des MD5 des parties suffixé du nombre
+    de parties en envoi multipart.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as file:
+        if size < config.multipart_threshold:
+            return hashlib.md5(file.read()).hexdigest()
+        part_digests = []
+        for chunk in iter(lambda: file.read(config.multipart_chunksize), b""):
+            part_digests.append(hashlib.md5(chunk).digest())
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+def is_unchanged(file_path, remote_object, check):
+    """Compare un fichier local à l'objet distant, par taille seule ou par taille et ETag."""
+    if remote_object is None:
+        return False
+    remote_size, remote_etag = remote_object
+    if os.path.getsize(file_path) != remote_size:
+        return False
+    return check == "size" or compute_etag(file_path) == remote_etag
+
+def upload_file(s3, bucket_name, file_path, key):
+    s3.upload_file(file_path, bucket_name, key, Config=TRANSFER_CONFIG)
+    return os.path.getsize(file_path)
+
+def sync_to_s3(bucket_name, input_dir=INPUT_DIR, max_workers=MAX_WORKERS, check="etag"):
+    """
+    Synchronisation incrémentale : n'envoie que les fichiers absents du bucket ou
+    dont le contenu a changé, en parallèle, puis affiche un résumé.
+    """
+    s3 = get_s3_client()
+    if not ensure_bucket(s3, bucket_name):
+        return
+
+    start_time = time.time()
+    remote = list_remote_objects(s3, bucket_name)
+    to_upload = []
+    skipped_files = skipped_bytes = 0
+    for file_path, key in list_local_files(input_dir):
+        if is_unchanged(file_path, remote.get(key), check):
+            skipped_files += 1
+            skipped_bytes += os.path.getsize(file_path)
+        else:
+            to_upload.append((file_path, key))
+
+    sent_files = sent_bytes = 0
+    sent_keys = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(upload_file, s3, bucket_name, file_path, key): key for file_path, key in to_upload}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                sent_bytes += future.result()
+                sent_files += 1
+                sent_keys.append(key)
+                print(f"Fichier {key} téléchargé avec succès dans le bucket {bucket_name}.")
+            except Exception as e:
+                errors.append(key)
+                print(f"Erreur lors du téléchargement du fichier {key} : {e}")
+
+    print(f"Synchronisation terminée en {time.time() - start_time:.2f} secondes : "
+          f"{sent_files} fichiers envoyés ({sent_bytes / MB:.2f} Mo), "
+          f"{skipped_files} fichiers inchangés ignorés ({skipped_bytes / MB:.2f} Mo), "
+          f"{len(errors)} erreurs.")
+
+    # Mise à jour du catalogue pour les seules partitions modifiées
+    if sent_keys:
+        refresh_catalog(s3, bucket_name, touched_prefixes(sent_keys))
+
+def upload_to_s3(bucket_name):
+    input_dir = INPUT_DIR
+    s3 = get_s3_client()
+
+    # Vérifie si le bucket existe, sinon le crée
+    if not ensure_bucket(s3, bucket_name):
+        return
+
+    # Télécharge les fichiers dans le bucket
+    print(input_dir)
+    for file_path, key in list_local_files(input_dir):
+        print(f"Téléchargement du fichier : {key} (chemin : {file_path})")
+
+        try:
+            s3.upload_file(file_path, bucket_name, key)
+            print(f"Fichier {key} téléchargé avec succès dans le bucket {bucket_name}.")
+        except Exception as e:
+            print(f"Erreur lors du téléchargement du fichier {key} : {e}")
 
-            # Vérifie si le fichier est un JSON ou contient 'data-' dans le nom
-            if file_name.endswith('.json') or 'data-' in file_name:
-                print(f"Téléchargement du fichier : {file_name} (chemin : {file_path})")
+    # Reconstruction complète du catalogue du bucket
+    refresh_catalog(s3, bucket_name)
 
-                try:
-                    s3.upload_file(file_path, bucket_name, file_name)
-                    print(f"Fichier {file_name} téléchargé avec succès dans le bucket {bucket_name}.")
-                except Exception as e:
-                    print(f"Erreur lors du téléchargement du fichier {file_name} : {e}")
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Parcours récursivement les dossiers et charge les fichiers JSON dans un bucket S3.")
     parser.add_argument("--bucket_name", type=str, required=True, help="Nom du bucket S3")
+    parser.add_argument("--mode", choices=["sync", "full"], default="sync",
+                        help="'sync' n'envoie que les fichiers nouveaux ou modifiés, en parallèle ; 'full' renvoie tout un par un.")
+    parser.add_argument("--check", choices=["etag", "size"], default="etag",
+                        help="Comparaison utilisée en mode sync : ETag (contenu) ou taille seule.")
+    parser.add_argument("--max_workers", type=int, default=MAX_WORKERS, help="Nombre d'envois simultanés en mode sync")
     args = parser.parse_args()
 
-    upload_to_s3(args.bucket_name)
\ No newline at end of file
+    if args.mode == "full":
+        upload_to_s3(args.bucket_name)
+    else:
+        sync_to_s3(args.bucket_name, max_workers=args.max_workers, check=args.check)
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from curated_rollups import build_rollup_documents, merge_partials, period_start
+from curated_store import PARTIAL_FIELDS
+
+def partials(city, period, tc, rain):
+    """Partiels d'un document, à plat comme les lit read_partials (json_normalize, sep="_")."""
+    values = {
+        "temperature": {"sum": tc, "count": 1, "min": tc, "max": tc},
+        "pressure": {"sum": 101000.0, "count": 1, "min": 101000.0, "max": 101000.0},
+        "wind_speed": {"sum": 3.0, "count": 1, "max": 3.0, "max_gust": 8.0},
+        "rainfall": {"sum": rain, "rainy_days": int(rain > 0), "sum_rr3": rain, "max_3h": rain},
+    }
+    row = {"city": city, "period": period}
+    for metric, fields in PARTIAL_FIELDS.items():
+        row.update({f"partials_{metric}_{key}": values[metric][key] for key in fields})
+    return row
+
+def test_period_start():
+    periods = ["2023-12-31", "2024-01-01", "2024-01-07", "2024-01-08", "2024-02-29"]
+    assert period_start(periods, "weekly").dt.strftime("%Y-%m-%d").tolist() == [
+        "2023-12-25", "2024-01-01", "2024-01-01", "2024-01-08", "2024-02-26",
+    ]
+    assert period_start(periods, "monthly").dt.strftime("%Y-%m-%d").tolist() == [
+        "2023-12-01", "2024-01-01", "2024-01-01", "2024-01-01", "2024-02-01",
+    ]
+    assert period_start(periods, "yearly").dt.strftime("%Y-%m-%d").tolist() == [
+        "2023-01-01", "2024-01-01", "2024-01-01", "2024-01-01", "2024-01-01",
+    ]
+
+def test_weekly_merge_splits_on_monday():
+    # Dimanche 07/01 et lundi 08/01 tombent dans deux semaines différentes
+    df = pd.DataFrame([
+        partials("A", "2024-01-06", 2.0, 0.0),
+        partials("A", "2024-01-07", 4.0, 1.5),
+        partials("A", "2024-01-08", 9.0, 3.0),
+        partials("B", "2024-01-07", 1.0, 0.0),
+    ])
+    documents = {
+        (document["city"], document["period"]): document
+        for document in build_rollup_documents(merge_partials(df, "weekly"))
+    }
+
+    assert sorted(documents) == [("A", "2024-01-01"), ("A", "2024-01-08"), ("B", "2024-01-01")]
+    week = documents[("A", "2024-01-01")]["metrics"]
+    assert week["temperature"] == {"avg": 3.0, "min": 2.0, "max": 4.0}
+    assert week["rainfall"]["days_with_rain"] == 1
+    assert week["rainfall"]["total"] == 1.5
+    assert documents[("A", "2024-01-08")]["metrics"]["temperature"]["avg"] == 9.0
+
+def test_yearly_merge_from_monthly_partials():
+    daily = pd.DataFrame([
+        partials("A", day.strftime("%Y-%m-%d"), float(day.month), 1.0 if day.day == 1 else 0.0)
+        for day in pd.date_range("2023-11-01", "2024-02-29")
+    ])
+    monthly = merge_partials(daily, "monthly")
+    monthly = monthly.assign(period=monthly["period"].dt.strftime("%Y-%m-%d"))
+    years = {document["period"]: document for document in build_rollup_documents(merge_partials(monthly, "yearly"))}
+    direct = {document["period"]: document for document in build_rollup_documents(merge_partials(daily, "yearly"))}
+
+    assert sorted(years) == ["2023-01-01", "2024-01-01"]
+    assert years == direct
+    assert years["2023-01-01"]["partials"]["temperature"]["count"] == 61
+    assert years["2024-01-01"]["metrics"]["rainfall"]["days_with_rain"] == 2
+    assert years["2024-01-01"]["metrics"]["temperature"]["min"] == 1.0
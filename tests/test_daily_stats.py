@@ -0,0 +1,73 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from daily_stats import DAILY_STATS_COLUMNS, daily_stats_parquet, daily_stats_per_city_tables, merge_midnight_rr3
+from mysql_loader import STAGING_TABLE_COLUMNS
+from staging_writer import StationParquetWriter, to_mysql_rows, to_synop_types
+
+CITY = "PARIS_MONTSOURIS"
+
+@pytest.fixture
+def observations():
+    """Deux jours d'une station, avec des mesures manquantes et des heures non synoptiques."""
+    return to_synop_types(pd.DataFrame({
+        "date": ["2023-12-01T00:00:00+00:00", "2023-12-01T03:00:00+00:00", "2023-12-01T04:00:00+00:00",
+                 "2023-12-01T06:00:00+00:00", "2023-12-02T00:00:00+00:00", "2023-12-02T01:00:00+00:00"],
+        "nom": ["PARIS-MONTSOURIS"] * 6,
+        "tc": [4.5, np.nan, 6.0, 7.5, np.nan, -1.0],
+        "pmer": [101200, 101150, np.nan, 101100, 100900, 100950],
+        "ff": [3.0, 4.5, 2.0, np.nan, 6.0, 5.5],
+        "rr1": [0.0, 1.2, np.nan, 0.4, 0.0, 2.0],
+        "rr3": [0.0, 2.5, 3.0, np.nan, 1.0, 4.0],
+        "rafper": [8.0, np.nan, 9.5, 7.0, 12.0, 11.0],
+    }))
+
+def sqlite_engine():
+    """Moteur SQLite avec la fonction HOUR() de MySQL, pour exécuter DAILY_METRICS_SQL."""
+    engine = create_engine("sqlite://")
+
+    @event.listens_for(engine, "connect")
+    def add_hour_function(dbapi_connection, _record):
+        dbapi_connection.create_function("HOUR", 1, lambda value: int(value[11:13]))
+
+    return engine
+
+def normalized(df):
+    df = df[DAILY_STATS_COLUMNS].assign(period=pd.to_datetime(df["period"]))
+    numeric = [column for column in DAILY_STATS_COLUMNS if column not in ("city", "period")]
+    return df.astype({column: float for column in numeric}).sort_values("period", ignore_index=True)
+
+def test_parquet_and_mysql_engines_agree(observations, tmp_path):
+    with StationParquetWriter(str(tmp_path), lambda _nom: CITY) as writer:
+        writer.write_station("PARIS-MONTSOURIS", observations)
+    parquet = daily_stats_parquet(str(tmp_path))
+
+    # Même chargement que la staging MySQL : mesures manquantes à 0 (to_mysql_rows)
+    engine = sqlite_engine()
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE `{CITY}` ({STAGING_TABLE_COLUMNS});"))
+        columns = list(observations.columns)
+        conn.exec_driver_sql(
+            f"INSERT INTO `{CITY}` ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))});",
+            to_mysql_rows(observations),
+        )
+    mysql = merge_midnight_rr3(daily_stats_per_city_tables(engine, [CITY]))
+
+    pd.testing.assert_frame_equal(normalized(parquet), normalized(mysql))
+
+def test_rr3_day_ends_with_next_midnight(observations, tmp_path):
+    with StationParquetWriter(str(tmp_path), lambda _nom: CITY) as writer:
+        writer.write_station("PARIS-MONTSOURIS", observations)
+    totals = normalized(daily_stats_parquet(str(tmp_path)))["total_rr3"].tolist()
+
+    # 01/12 : 03 h (2,5) et 06 h (manquant, 0) du jour, puis 00 h du 02/12 (1,0) ; 04 h n'est pas
+    # synoptique et 00 h du 01/12 appartient à la veille. Le 02/12 n'a ni heure de jour ni lendemain.
+    assert totals[0] == pytest.approx(3.5)
+    assert np.isnan(totals[1])
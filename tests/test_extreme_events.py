@@ -0,0 +1,113 @@
+import os
+import random
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import extreme_events
+from extreme_events import (
+    CONTEXT_DAYS, THRESHOLDS_COLLECTION, detect_extreme_events, load_thresholds, read_daily_metrics, update_extreme_events,
+)
+from curated_store import DAILY_COLLECTION
+
+class FakeCollection:
+    """Collection en mémoire : find avec $or, $in, $gte, $lte et bulk_write d'UpdateOne/ReplaceOne."""
+    def __init__(self):
+        self.documents = {}
+
+    def find(self, query, projection=None):
+        return [dict(document) for document in self.documents.values() if self.matches(document, query)]
+
+    def matches(self, document, query):
+        for field, condition in query.items():
+            if field == "$or":
+                if not any(self.matches(document, clause) for clause in condition):
+                    return False
+            elif isinstance(condition, dict):
+                value = document.get(field)
+                if "$in" in condition and value not in condition["$in"]:
+                    return False
+                if "$gte" in condition and (value is None or value < condition["$gte"]):
+                    return False
+                if "$lte" in condition and (value is None or value > condition["$lte"]):
+                    return False
+            elif document.get(field) != condition:
+                return False
+        return True
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            key = tuple(sorted(request._filter.items()))
+            if "$set" in request._doc:
+                self.documents[key].update(request._doc["$set"])
+            else:
+                self.documents[key] = dict(request._doc)
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def document(self, city, period):
+        return self.documents[(("city", city), ("period", period))]
+
+@pytest.fixture
+def mongo_db():
+    """Deux villes sur trois ans, avec une vague de chaleur de 31 jours en juillet 2022 pour A."""
+    rng = random.Random(1)
+    db = {DAILY_COLLECTION: FakeCollection(), THRESHOLDS_COLLECTION: FakeCollection()}
+    for city in ["A", "B"]:
+        for day in pd.date_range("2020-01-01", "2022-12-31"):
+            max_temp = 20 + 12 * (day.month in (7, 8)) * rng.random()
+            if city == "A" and day.year == 2022 and day.month == 7:
+                max_temp += 15
+            period = day.strftime("%Y-%m-%d")
+            db[DAILY_COLLECTION].documents[(("city", city), ("period", period))] = {
+                "city": city, "period": period, "extreme_events": [],
+                "metrics": {
+                    "temperature": {"max": max_temp},
+                    "wind_speed": {"max_gust": rng.uniform(0, 25)},
+                    "rainfall": {"total_rr3": rng.choice([0, 0, 0, 5, 30])},
+                },
+            }
+    touched = [(document["city"], document["period"]) for document in db[DAILY_COLLECTION].documents.values()]
+    update_extreme_events(db, touched)
+    return db
+
+def full_recompute(db):
+    """Événements attendus : détection sur tout l'historique, avec les seuils en cache."""
+    df = read_daily_metrics(db[DAILY_COLLECTION], [("A", None, None), ("B", None, None)])
+    events = detect_extreme_events(df, load_thresholds(db[THRESHOLDS_COLLECTION], ["A", "B"]))
+    return {(city, period.strftime("%Y-%m-%d")): event for city, period, event in zip(df["city"], df["period"], events)}
+
+def stored_events(db):
+    return {(document["city"], document["period"]): document["extreme_events"]
+            for document in db[DAILY_COLLECTION].documents.values()}
+
+def test_windowed_update_matches_full_recompute(mongo_db):
+    daily = mongo_db[DAILY_COLLECTION]
+    # Un jour froid coupe la vague de 31 jours (plus longue que CONTEXT_DAYS : la fenêtre est
+    # élargie), et de fortes pluies changent les cumuls 72 h autour de deux jours proches de B
+    daily.document("A", "2022-07-15")["metrics"]["temperature"]["max"] = 5.0
+    daily.document("B", "2021-03-03")["metrics"]["rainfall"]["total_rr3"] = 45
+    written = [("A", "2022-07-15"), ("B", "2021-03-03"), ("B", "2021-03-20")]
+    for city, period in written:
+        daily.document(city, period)["extreme_events"] = []
+
+    assert update_extreme_events(mongo_db, written) > 0
+    assert stored_events(mongo_db) == full_recompute(mongo_db)
+
+def test_heat_wave_crossing_the_window_edge_widens_it(mongo_db, monkeypatch):
+    reads = []
+    original = extreme_events.read_daily_metrics
+    monkeypatch.setattr(extreme_events, "read_daily_metrics", lambda collection, ranges: reads.append(ranges) or original(collection, ranges))
+
+    mongo_db[DAILY_COLLECTION].document("A", "2022-07-20")["metrics"]["temperature"]["max"] = 60.0
+    update_extreme_events(mongo_db, [("A", "2022-07-20")])
+
+    # Première lecture à CONTEXT_DAYS jours, puis au moins une lecture élargie
+    assert len(reads) >= 2
+    first, last = reads[0][0][1:], reads[-1][0][1:]
+    assert last[1] - last[0] > first[1] - first[0] == pd.Timedelta(days=2 * CONTEXT_DAYS)
+    assert stored_events(mongo_db) == full_recompute(mongo_db)